@@ -1,5 +1,34 @@
 __all__ = []
 
-from .interactor import Interactor
-from .gpt35 import GPT35
-from .coq_llm_prompt import CoqPromptKShot, CoqPromptKShotRandomEvalChoice
\ No newline at end of file
+import importlib
+
+# The public classes are imported on first use, so that importing 
+# the package (e.g. to run one of the scripts in it) does not load 
+# openai, asyncio or numpy unless they are needed
+_exports = {
+    "Interactor": ".interactor",
+    "RunOptions": ".interactor",
+    "GPT35": ".gpt35",
+    "RateLimiter": ".rate_limiter",
+    "CachedLLMInterface": ".cached_llm",
+    "AsyncGPT35": ".async_gpt35",
+    "MockLLM": ".mock_llm",
+    "AsyncMockLLM": ".mock_llm",
+    "MockLLMBackend": ".mock_llm",
+    "FakeOpenAIServer": ".fake_openai_server",
+    "CoqPromptKShot": ".coq_llm_prompt",
+    "CoqPromptKShotRandomEvalChoice": ".coq_llm_prompt",
+    "CoqPromptKShotRetrieval": ".coq_llm_prompt",
+}
+
+
+def __getattr__(name: str):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_exports.keys()))
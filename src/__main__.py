@@ -1,5 +1,7 @@
-from .interactor import Interactor
+from .interactor import Interactor, RunOptions
 from .gpt35 import GPT35
+from .cached_llm import CachedLLMInterface
+from .proof_check_cache import ProofCheckCache
 import dotenv
 from .coq_llm_prompt import CoqPromptKShot, CoqPromptKShotRandomEvalChoice
 import os 
@@ -23,16 +25,22 @@ root_dir = "coqpylspclient/tests/resources"
 #     'negation_fn_applied_twice', 'andb_eq_orb'
 # ]
 
-llm_prompt = CoqPromptKShot(coq_file, root_dir, [], ["test_thr", "test_thr1"])
+llm_prompt = CoqPromptKShot(
+    coq_file, root_dir, [], ["test_thr", "test_thr1"], 
+    proof_check_cache=ProofCheckCache()
+)
 # llm_prompt = CoqPromptKShotRandomEvalChoice(coq_file, root_dir, 0.3)
 # llm_prompt = CoqPromptKShot(coq_file, root_dir, ["fr_co", "loceq_co", "loceq_rmw"], ["loceq_rf"])
 
 dotenv.load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-llm_interface = GPT35(OPENAI_API_KEY)
+# Completions are cached on disk, so reruns with the 
+# same prompts do not spend any tokens
+llm_interface = CachedLLMInterface(GPT35(OPENAI_API_KEY))
 interactor = Interactor(llm_prompt, llm_interface)
 
-print(interactor.run(shots=15))
+print(interactor.run(RunOptions(shots=15)))
 
-llm_prompt.stop()
\ No newline at end of file
+llm_prompt.stop()
+llm_interface.close()
\ No newline at end of file
@@ -0,0 +1,128 @@
+from .async_llm_interface import AsyncLLMInterface
+from .llm_prompt_interface import LLMPromptInterface
+from .prompt_budget import TokenCounter
+from .prompt_payload import PromptPayloadCache
+from .rate_limiter import RateLimiter, get_rate_limiter, backoff_delay
+from .gpt35 import estimate_tokens, is_rate_limited, retry_after, is_retryable
+from typing import Any, List, Dict, Tuple, Optional, AsyncIterator
+import asyncio
+import logging
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("AsyncOpenaiCalls")
+
+
+class AsyncGPT35(AsyncLLMInterface):
+    def __init__(
+        self,
+        api_key: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        request_attempts: int = 6,
+        expected_completion_tokens: int = 256
+    ) -> None:
+        """
+        :param api_key: The key of the OpenAI API.
+        :param rate_limiter: Schedules the requests under the RPM and TPM limits.
+            By default the limiter shared by all the clients with this key,
+            the synchronous ones included, is used.
+        :param request_attempts: How many times a request is sent before giving up.
+        :param expected_completion_tokens: The completion length per choice
+            assumed before the real usage of a request is known.
+        """
+        self.history = []
+        self.model = "gpt-3.5-turbo-0301"
+        self.request_attemps = request_attempts
+        self.expected_completion_tokens = expected_completion_tokens
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter(api_key)
+        self.token_counter = TokenCounter(self.model)
+        self.payloads = PromptPayloadCache()
+        # Passed with every request, see GPT35
+        self.api_key = api_key
+
+    def init_history(self, llm_prompt: LLMPromptInterface) -> None:
+        prompt = llm_prompt.get_system_message()
+        message_history = llm_prompt.get_msg_history()
+
+        self.history.append( {"role": "system", "content": prompt} )
+        self.history.extend(message_history)
+
+    def __options(self, temperature: Optional[float]) -> Dict[str, Any]:
+        options: Dict[str, Any] = {"api_key": self.api_key}
+        # The API default is used unless a temperature is given
+        if temperature is not None:
+            options["temperature"] = temperature
+        return options
+
+    async def __acreate(
+        self, message: str, choices: int, 
+        history: Optional[List[Dict[str, str]]], 
+        temperature: Optional[float], 
+        stream: bool = False
+    ) -> Tuple[Any, int]:
+        """
+        Sends the request once the rate limiter lets it through, 
+        as GPT35 does. Failed requests are retried after a backoff 
+        (or after the time the server asked for in Retry-After). 
+        Returns the completion, or the stream, and the tokens 
+        the request was estimated to take.
+        """
+        import openai
+        payload = self.payloads.for_request(self.history, history)
+        estimated_tokens = estimate_tokens(
+            self.token_counter, payload, message, choices, self.expected_completion_tokens
+        )
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            # The limiter blocks, so it is waited for in a worker thread
+            await loop.run_in_executor(None, self.rate_limiter.acquire, estimated_tokens)
+            try:
+                completion = await openai.ChatCompletion.acreate(
+                    **self.__options(temperature),
+                    model=self.model, 
+                    messages=payload.request_messages(message),
+                    n=choices, 
+                    stream=stream
+                )
+                return completion, estimated_tokens
+            except Exception as e:
+                attempt += 1
+                delay = None
+                if is_rate_limited(e):
+                    delay = retry_after(e)
+                    self.rate_limiter.on_rate_limited(delay)
+                if attempt >= self.request_attemps or not is_retryable(e):
+                    raise e
+                logger.info(f"OpenAI API call failed with {e}. {self.request_attemps - attempt} attempts left.")
+                # With Retry-After the limiter already holds the request back
+                if delay is None:
+                    await asyncio.sleep(backoff_delay(attempt - 1))
+
+    async def send_message_wout_history_change(
+        self, message: str, choices: int = 1, 
+        history: Optional[List[Dict[str, str]]] = None, 
+        temperature: Optional[float] = None
+    ) -> List[str]:
+        completion, estimated_tokens = await self.__acreate(message, choices, history, temperature)
+        usage = completion.get("usage")
+        if usage is not None and "total_tokens" in usage:
+            self.rate_limiter.reconcile(estimated_tokens, usage["total_tokens"])
+        return [choice['message']['content'] for choice in completion["choices"]]
+
+    async def stream_message_wout_history_change(
+        self, message: str, choices: int = 1, 
+        history: Optional[List[Dict[str, str]]] = None, 
+        temperature: Optional[float] = None
+    ) -> AsyncIterator[Tuple[int, str]]:
+        # Only opening the stream is retried, it can not 
+        # be retried once choices have been yielded
+        stream, _ = await self.__acreate(message, choices, history, temperature, stream=True)
+        contents: Dict[int, List[str]] = {}
+        async for chunk in stream: 
+            for choice in chunk["choices"]: 
+                index = choice["index"]
+                delta = choice.get("delta", {})
+                contents.setdefault(index, []).append(delta.get("content", "") or "")
+                if choice.get("finish_reason") is not None: 
+                    yield index, "".join(contents.pop(index))
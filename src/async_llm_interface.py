@@ -0,0 +1,62 @@
+from typing import List, Dict, Tuple, Optional, AsyncIterator
+from .llm_prompt_interface import LLMPromptInterface
+
+class AsyncLLMInterface:
+    def __init__(self, api_key: str) -> None:
+        """
+        Constructs a new AsyncLLMInterface object, the asynchronous 
+        counterpart of LLMInterface. 
+
+        :param api_key: The API key for the LLM. 
+        """
+        pass 
+
+    def init_history(self, llm_prompt: LLMPromptInterface) -> None:
+        """
+        Initializes the message history of the LLM. 
+        This function should be called after the LLM is initialized. 
+
+        :param llm_prompt: The LLM prompt to use to initialize the message history. 
+        """
+        pass
+
+    async def send_message_wout_history_change(
+        self, message: str, choices: int = 1, 
+        history: Optional[List[Dict[str, str]]] = None, 
+        temperature: Optional[float] = None
+    ) -> List[str]: 
+        """
+        Sends a message to the LLM and returns the response once 
+        all the choices are complete. Garantees that the message 
+        history after the call remains the same as before the call.
+
+        :param message: The message to send to the LLM.
+        :param choices: The number of choices to return. Defaults to 1.
+        :param history: If given, is used instead of the message history 
+            for this request. The system message is kept.
+        :param temperature: The sampling temperature for this request. 
+            If None, the default of the LLM is used.
+        :return: A list of choices. 
+        """
+        pass
+
+    async def stream_message_wout_history_change(
+        self, message: str, choices: int = 1, 
+        history: Optional[List[Dict[str, str]]] = None, 
+        temperature: Optional[float] = None
+    ) -> AsyncIterator[Tuple[int, str]]: 
+        """
+        Sends a message to the LLM and yields each choice as soon 
+        as it is complete, so that it can be checked before the 
+        rest of the choices arrive. The choices may be yielded 
+        in any order. Does not change the message history.
+
+        :param message: The message to send to the LLM.
+        :param choices: The number of choices to return. Defaults to 1.
+        :param history: If given, is used instead of the message history 
+            for this request. The system message is kept.
+        :param temperature: The sampling temperature for this request. 
+            If None, the default of the LLM is used.
+        :return: An async iterator over pairs (choice index, choice). 
+        """
+        pass
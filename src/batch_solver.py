@@ -0,0 +1,383 @@
+from .llm_interface import LLMInterface
+from .coq_llm_prompt import CoqPromptKShot, KSHOT_SYSTEM_MESSAGE
+from .prompt_budget import split_admitted_theorems, TokenCounter
+from .parsed_file_cache import load_theorems, file_key, CACHE_DIR_NAME
+from .coq_file_contents import CoqFileContents
+from .run_journal import RunJournal
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from collections import OrderedDict
+import threading
+import logging
+import shutil
+import queue
+import json
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("BatchSolver")
+
+
+class BatchTask:
+    def __init__(self, coq_file: str, theorem_name: str, thr_id: int, cost: int) -> None:
+        # The statement is looked up in the file's TheoremStore
+        # when the task is solved
+        self.coq_file = coq_file
+        self.theorem_name = theorem_name
+        self.thr_id = thr_id
+        self.cost = cost
+
+    def __lt__(self, other: "BatchTask") -> bool:
+        return (self.cost, self.coq_file, self.theorem_name) < (other.cost, other.coq_file, other.theorem_name)
+
+
+class BatchFile:
+    def __init__(
+        self,
+        coq_file: str,
+        root_dir: str,
+        llm_interface: LLMInterface,
+        token_limit: int,
+        token_counter: TokenCounter
+    ) -> None:
+        """
+        Everything the batch keeps for a single file: the prompt
+        with the admitted theorems as test theorems and the most
+        relevant solved ones as train theorems, the LLM client
+        with the history of that prompt, and a lock that makes
+        the file's ProofView check one theorem at a time.
+        The ProofView used for parsing is stopped, the batch
+        starts it again when the file has a proof to check.
+        """
+        self.coq_file = coq_file
+        self.key = file_key(coq_file, root_dir)
+        theorems, proof_view = load_theorems(coq_file, root_dir)
+        admitted, train = split_admitted_theorems(
+            theorems, token_limit, KSHOT_SYSTEM_MESSAGE, token_counter=token_counter
+        )
+        self.admitted = admitted
+        self.llm_prompt = CoqPromptKShot(coq_file, root_dir, train, admitted, proof_view=proof_view)
+        self.llm_prompt.release_proof_view()
+        self.llm_interface = llm_interface
+        self.llm_interface.init_history(self.llm_prompt)
+        self.check_lock = threading.Lock()
+        # Set by the solver, under its lock
+        self.remaining_tasks = 0
+        self.checking = False
+
+
+class BatchSolver:
+    def __init__(
+        self,
+        root_dir: str,
+        llm_interface_factory: Callable[[], LLMInterface],
+        shots: int = 5,
+        max_llm_requests: int = 4,
+        max_proof_checkers: int = 2,
+        token_limit: int = 4096,
+        journal_path: Optional[str] = None
+    ) -> None:
+        """
+        Solves every admitted theorem in every .v file under the
+        project root. All theorems go to one global queue, the
+        cheapest (shortest statement) first. At most
+        `max_llm_requests` LLM requests and `max_proof_checkers`
+        proof checks are in flight at any moment, and at most
+        `max_proof_checkers` coq-lsp processes are alive: before
+        a file's ProofView is started, the least recently used
+        idle one is stopped. Every finished theorem is recorded
+        in a journal, so an interrupted run resumes where it
+        stopped. Theorems that ended with an exception (the LLM
+        API or coq-lsp failing) are not recorded and are tried
+        again by the next run.
+
+        :param root_dir: The project root with the _CoqProject.
+        :param llm_interface_factory: Makes a new LLM client, one is used per file.
+        :param shots: The number of proofs asked for every theorem.
+        :param max_llm_requests: The bound on concurrent LLM requests.
+        :param max_proof_checkers: The bound on concurrent proof checks and coq-lsp processes.
+        :param token_limit: The token limit of the LLM, used to pick train theorems.
+        :param journal_path: Where to keep the journal. Defaults to the project cache folder.
+        """
+        self.root_dir = root_dir
+        self.llm_interface_factory = llm_interface_factory
+        self.shots = shots
+        self.max_llm_requests = max_llm_requests
+        self.max_proof_checkers = max_proof_checkers
+        self.token_limit = token_limit
+        self.token_counter = TokenCounter()
+        self.journal = RunJournal(
+            journal_path if journal_path is not None
+            else os.path.join(root_dir, CACHE_DIR_NAME, "batch_journal.jsonl")
+        )
+        self.files: Dict[str, BatchFile] = {}
+        self.__llm_slots = threading.Semaphore(max_llm_requests)
+        self.__checker_slots = threading.Semaphore(max_proof_checkers)
+        # Files with a started ProofView, least recently used first
+        self.__live_views: "OrderedDict[str, BatchFile]" = OrderedDict()
+        self.__views_lock = threading.Lock()
+
+    def find_coq_files(self) -> List[str]:
+        coq_files = []
+        for directory, subdirectories, file_names in os.walk(self.root_dir):
+            subdirectories[:] = sorted(d for d in subdirectories if not d.startswith("."))
+            for file_name in sorted(file_names):
+                if file_name.endswith(".v"):
+                    coq_files.append(os.path.join(directory, file_name))
+        return coq_files
+
+    def __relative(self, coq_file: str) -> str:
+        return os.path.relpath(coq_file, self.root_dir)
+
+    def finished_results(self) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """
+        Returns the journal entries that are still valid, i.e.
+        made for the current contents of their files.
+        """
+        current_keys: Dict[str, Optional[str]] = {}
+        results = {}
+        for entry in self.journal.entries():
+            coq_file = os.path.join(self.root_dir, entry["file"])
+            if coq_file not in current_keys:
+                current_keys[coq_file] = (
+                    file_key(coq_file, self.root_dir) if os.path.exists(coq_file) else None
+                )
+            if entry["key"] == current_keys[coq_file]:
+                results[(entry["file"], entry["theorem"])] = entry
+        return results
+
+    def find_tasks(self) -> List[BatchTask]:
+        finished = self.finished_results()
+        tasks = []
+        for coq_file in self.find_coq_files():
+            try:
+                batch_file = BatchFile(
+                    coq_file, self.root_dir, self.llm_interface_factory(),
+                    self.token_limit, self.token_counter
+                )
+            except Exception as e:
+                logger.info(f"Skipping {coq_file}: {e}")
+                continue
+            if len(batch_file.admitted) == 0:
+                batch_file.llm_prompt.stop()
+                continue
+            self.files[coq_file] = batch_file
+            theorem_store = batch_file.llm_prompt.theorem_store
+            for thr_id in batch_file.llm_prompt.eval_ids:
+                theorem_name = theorem_store.name(thr_id)
+                if (self.__relative(coq_file), theorem_name) in finished:
+                    continue
+                batch_file.remaining_tasks += 1
+                tasks.append(BatchTask(
+                    coq_file, theorem_name, thr_id,
+                    self.token_counter.count(theorem_store.statement(thr_id))
+                ))
+        return sorted(tasks)
+
+    def __start_checking(self, batch_file: BatchFile) -> None:
+        """
+        Marks the file's ProofView as used by a check, making
+        room for it first. Called with a checker slot held, so
+        when the limit is reached some live ProofView is idle.
+        """
+        with self.__views_lock:
+            batch_file.checking = True
+            if batch_file.coq_file in self.__live_views:
+                self.__live_views.move_to_end(batch_file.coq_file)
+                return
+            while len(self.__live_views) >= self.max_proof_checkers:
+                idle = next(
+                    other for other in self.__live_views.values() if not other.checking
+                )
+                del self.__live_views[idle.coq_file]
+                idle.llm_prompt.release_proof_view()
+            self.__live_views[batch_file.coq_file] = batch_file
+
+    def __finish_task(self, batch_file: BatchFile, checked: bool) -> None:
+        with self.__views_lock:
+            if checked:
+                batch_file.checking = False
+            batch_file.remaining_tasks -= 1
+            if batch_file.remaining_tasks == 0 and batch_file.coq_file in self.__live_views:
+                # Nothing is left to check in the file
+                del self.__live_views[batch_file.coq_file]
+                batch_file.llm_prompt.release_proof_view()
+
+    def __solve(self, task: BatchTask) -> Dict[str, Any]:
+        """
+        Returns the journal entry of the task. Its "retryable"
+        field is set if the task ended with an exception.
+        """
+        batch_file = self.files[task.coq_file]
+        entry: Dict[str, Any] = {
+            "file": self.__relative(task.coq_file), "key": batch_file.key,
+            "theorem": task.theorem_name, "solved": False, "proof": None, "error": None
+        }
+        checked = False
+        statement = batch_file.llm_prompt.theorem_store.statement(task.thr_id)
+        try:
+            with self.__llm_slots:
+                proofs = batch_file.llm_interface.send_message_wout_history_change(
+                    message=statement, choices=self.shots,
+                    history=batch_file.llm_prompt.get_msg_history_for_theorem(statement)
+                )
+            with self.__checker_slots, batch_file.check_lock:
+                self.__start_checking(batch_file)
+                checked = True
+                try:
+                    results = batch_file.llm_prompt.verify_proofs_until_success(statement, proofs)
+                finally:
+                    self.__finish_task(batch_file, checked=True)
+            for proof, check_result in zip(proofs, results):
+                if check_result is not None and check_result[0]:
+                    entry["solved"] = True
+                    entry["proof"] = proof
+                    break
+            else:
+                errors = [check_result[1] for check_result in results if check_result is not None]
+                entry["error"] = errors[0] if len(errors) > 0 else None
+        except Exception as e:
+            entry["error"] = f"{e.__class__.__name__}: {e}"
+            entry["retryable"] = True
+        if not checked:
+            self.__finish_task(batch_file, checked=False)
+        return entry
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Solves all the admitted theorems that are not in the
+        journal yet and returns the summary of the whole batch,
+        including the results of the previous interrupted runs.
+        """
+        start_time = time.time()
+        tasks = self.find_tasks()
+        logger.info(f"{len(tasks)} admitted theorems to solve in {len(self.files)} files")
+
+        work_queue: "queue.PriorityQueue[BatchTask]" = queue.PriorityQueue()
+        for task in tasks:
+            work_queue.put(task)
+        # Entries that ended with an exception, reported
+        # but not journaled, so that they are retried
+        failed: List[Dict[str, Any]] = []
+
+        def worker() -> None:
+            while True:
+                try:
+                    task = work_queue.get_nowait()
+                except queue.Empty:
+                    return
+                entry = self.__solve(task)
+                if entry.get("retryable", False):
+                    failed.append(entry)
+                    logger.info(f"{entry['theorem']} from {entry['file']}: failed, {entry['error']}")
+                    continue
+                self.journal.record(entry)
+                logger.info(
+                    f"{entry['theorem']} from {entry['file']}: "
+                    f"{'solved' if entry['solved'] else 'not solved'}"
+                )
+
+        # Enough workers to keep both kinds of slots busy
+        workers = [
+            threading.Thread(target=worker, daemon=True)
+            for _ in range(min(len(tasks), self.max_llm_requests + self.max_proof_checkers))
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        results = list(self.finished_results().values()) + failed
+        task_keys = {(self.__relative(task.coq_file), task.theorem_name) for task in tasks}
+        return {
+            "root_dir": self.root_dir,
+            "solved": sum(1 for entry in results if entry["solved"]),
+            "not_solved": sum(1 for entry in results if not entry["solved"]),
+            "solved_in_this_run": sum(
+                1 for entry in results if entry["solved"] and
+                (entry["file"], entry["theorem"]) in task_keys
+            ),
+            "elapsed_seconds": time.time() - start_time,
+            "theorems": sorted(
+                [{"file": entry["file"], "theorem": entry["theorem"],
+                  "solved": entry["solved"], "error": entry["error"]} for entry in results],
+                key=lambda entry: (entry["file"], entry["theorem"])
+            ),
+        }
+
+    def __copy_project(self, output_dir: str) -> None:
+        """
+        Copies the project tree to `output_dir`, without the
+        cache folder and without `output_dir` itself if it is
+        inside the project.
+        """
+        output_dir = os.path.abspath(output_dir)
+
+        def ignore(directory: str, names: List[str]) -> List[str]:
+            return [
+                name for name in names if name == CACHE_DIR_NAME
+                or os.path.abspath(os.path.join(directory, name)) == output_dir
+            ]
+
+        shutil.copytree(self.root_dir, output_dir, ignore=ignore, dirs_exist_ok=True)
+
+    def write_patched_files(self, output_dir: Optional[str] = None) -> List[str]:
+        """
+        Writes the files with the Admitted proofs replaced by the
+        found ones. With no `output_dir` the files are patched in
+        place, and the journal entries of a patched file are
+        recorded again with its new key, so that they stay valid.
+        Otherwise the whole project is copied to `output_dir` and
+        the copy is patched. Returns the paths of the written files.
+        """
+        entries: Dict[str, List[Dict[str, Any]]] = {}
+        solved: Dict[str, Dict[str, str]] = {}
+        for entry in self.finished_results().values():
+            entries.setdefault(entry["file"], []).append(entry)
+            if entry["solved"]:
+                solved.setdefault(entry["file"], {})[entry["theorem"]] = entry["proof"]
+
+        if output_dir is not None:
+            self.__copy_project(output_dir)
+        written = []
+        for relative_path, proofs in sorted(solved.items()):
+            coq_file = os.path.join(self.root_dir, relative_path)
+            theorems, proof_view = load_theorems(coq_file, self.root_dir)
+            if proof_view is not None:
+                proof_view.exit()
+            contents = CoqFileContents(coq_file)
+            text = contents.text
+            replacements = []
+            for theorem in theorems:
+                if theorem.name in proofs and theorem.proof is not None:
+                    start = contents.offset(theorem.statement_range.end)
+                    end = contents.offset(theorem.proof.end_pos.end)
+                    replacements.append((start, end, "\n" + proofs[theorem.name]))
+
+            pieces = []
+            last_end = 0
+            for start, end, replacement in sorted(replacements):
+                pieces.append(text[last_end:start])
+                pieces.append(replacement)
+                last_end = end
+            pieces.append(text[last_end:])
+
+            output_path = coq_file if output_dir is None else os.path.join(output_dir, relative_path)
+            with open(output_path, "w") as f:
+                f.write("".join(pieces))
+            written.append(output_path)
+            if output_dir is None:
+                new_key = file_key(coq_file, self.root_dir)
+                for entry in entries[relative_path]:
+                    self.journal.record(dict(entry, key=new_key))
+        return written
+
+    def stop(self) -> None:
+        for batch_file in self.files.values():
+            batch_file.llm_prompt.stop()
+
+    @staticmethod
+    def write_report(summary: Dict[str, Any], path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=4)
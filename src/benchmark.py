@@ -0,0 +1,275 @@
+from .interactor import Interactor, RunOptions
+from .coq_llm_prompt import CoqPromptKShot
+from .replay_llm import ReplayLLM
+from .parsed_file_cache import load_theorems
+from . import metrics_report
+from typing import Any, Dict, List, Tuple
+import multiprocessing
+import subprocess
+import statistics
+import tempfile
+import resource
+import logging
+import shutil
+import json
+import time
+import sys
+import os
+
+"""
+Offline benchmark of the whole Interactor pipeline over the
+Software Foundations files in resources/. Completions come from
+ReplayLLM with the recordings in resources/sf_replay.json, so
+every run asks coq-lsp to check the same candidates:
+
+    python3 -m src.benchmark <report.json> [<baseline.json>]
+
+Every mode runs in a fresh process on a fresh copy of the files,
+so each one pays the full startup (starting coq-lsp and parsing
+the files) and has its own peak RSS. For every mode the report
+has the theorems per second, the verification time per
+candidate, the startup time and the peak RSS of the process
+and of its coq-lsp children.
+
+The cold start of the editor scripts is tracked too: the modules
+run_coqpilot.py imports are imported in a fresh interpreter with
+`python -X importtime`, and the time must stay within the budget
+with none of the heavy dependencies (openai, plotly, numpy) loaded.
+
+Given a baseline report, the metrics that got worse by more than
+20% are listed and the exit code is 1, as it is when the import
+budget is exceeded.
+"""
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("Benchmark")
+
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources")
+BENCHMARK_FILES = ["sf_train.v", "sf_test.v"]
+RECORDINGS_FILE = "sf_replay.json"
+SHOTS = 4
+REGRESSION_THRESHOLD = 0.2
+
+# The modules run_coqpilot.py imports, and the ones they should not pull in
+STARTUP_MODULES = ["interactor", "gpt35", "coq_llm_prompt", "eval_logger"]
+HEAVY_MODULES = ["openai", "aiohttp", "plotly", "numpy", "dotenv"]
+IMPORT_TIME_BUDGET_MS = 150.0
+IMPORT_TIME_RUNS = 5
+
+MODES: Dict[str, Dict[str, Any]] = {
+    "serial": {"concurrency": 1, "proof_view_workers": 1, "early_exit": False},
+    "parallel": {"concurrency": 4, "proof_view_workers": 4, "early_exit": False},
+    "parallel_early_exit": {"concurrency": 4, "proof_view_workers": 4, "early_exit": True},
+}
+
+# Metric, whether a higher value is better
+COMPARED_METRICS: List[Tuple[str, bool]] = [
+    ("theorems_per_second", True),
+    ("verification_seconds_per_candidate_p50", False),
+    ("startup_seconds", False),
+    ("peak_rss_mb", False),
+]
+
+
+def peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_mode(mode: str) -> Dict[str, Any]:
+    """
+    Runs the pipeline over all the benchmark files in the given
+    mode. Meant to be run in a fresh process.
+    """
+    settings = MODES[mode]
+    work_dir = tempfile.mkdtemp(prefix=f"coq_llm_benchmark_{mode}_")
+    try:
+        for file_name in BENCHMARK_FILES + [RECORDINGS_FILE]:
+            shutil.copy(os.path.join(RESOURCES_DIR, file_name), work_dir)
+        recordings_path = os.path.join(work_dir, RECORDINGS_FILE)
+        metrics_path = os.path.join(work_dir, "metrics.jsonl")
+        llm_interface = ReplayLLM(recordings_path)
+
+        startup_seconds = 0.0
+        run_seconds = 0.0
+        for file_name in BENCHMARK_FILES:
+            coq_file = os.path.join(work_dir, file_name)
+            start_time = time.perf_counter()
+            theorems, proof_view = load_theorems(coq_file, work_dir)
+            test_theorems = [
+                theorem.name for theorem in theorems
+                if theorem.proof is not None and theorem.name in llm_interface.recordings
+            ]
+            llm_prompt = CoqPromptKShot(
+                coq_file, work_dir, [], test_theorems, proof_view=proof_view,
+                proof_view_workers=settings["proof_view_workers"]
+            )
+            startup_seconds += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            interactor = Interactor(llm_prompt, llm_interface, is_silent=True)
+            interactor.run(RunOptions(
+                shots=SHOTS, concurrency=settings["concurrency"],
+                early_exit=settings["early_exit"], metrics_path=metrics_path
+            ))
+            run_seconds += time.perf_counter() - start_time
+            llm_prompt.stop()
+
+        summary = metrics_report.summarize(metrics_report.load_events(metrics_path))
+        return {
+            "mode": mode,
+            "settings": settings,
+            "theorems": summary["theorems"],
+            "solved": summary["solved"],
+            "candidates": summary["verification_seconds_per_candidate"]["count"],
+            "startup_seconds": startup_seconds,
+            "run_seconds": run_seconds,
+            "theorems_per_second": summary["theorems"] / run_seconds if run_seconds > 0 else None,
+            "verification_seconds_per_candidate_p50": summary["verification_seconds_per_candidate"]["p50"],
+            "verification_seconds_per_candidate_p95": summary["verification_seconds_per_candidate"]["p95"],
+            "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+            "peak_children_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def measure_import_time() -> Dict[str, Any]:
+    """
+    Imports STARTUP_MODULES in fresh interpreters with -X importtime. 
+    Returns the median time the package took to import, the modules 
+    that took the longest themselves and the heavy modules that got 
+    loaded.
+    """
+    top_package = __package__.split(".")[0]
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    statement = (
+        "import sys; " 
+        + "; ".join(f"import {__package__}.{module}" for module in STARTUP_MODULES) 
+        + f"; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+
+    totals, slowest, heavy_modules = [], [], []
+    for _ in range(IMPORT_TIME_RUNS):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", statement], 
+            cwd=os.path.dirname(package_dir), capture_output=True, text=True, check=True
+        )
+        total_us = 0
+        self_times = []
+        for line in completed.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            if not self_us.strip().isdigit():
+                continue
+            module = name.strip()
+            # Only the top level imports are summed, the rest are nested in them
+            if name.startswith(" ") and not name.startswith("  ") and module.split(".")[0] == top_package:
+                total_us += int(cumulative_us)
+            self_times.append((int(self_us), module))
+        totals.append(total_us / 1000)
+        slowest = [module for _, module in sorted(self_times, reverse=True)[:5]]
+        heavy_modules = completed.stdout.split()
+
+    return {
+        "import_ms": statistics.median(totals),
+        "import_budget_ms": IMPORT_TIME_BUDGET_MS,
+        "slowest_modules": slowest,
+        "heavy_modules_loaded": heavy_modules,
+    }
+
+
+def run_benchmark() -> Dict[str, Any]:
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for mode in MODES:
+        logger.info(f"Running the benchmark in the {mode} mode")
+        with context.Pool(1) as pool:
+            results[mode] = pool.apply(run_mode, (mode,))
+    return {
+        "shots": SHOTS, "files": BENCHMARK_FILES, 
+        "startup": measure_import_time(), "modes": results
+    }
+
+
+def check_startup_budget(report: Dict[str, Any]) -> List[str]:
+    startup = report["startup"]
+    problems = []
+    if startup["import_ms"] > startup["import_budget_ms"]:
+        problems.append(
+            f"startup: importing the editor script modules took {startup['import_ms']:.1f} ms, "
+            f"over the budget of {startup['import_budget_ms']:.0f} ms"
+        )
+    if len(startup["heavy_modules_loaded"]) > 0:
+        problems.append(f"startup: {', '.join(startup['heavy_modules_loaded'])} imported eagerly")
+    return problems
+
+
+def find_regressions(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    regressions = []
+    old_import, new_import = baseline.get("startup", {}).get("import_ms"), report["startup"]["import_ms"]
+    if old_import and (new_import - old_import) / old_import > REGRESSION_THRESHOLD:
+        regressions.append(f"startup: import_ms {old_import:.1f} -> {new_import:.1f}")
+    for mode, result in report["modes"].items():
+        previous = baseline.get("modes", {}).get(mode)
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > REGRESSION_THRESHOLD:
+                regressions.append(f"{mode}: {metric} {old:.4f} -> {new:.4f} ({change:+.0%})")
+    return regressions
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    def number(value: Any) -> str:
+        return "-" if value is None else f"{value:.3f}"
+
+    lines = [
+        f"{'mode':<22}{'thr/s':>9}{'verify/cand p50':>17}{'startup s':>11}"
+        f"{'peak RSS MB':>13}{'coq-lsp MB':>12}{'solved':>9}"
+    ]
+    for mode, result in report["modes"].items():
+        lines.append(
+            f"{mode:<22}{number(result['theorems_per_second']):>9}"
+            f"{number(result['verification_seconds_per_candidate_p50']):>17}"
+            f"{number(result['startup_seconds']):>11}{number(result['peak_rss_mb']):>13}"
+            f"{number(result['peak_children_rss_mb']):>12}"
+            f"{str(result['solved']) + '/' + str(result['theorems']):>9}"
+        )
+    startup = report["startup"]
+    lines += [
+        "",
+        f"Import of the editor script modules: {startup['import_ms']:.1f} ms "
+        f"(budget {startup['import_budget_ms']:.0f} ms), slowest: {', '.join(startup['slowest_modules'])}",
+    ]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    """
+    Path to write the report to and, optionally, the path
+    to a previous report to compare with.
+    """
+    report_path: str = sys.argv[1]
+    baseline_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    report = run_benchmark()
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=4)
+    print(format_report(report))
+
+    problems = check_startup_budget(report)
+    if baseline_path is not None:
+        with open(baseline_path, "r") as f:
+            problems += find_regressions(report, json.load(f))
+    if len(problems) > 0:
+        print("Regressions:")
+        print("\n".join(problems))
+        sys.exit(1)
+    print("No regressions.")
@@ -0,0 +1,109 @@
+from .llm_interface import LLMInterface
+from .llm_prompt_interface import LLMPromptInterface
+from .disk_cache import DiskCache
+from .prompt_payload import PromptPayloadCache
+from typing import List, Dict, Optional
+import threading
+import logging
+import json
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("CachedLLMInterface")
+
+
+class CachedLLMInterface(LLMInterface):
+    def __init__(
+        self,
+        llm_interface: LLMInterface,
+        cache: Optional[DiskCache] = None,
+        cache_path: str = os.path.join("cache", "llm_completions.sqlite")
+    ) -> None:
+        """
+        Wraps any LLMInterface with a persistent completion cache.
+        Completions are stored under the hash of the model name,
+        the system message, the message history and the message.
+        The amount of choices is stored along with them: a request
+        for m choices is served from the cache if at least m
+        choices were stored for the same prompt, otherwise the
+        wrapped LLM is asked and the entry is replaced. After
+        `refresh_next_request` the next request from the thread
+        skips the lookup and replaces the entry too.
+
+        :param llm_interface: The LLM to send the requests to on a cache miss.
+        :param cache: The cache to use. If None, a DiskCache at `cache_path` is opened.
+        :param cache_path: Path to the cache database.
+        """
+        self.llm_interface = llm_interface
+        self.cache = cache if cache is not None else DiskCache(cache_path)
+        self.model = getattr(llm_interface, "model", llm_interface.__class__.__name__)
+        self.history: List[Dict[str, str]] = []
+        self.payloads = PromptPayloadCache()
+        self.hits = 0
+        self.misses = 0
+        # Requests come from the pipelined fetch threads too
+        self.__counters_lock = threading.Lock()
+        self.__last_request = threading.local()
+
+    def init_history(self, llm_prompt: LLMPromptInterface) -> None:
+        self.llm_interface.init_history(llm_prompt)
+        self.history.append({"role": "system", "content": llm_prompt.get_system_message()})
+        self.history.extend(llm_prompt.get_msg_history())
+
+    def __cache_key(
+        self, message: str, 
+        history: Optional[List[Dict[str, str]]], 
+        temperature: Optional[float]
+    ) -> str:
+        # The hash of the sorted JSON of {"model", "history", "message"}, 
+        # with the history serialized once per payload
+        fields = {"model": self.model}
+        # Requests at the default temperature keep their old keys
+        if temperature is not None: 
+            fields["temperature"] = temperature
+        return self.payloads.for_request(self.history, history).request_key(message, **fields)
+
+    def send_message_for_response(self, message: str, choices: int = 1) -> List[str]:
+        responses = self.llm_interface.send_message_for_response(message, choices=choices)
+        self.history.append({"role": "user", "content": message})
+        self.history.append({"role": "assistant", "content": responses[0]})
+        return responses
+
+    def send_message_wout_history_change(
+        self, message: str, choices: int = 1, 
+        history: Optional[List[Dict[str, str]]] = None, 
+        temperature: Optional[float] = None
+    ) -> List[str]:
+        key = self.__cache_key(message, history, temperature)
+        refresh = getattr(self.__last_request, "refresh", False)
+        self.__last_request.refresh = False
+        cached = self.cache.get(key) if not refresh else None
+        if cached is not None:
+            cached_choices: List[str] = json.loads(cached)["choices"]
+            if len(cached_choices) >= choices:
+                with self.__counters_lock:
+                    self.hits += 1
+                self.__last_request.cached = True
+                return cached_choices[:choices]
+
+        with self.__counters_lock:
+            self.misses += 1
+        self.__last_request.cached = False
+        responses = self.llm_interface.send_message_wout_history_change(
+            message, choices=choices, history=history, temperature=temperature
+        )
+        self.cache.put(key, json.dumps({"n": len(responses), "choices": responses}, ensure_ascii=False))
+        return responses
+
+    def last_request_cached(self) -> bool:
+        return getattr(self.__last_request, "cached", False)
+
+    def refresh_next_request(self) -> None:
+        self.__last_request.refresh = True
+
+    def close(self) -> None:
+        with self.__counters_lock:
+            hits, misses = self.hits, self.misses
+        logger.info(f"Completion cache: {hits} hits, {misses} misses; {self.cache.stats()}")
+        self.cache.close()
@@ -0,0 +1,86 @@
+from typing import List, Tuple
+from .parsed_file_cache import IndexedTheorem
+from .coq_file_contents import CoqFileContents
+import bisect
+
+
+class ContextCheckpoints:
+    def __init__(self, file_contents: CoqFileContents, theorems: List[IndexedTheorem]) -> None:
+        """
+        Builds, in a single pass over the file, a checked-once
+        version of it in which the proof of every theorem closed
+        with Qed. is replaced by Admitted. The environment after
+        such a theorem stays the same, as the proof is opaque
+        anyway, but Coq no longer has to re-elaborate it.
+        The context of a theorem is then a slice of this text
+        up to the theorem (its checkpoint), so checking a
+        candidate costs the statements above it and the
+        candidate itself, instead of every proof above it.
+        As consecutive checkpoints share their prefixes,
+        coq-lsp reuses the already elaborated sentences.
+
+        :param file_contents: The contents of the file.
+        :param theorems: The theorems of the file, from load_theorems.
+        """
+        text = file_contents.text
+
+        replacements: List[Tuple[int, int, str]] = []
+        for theorem in theorems:
+            if theorem.proof is None or theorem.proof.is_incomplete:
+                continue
+            start = file_contents.offset(theorem.statement_range.end)
+            end = file_contents.offset(theorem.proof.end_pos.end)
+            if not text[start:end].rstrip().endswith("Qed."):
+                continue
+            replacements.append((start, end, " Admitted."))
+        replacements.sort()
+
+        pieces: List[str] = []
+        self.__orig_starts: List[int] = []
+        self.__orig_ends: List[int] = []
+        self.__abridged_starts: List[int] = []
+        # Shift of the abridged text relative to the original one
+        # after each replacement
+        self.__shifts: List[int] = []
+        last_end, shift, abridged_length = 0, 0, 0
+        for start, end, replacement in replacements:
+            if start < last_end:
+                continue
+            pieces.append(text[last_end:start])
+            abridged_length += start - last_end
+            self.__orig_starts.append(start)
+            self.__orig_ends.append(end)
+            self.__abridged_starts.append(abridged_length)
+            pieces.append(replacement)
+            abridged_length += len(replacement)
+            shift += len(replacement) - (end - start)
+            self.__shifts.append(shift)
+            last_end = end
+        pieces.append(text[last_end:])
+        self.__original_text = text
+        self.__line_ends = [i for i, char in enumerate(text) if char == "\n"]
+        self.__abridged_text = "".join(pieces)
+
+    def checkpoint(self, line_index: int) -> str:
+        """
+        Returns the abridged text preceding the line, the
+        counterpart of CoqFileContents.prefix(line_index).
+        Offsets refer to the file as it was when the
+        checkpoints were built.
+        """
+        if line_index <= 0:
+            return ""
+        if line_index > len(self.__line_ends):
+            cut = len(self.__original_text)
+        else:
+            cut = self.__line_ends[line_index - 1]
+
+        # Replacements that end before the cut
+        replaced = bisect.bisect_right(self.__orig_ends, cut)
+        shift = self.__shifts[replaced - 1] if replaced > 0 else 0
+        if replaced < len(self.__orig_starts) and self.__orig_starts[replaced] < cut:
+            # The cut is in the middle of a proof, keep its original text
+            straddling_start = self.__orig_starts[replaced]
+            return (self.__abridged_text[:self.__abridged_starts[replaced]] +
+                    self.__original_text[straddling_start:cut])
+        return self.__abridged_text[:cut + shift]
@@ -0,0 +1,107 @@
+from typing import Dict, List
+from ..coqpylspclient import Position
+import threading
+import os
+
+
+class CoqFileContents:
+    def __init__(self, path: str) -> None:
+        """
+        The text of a file loaded once together with the offsets
+        of the beginnings of its lines, so that any prefix or
+        range of the file is a single slice. The file is read
+        again only when its modification time changes.
+
+        :param path: Path to the file.
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__mtime = None
+        self.__text = ""
+        self.__line_offsets: List[int] = [0]
+        self.__load()
+
+    def __load(self) -> None:
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, "r") as f:
+            text = f.read()
+        line_offsets = [0]
+        newline = text.find("\n")
+        while newline != -1:
+            line_offsets.append(newline + 1)
+            newline = text.find("\n", newline + 1)
+
+        self.__text = text
+        self.__line_offsets = line_offsets
+        self.__mtime = mtime
+
+    def __refresh(self) -> None:
+        with self.__lock:
+            if os.stat(self.path).st_mtime_ns != self.__mtime:
+                self.__load()
+
+    @property
+    def text(self) -> str:
+        self.__refresh()
+        return self.__text
+
+    def line_count(self) -> int:
+        self.__refresh()
+        return len(self.__line_offsets)
+
+    def line(self, line_index: int) -> str:
+        self.__refresh()
+        start = self.__line_offsets[line_index]
+        if line_index + 1 < len(self.__line_offsets):
+            return self.__text[start:self.__line_offsets[line_index + 1] - 1]
+        return self.__text[start:]
+
+    def offset(self, position: Position) -> int:
+        """
+        Converts a position to an offset in the text. The character
+        is clipped to the length of the line, as slicing a line does.
+        """
+        self.__refresh()
+        line_start = self.__line_offsets[position.line]
+        if position.line + 1 < len(self.__line_offsets):
+            line_end = self.__line_offsets[position.line + 1] - 1
+        else:
+            line_end = len(self.__text)
+        return min(line_start + position.character, line_end)
+
+    def end_position(self) -> Position:
+        self.__refresh()
+        last_line = len(self.__line_offsets) - 1
+        return Position(last_line, len(self.__text) - self.__line_offsets[last_line])
+
+    def prefix(self, line_index: int) -> str:
+        """
+        Returns the first `line_index` lines of the file joined
+        with line breaks, i.e. the text preceding the line.
+        """
+        self.__refresh()
+        if line_index <= 0:
+            return ""
+        if line_index >= len(self.__line_offsets):
+            return self.__text
+        return self.__text[:self.__line_offsets[line_index] - 1]
+
+    def text_in_range(self, start: Position, end: Position) -> str:
+        self.__refresh()
+        return self.__text[self.offset(start):self.offset(end)]
+
+
+_shared_contents: Dict[str, CoqFileContents] = {}
+_shared_contents_lock = threading.Lock()
+
+
+def get_coq_file_contents(path: str) -> CoqFileContents:
+    """
+    Returns the CoqFileContents shared by everyone
+    working with the file at the given path.
+    """
+    key = os.path.abspath(path)
+    with _shared_contents_lock:
+        if key not in _shared_contents:
+            _shared_contents[key] = CoqFileContents(path)
+        return _shared_contents[key]
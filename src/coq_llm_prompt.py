@@ -1,16 +1,22 @@
 from .llm_prompt_interface import LLMPromptInterface, ProofView
 from typing import List, Dict, Optional, Tuple
 from ..coqpylspclient.coqlspclient.progress_bar import ProgressBar
+from .prompt_budget import TokenCounter, select_train_theorems, identifier_relevance
+from .parsed_file_cache import load_theorems, IndexedTheorem
 import random
 
+# Also counted by split_admitted_theorems, which picks the 
+# train theorems for the k-shot prompts
+KSHOT_SYSTEM_MESSAGE = ('Generate proof of the theorem from user input in Coq. '
+                        'You should only generate proofs in Coq.'
+                        'Never add special comments to the proof.'
+                        'Your answer should be a valid Coq proof.'
+                        'It should start with "Proof." and end with "Qed.".'
+                       )
+
 class CoqPromptBasic(LLMPromptInterface): 
     def get_system_message(self) -> str: 
-        return ('Generate proof of the theorem from user input in Coq. '
-                'You should only generate proofs in Coq.'
-                'Never add special comments to the proof.'
-                'Your answer should be a valid Coq proof.'
-                'It should start with "Proof." and end with "Qed.".'
-               )
+        return KSHOT_SYSTEM_MESSAGE
 
     def get_msg_history(self) -> List[Dict[str, str]]:
         return []
@@ -20,27 +26,24 @@ class CoqPromptBasic(LLMPromptInterface):
 
 class CoqPromptKShot(LLMPromptInterface): 
     def get_system_message(self) -> str: 
-        return ('Generate proof of the theorem from user input in Coq. '
-                'You should only generate proofs in Coq.'
-                'Never add special comments to the proof.'
-                'Your answer should be a valid Coq proof.'
-                'It should start with "Proof." and end with "Qed.".'
-               )
+        return KSHOT_SYSTEM_MESSAGE
 
     def get_msg_history(self) -> List[Dict[str, str]]:
-        theorems = self.theorems_from_file
+        theorems = self.theorem_store
 
         history = []
-        for theorem in theorems: 
-            if theorem.name in self.train_theorems:
-                history.append({"role": "user", "content": theorem.statement})
-                thr_proof = theorem.proof.only_text() if theorem.proof is not None else "Admitted."
-                history.append({"role": "assistant", "content": thr_proof})
+        for thr_id in self.train_ids: 
+            history.append({"role": "user", "content": theorems.statement(thr_id)})
+            thr_proof = theorems.proof(thr_id)
+            history.append({"role": "assistant", "content": thr_proof if thr_proof is not None else "Admitted."})
         
         return history
 
 
 class CoqPromptKShotWithContext(LLMPromptInterface): 
+    # The goals after each tactic come from the proof steps
+    keeps_parsed_theorems = True
+
     def get_system_message(self) -> str: 
         return ('Generate proof of the theorem from user input in Coq. '
                 'You should only generate proofs in Coq. '
@@ -58,10 +61,11 @@ class CoqPromptKShotWithContext(LLMPromptInterface):
 
     def get_msg_history(self) -> List[Dict[str, str]]:
         theorems = self.theorems_from_file
+        train_names = set(self.train_theorems)
 
         history = []
         for theorem in theorems: 
-            if theorem.name in self.train_theorems:
+            if theorem.name in train_names:
                 history.append({"role": "user", "content": theorem.statement})
                 thr_proof = str(theorem.proof) if theorem.proof is not None else "Admitted."
                 history.append({"role": "assistant", "content": thr_proof})
@@ -69,17 +73,86 @@ class CoqPromptKShotWithContext(LLMPromptInterface):
         return history
 
 
+class CoqPromptKShotRetrieval(CoqPromptKShot): 
+    def __init__(
+        self, 
+        path_to_coq_file: str, 
+        path_to_root_dir: str,
+        train_theorems: List[str],
+        test_theorems: List[str],
+        k: int = 5,
+        token_budget: int = 3000,
+        **kwargs
+    ) -> None:
+        """
+        Instead of a fixed history, for every test theorem sends 
+        the k train theorems most similar to it (by TF-IDF over 
+        identifiers and tactics) that fit into `token_budget` 
+        tokens. The index is built once per file and persisted 
+        next to it.
+        """
+        super().__init__(
+            path_to_coq_file, path_to_root_dir, 
+            train_theorems, test_theorems, **kwargs
+        )
+        self.k = k
+        self.token_budget = token_budget
+        self.token_counter = TokenCounter()
+        theorems = self.theorem_store
+        candidates = [
+            thr_id for thr_id in self.train_ids
+            if theorems.records[thr_id].has_proof and not theorems.records[thr_id].is_incomplete
+        ]
+        # numpy is imported only when the retrieval strategy is used
+        from .retrieval_index import load_or_build_retrieval_index
+        self.retrieval_index = load_or_build_retrieval_index(
+            self.coq_file, self.root_dir, self.file_contents.text, theorems, candidates
+        )
+        self.candidates = {theorems.name(thr_id): thr_id for thr_id in candidates}
+        self.histories: Dict[str, List[Dict[str, str]]] = {}
+
+    def get_msg_history(self) -> List[Dict[str, str]]:
+        return []
+
+    def get_msg_history_for_theorem(self, thr_st: str) -> Optional[List[Dict[str, str]]]:
+        if thr_st in self.histories: 
+            return self.histories[thr_st]
+
+        theorems = self.theorem_store
+        chosen = []
+        tokens_used = 0
+        for name, _ in self.retrieval_index.query(thr_st): 
+            if len(chosen) == self.k: 
+                break
+            thr_id = self.candidates[name]
+            tokens = (self.token_counter.count(theorems.statement(thr_id)) 
+                      + self.token_counter.count(theorems.proof(thr_id)))
+            if tokens_used + tokens > self.token_budget: 
+                continue
+            chosen.append(thr_id)
+            tokens_used += tokens
+        # Examples keep the order of the file
+        chosen.sort()
+
+        history = []
+        for thr_id in chosen: 
+            history.append({"role": "user", "content": theorems.statement(thr_id)})
+            history.append({"role": "assistant", "content": theorems.proof(thr_id)})
+        self.histories[thr_st] = history
+        return history
+
+
 class CoqPromptKShotRandomEvalChoice(CoqPromptKShot): 
     def __init__(
         self, 
         path_to_coq_file: str, 
         path_to_root_dir: str,
         train_fraction: float,
+        token_limit: int = 4096
     ) -> None:
         if train_fraction < 0 or train_fraction > 1: 
             raise ValueError("train_fraction must be between 0 and 1")
-        proof_view = ProofView(path_to_coq_file, path_to_root_dir)
-        all_theorems = proof_view.all_theorem_names()
+        all_theorems, proof_view = load_theorems(path_to_coq_file, path_to_root_dir)
         self.train_fraction = train_fraction
         # Split self.theorems_from_file into train and test 
         # according to train_fraction
@@ -90,12 +163,24 @@ class CoqPromptKShotRandomEvalChoice(CoqPromptKShot):
                 train_theorems.append(theorem)
             else:
                 test_theorems.append(theorem)
-        # make both lists 4 times shorter cause otherwise 
-        # we reach the token limit when using gpt
-        random_indexes_train = random.sample(range(len(train_theorems)), len(train_theorems)//4)
-        random_indexes_test = random.sample(range(len(test_theorems)), len(test_theorems)//6)
-        train_theorems = [train_theorems[i] for i in random_indexes_train]
+        # Evaluate on a random sixth of the test theorems 
+        # to keep the evaluation time reasonable
+        random_indexes_test = sorted(random.sample(range(len(test_theorems)), len(test_theorems)//6))
         test_theorems = [test_theorems[i] for i in random_indexes_test]
+        # Out of the train theorems take the most relevant ones 
+        # that fit into the token limit together with the system 
+        # message and the longest test statement
+        token_counter = TokenCounter()
+        token_budget = int(0.9 * token_limit) - token_counter.count(self.get_system_message()) - max(
+            [token_counter.count(theorem.statement) for theorem in test_theorems], default=0
+        )
+        train_theorems = select_train_theorems(
+            train_theorems, token_budget, 
+            identifier_relevance([theorem.statement for theorem in test_theorems]), 
+            token_counter=token_counter
+        )
+        train_theorems = [theorem.name for theorem in train_theorems]
+        test_theorems = [theorem.name for theorem in test_theorems]
         
         print(f"Train theorems: {train_theorems}")
         print(f"Test theorems: {test_theorems}")
@@ -108,8 +193,7 @@ class CoqPromptSolveAdmitted(CoqPromptKShot):
         path_to_coq_file: str, 
         path_to_root_dir: str
     ) -> None:
-        proof_view = ProofView(path_to_coq_file, path_to_root_dir)
-        all_theorems = proof_view.parse_file()
+        all_theorems, proof_view = load_theorems(path_to_coq_file, path_to_root_dir)
         train_theorems = []
         test_theorems = []
         for theorem in all_theorems:
@@ -127,9 +211,12 @@ class CoqPromptSingleTheorem(CoqPromptKShot):
         path_to_root_dir: str,
         train_theorems: List[str],
         theorem_to_solve: str,
-        progress_bar: ProgressBar = None
+        progress_bar: ProgressBar = None,
+        proof_view: Optional[ProofView] = None,
+        theorems: Optional[List[IndexedTheorem]] = None
     ) -> None:
         super().__init__(
             path_to_coq_file, path_to_root_dir, train_theorems, 
-            [theorem_to_solve], progress_bar=progress_bar
+            [theorem_to_solve], progress_bar=progress_bar, 
+            proof_view=proof_view, theorems=theorems
         )
\ No newline at end of file
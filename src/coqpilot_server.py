@@ -0,0 +1,280 @@
+from .interactor import Interactor, RunOptions
+from .gpt35 import GPT35
+from .coq_llm_prompt import CoqPromptSingleTheorem, KSHOT_SYSTEM_MESSAGE
+from .prompt_budget import split_admitted_theorems, TokenCounter
+from .parsed_file_cache import load_theorems, file_key, IndexedTheorem
+from ..coqpylspclient import ProofView
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple, TextIO
+import threading
+import logging
+import json
+import sys
+import os
+
+"""
+A long-lived replacement for the run_coqpilot.py and get_admitted.py
+scripts. Requests are JSON-RPC 2.0 messages, one per line, read from
+stdin; responses are written to stdout the same way. Requests are
+handled concurrently, and ProofView sessions, parsed theorems and
+the token counter are kept between them.
+
+Methods:
+    listAdmitted {file, rootDir, tokenLimit}
+        -> {admitted: [names], train: [names]}
+    solveTheorem {file, rootDir, apiKey, shots, theorem, trainTheorems}
+        -> {proof: "statement\\nproof" or null}
+    shutdown {} -> null
+"""
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("CoqpilotServer")
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class CoqpilotServerError(Exception):
+    def __init__(self, code: int, message: str) -> None:
+        self.code = code
+        self.message = message
+
+
+class SharedProofView:
+    def __init__(self, proof_view: ProofView) -> None:
+        """
+        A ProofView shared between concurrent requests. Only
+        one request talks to the coq-lsp session at a time,
+        while the others may be waiting for the LLM. The
+        requests using it are counted, and a retired session
+        is stopped only once the last of them is done.
+        """
+        self.proof_view = proof_view
+        self.__lock = threading.Lock()
+        self.__users_lock = threading.Lock()
+        self.__users = 0
+        self.__retired = False
+
+    def parse_file(self):
+        with self.__lock:
+            return self.proof_view.parse_file()
+
+    def check_proof(self, thr_st: str, proof: str, context: str) -> Tuple[bool, str]:
+        with self.__lock:
+            return self.proof_view.check_proof(thr_st, proof, context)
+
+    def check_proofs(self, context: str, thr_st: str, proofs: List[str]) -> List[Tuple[bool, str]]:
+        with self.__lock:
+            return self.proof_view.check_proofs(context, thr_st, proofs)
+
+    def acquire(self) -> None:
+        with self.__users_lock:
+            self.__users += 1
+
+    def release(self) -> None:
+        with self.__users_lock:
+            self.__users -= 1
+            stop = self.__retired and self.__users == 0
+        if stop:
+            self.__stop()
+
+    def retire(self) -> None:
+        """
+        Stops the session once no request uses it.
+        """
+        with self.__users_lock:
+            if self.__retired:
+                return
+            self.__retired = True
+            stop = self.__users == 0
+        if stop:
+            self.__stop()
+
+    def exit(self) -> None:
+        self.retire()
+
+    def __stop(self) -> None:
+        with self.__lock:
+            self.proof_view.exit()
+
+
+class FileSession:
+    def __init__(self, path_to_coq_file: str, path_to_root_dir: str) -> None:
+        """
+        The warm state kept for a single file: its ProofView and
+        its parsed theorems. Both are replaced when the file or
+        the _CoqProject changes.
+        """
+        self.coq_file = path_to_coq_file
+        self.root_dir = path_to_root_dir
+        self.key: Optional[str] = None
+        self.theorems = []
+        self.proof_view: Optional[SharedProofView] = None
+        self.__lock = threading.Lock()
+
+    def refresh(self) -> None:
+        with self.__lock:
+            key = file_key(self.coq_file, self.root_dir)
+            if key == self.key:
+                return
+            if self.proof_view is not None:
+                # Requests that hold the old session finish with it
+                self.proof_view.retire()
+                self.proof_view = None
+            theorems, proof_view = load_theorems(self.coq_file, self.root_dir)
+            self.theorems = theorems
+            if proof_view is None:
+                proof_view = ProofView(self.coq_file, self.root_dir)
+            self.proof_view = SharedProofView(proof_view)
+            self.key = key
+
+    @contextmanager
+    def lease(self) -> Iterator[Tuple[SharedProofView, List[IndexedTheorem]]]:
+        """
+        Gives the current ProofView of the file with the theorems
+        parsed along with it. The ProofView is not stopped by a
+        refresh until the block is left.
+        """
+        with self.__lock:
+            proof_view = self.proof_view
+            theorems = self.theorems
+            proof_view.acquire()
+        try:
+            yield proof_view, theorems
+        finally:
+            proof_view.release()
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.proof_view is not None:
+                self.proof_view.retire()
+                self.proof_view = None
+
+
+class CoqpilotServer:
+    def __init__(self, output: TextIO, max_workers: int = 8) -> None:
+        self.output = output
+        self.sessions: Dict[Tuple[str, str], FileSession] = {}
+        self.token_counter = TokenCounter()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.running = True
+        self.__sessions_lock = threading.Lock()
+        self.__output_lock = threading.Lock()
+
+    def session(self, path_to_coq_file: str, path_to_root_dir: str) -> FileSession:
+        key = (os.path.abspath(path_to_coq_file), os.path.abspath(path_to_root_dir))
+        with self.__sessions_lock:
+            if key not in self.sessions:
+                self.sessions[key] = FileSession(path_to_coq_file, path_to_root_dir)
+            session = self.sessions[key]
+        session.refresh()
+        return session
+
+    def list_admitted(self, params: Dict[str, Any]) -> Dict[str, List[str]]:
+        session = self.session(params["file"], params["rootDir"])
+        admitted, train = split_admitted_theorems(
+            session.theorems, int(params["tokenLimit"]), KSHOT_SYSTEM_MESSAGE,
+            token_counter=self.token_counter
+        )
+        return {"admitted": admitted, "train": train}
+
+    def solve_theorem(self, params: Dict[str, Any]) -> Dict[str, Optional[str]]:
+        session = self.session(params["file"], params["rootDir"])
+        with session.lease() as (proof_view, theorems):
+            # The theorems of the session are reused, the
+            # theorem index is not loaded again per request
+            llm_prompt = CoqPromptSingleTheorem(
+                params["file"], params["rootDir"],
+                params.get("trainTheorems", []), params["theorem"],
+                proof_view=proof_view, theorems=theorems
+            )
+            try:
+                # The message history is a part of the client, so a new
+                # one is made per request; the openai module stays loaded
+                # and the key is passed with every call of the client
+                llm_interface = GPT35(params["apiKey"])
+                interactor = Interactor(llm_prompt, llm_interface, is_silent=True)
+                interactor.run(RunOptions(shots=int(params.get("shots", 1))))
+            finally:
+                # The session ProofView is not stopped, only the one
+                # started if the prompt had to restart it
+                if llm_prompt.proof_view is not proof_view:
+                    llm_prompt.proof_view.exit()
+        found_proofs = interactor.eval_logger.get_found_proofs()
+        return {"proof": found_proofs[0] if len(found_proofs) > 0 else None}
+
+    def shutdown(self, params: Dict[str, Any]) -> None:
+        self.running = False
+
+    def dispatch(self, method: str, params: Dict[str, Any]) -> Any:
+        handlers = {
+            "listAdmitted": self.list_admitted,
+            "solveTheorem": self.solve_theorem,
+            "shutdown": self.shutdown,
+        }
+        if method not in handlers:
+            raise CoqpilotServerError(METHOD_NOT_FOUND, f"Unknown method {method}")
+        try:
+            return handlers[method](params)
+        except KeyError as e:
+            raise CoqpilotServerError(INVALID_PARAMS, f"Missing parameter {e}")
+
+    def respond(self, request_id: Any, result: Any = None, error: Optional[CoqpilotServerError] = None) -> None:
+        response: Dict[str, Any] = {"jsonrpc": "2.0", "id": request_id}
+        if error is not None:
+            response["error"] = {"code": error.code, "message": error.message}
+        else:
+            response["result"] = result
+        with self.__output_lock:
+            self.output.write(json.dumps(response) + "\n")
+            self.output.flush()
+
+    def handle(self, request: Dict[str, Any]) -> None:
+        request_id = request.get("id")
+        # Notifications (requests without an id) are not answered
+        is_notification = "id" not in request
+        try:
+            result = self.dispatch(request["method"], request.get("params", {}))
+            if not is_notification:
+                self.respond(request_id, result=result)
+        except CoqpilotServerError as e:
+            if not is_notification:
+                self.respond(request_id, error=e)
+        except Exception as e:
+            logger.exception(f"Request {request_id} failed")
+            if not is_notification:
+                self.respond(request_id, error=CoqpilotServerError(INTERNAL_ERROR, str(e)))
+
+    def serve(self, input: TextIO) -> None:
+        for line in input:
+            if line.strip() == "":
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                self.respond(None, error=CoqpilotServerError(PARSE_ERROR, str(e)))
+                continue
+            if not isinstance(request, dict) or "method" not in request:
+                self.respond(None, error=CoqpilotServerError(INVALID_REQUEST, "Not a JSON-RPC request"))
+                continue
+            if request["method"] == "shutdown":
+                self.executor.shutdown(wait=True)
+                self.handle(request)
+                break
+            self.executor.submit(self.handle, request)
+
+        self.executor.shutdown(wait=True)
+        for session in self.sessions.values():
+            session.close()
+
+
+if __name__ == "__main__":
+    # Everything else that is printed goes to stderr,
+    # stdout is reserved for the responses
+    protocol_output = sys.stdout
+    sys.stdout = sys.stderr
+    CoqpilotServer(protocol_output).serve(sys.stdin)
@@ -0,0 +1,115 @@
+from typing import Optional
+import threading
+import sqlite3
+import logging
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("DiskCache")
+
+
+class DiskCache:
+    def __init__(self, path: str, max_size_bytes: int = 256 * 1024 * 1024) -> None:
+        """
+        A persistent string-to-string cache backed by SQLite.
+        When the total size of the stored values exceeds
+        `max_size_bytes`, the least recently used entries
+        are evicted. Safe to use from several threads.
+
+        :param path: Path to the SQLite database, created if missing.
+        :param max_size_bytes: The size limit of the stored values.
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.__connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)"
+        )
+        self.__connection.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the value stored under the key or None.
+        Updates the hit/miss counters.
+        """
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__connection.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self.__connection.commit()
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """
+        Stores the value under the key, replacing the old one,
+        and evicts the least recently used entries if needed.
+        """
+        size = len(value.encode("utf-8"))
+        with self.__lock:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self.__evict()
+            self.__connection.commit()
+
+    def __evict(self) -> None:
+        total_size = self.__connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+
+        rows = self.__connection.execute(
+            "SELECT key, size FROM entries ORDER BY last_access ASC"
+        ).fetchall()
+        for key, size in rows:
+            if total_size <= self.max_size_bytes:
+                break
+            self.__connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total_size -= size
+            self.evictions += 1
+
+    def size(self) -> int:
+        """
+        Returns the total size of the stored values in bytes.
+        """
+        with self.__lock:
+            return self.__connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()[0]
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self) -> str:
+        return (f"{self.hits} hits, {self.misses} misses, "
+                f"{self.evictions} evictions, {self.size()} bytes stored")
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
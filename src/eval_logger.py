@@ -1,15 +1,24 @@
 from datetime import datetime
-import plotly.graph_objects as go
 from abc import abstractmethod
-from .llm_prompt_interface import Range, Position
-from typing import Dict, List, Tuple
+from ..coqpylspclient import Range, Position
+from .coq_file_contents import CoqFileContents, get_coq_file_contents
+from .theorem_store import TheoremStore
+from .metrics_stream import MetricsStream, error_class
+from typing import Dict, List, Mapping, Optional
 import logging
+import time
 import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("EvalLogger")
 
 
+_replayable_events = [
+    "success_attempt", "failed_attempt", "cancelled_attempt", "shot_escalation", 
+    "sampling_stats", "attempt_exception", "proof_check_fail", "repair_round"
+]
+
+
 class StdoutLoggingSetup:
     def __init__(self, return_start_msg: str, return_end_msg: str, failure_msg: str): 
         self.return_start_msg = return_start_msg
@@ -22,15 +31,82 @@ class EvalLoggerException(Exception):
         self.message = message
 
 
+class StreamingLogWriter: 
+    def __init__(
+        self, 
+        log_f_path: str, 
+        contents: CoqFileContents, 
+        ranges: List[Range]
+    ) -> None: 
+        """
+        Writes the file with the given ranges substituted to the 
+        log as soon as the substitutions are known. The text 
+        is written in the order of the ranges, so a substitution 
+        waits until all the ranges before it are substituted. 
+        The log is flushed after every write, so it keeps 
+        everything up to the last finished theorem if the run 
+        crashes, and only the waiting substitutions are kept 
+        in memory.
+        """
+        self.contents = contents
+        self.ranges = sorted(ranges, key=lambda range_: (range_.start.line, range_.start.character))
+        self.next_range_ind = 0
+        self.written_pos = Position(0, 0)
+        self.pending: Dict[Range, str] = {}
+        self.__file = open(log_f_path, "a")
+
+    def __write(self, pieces: List[str]) -> None: 
+        if len(pieces) == 0: 
+            return
+        self.__file.write("".join(pieces))
+        self.__file.flush()
+
+    def __take_range(self, range_: Range, pieces: List[str]) -> None: 
+        # The unchanged text before the range and its substitution
+        pieces.append(self.contents.text_in_range(self.written_pos, range_.start))
+        pieces.append(self.pending.pop(range_))
+        self.written_pos = range_.end
+
+    def substitute(self, range_: Range, text: str) -> None: 
+        if self.__file is None: 
+            raise EvalLoggerException("The log is already closed")
+        self.pending[range_] = text
+        pieces = []
+        while self.next_range_ind < len(self.ranges) and self.ranges[self.next_range_ind] in self.pending: 
+            self.__take_range(self.ranges[self.next_range_ind], pieces)
+            self.next_range_ind += 1
+        self.__write(pieces)
+
+    def close(self) -> None: 
+        """
+        Writes the rest of the file. The ranges that were 
+        never substituted keep their original text.
+        """
+        if self.__file is None: 
+            return
+        pieces = []
+        for range_ in self.ranges[self.next_range_ind:]: 
+            if range_ in self.pending: 
+                self.__take_range(range_, pieces)
+        self.next_range_ind = len(self.ranges)
+        pieces.append(self.contents.text_in_range(self.written_pos, self.contents.end_position()))
+        self.__write(pieces)
+        self.__file.close()
+        self.__file = None
+
+
 class EvalLogger: 
     def __init__(
         self, 
         coq_file_path: str, 
         run_strategy: str, 
         shots: int, 
-        statements2ranges: Dict[str, Range], 
+        theorem_store: TheoremStore, 
+        ranges: Mapping[int, Range], 
         silent_mode: bool = False, 
-        logger_setup: StdoutLoggingSetup = None
+        logger_setup: StdoutLoggingSetup = None,
+        file_contents: CoqFileContents = None,
+        metrics_path: Optional[str] = None
     ) -> None: 
         self.coq_file = coq_file_path
         date_time_now = datetime.now().strftime("%d_%m__%H_%M_%S")      
@@ -42,8 +118,12 @@ class EvalLogger:
             self.log_pie_path = f"logs/pie_{date_time_now}.pdf"
             with open(self.log_f_path, "w") as log_file:
                 log_file.write(f"(*\n Date: {date_time_now}\n Strat: {run_strategy}\n*)\n\n")
-        with open(self.coq_file, "r") as coq_file:
-            self.contents = coq_file.read().split('\n')
+        self.contents = file_contents if file_contents is not None else get_coq_file_contents(self.coq_file)
+        self.log_writer = None
+        if not silent_mode: 
+            self.log_writer = StreamingLogWriter(
+                self.log_f_path, self.contents, list(ranges.values())
+            )
 
         self.labels = []
         self.values = []
@@ -54,86 +134,150 @@ class EvalLogger:
         self.values.append(0)
         self.pull = [0] * (shots + 1)
         self.pull[-1] = 0.2
+        self.cancelled_attempts = 0
+        self.sampled_proofs = 0
+        self.baseline_proofs = 0
+        self.used_tokens = 0
+        self.baseline_tokens = 0
+        self.saved_seconds = 0.0
+        self.repair_requests = 0
+        self.repaired_theorems = 0
+        self.in_repair = False
         self.in_proof = False
         self.proof_log = ""
         self.proof_complete = None
         self.contents_pointer = 0
-        self.statements_to_ranges = statements2ranges
+        # The theorems are referred to by their ids in the store, 
+        # their text is only looked up to be written to the log
+        self.theorem_store = theorem_store
+        self.ranges = ranges
         self.ranges_to_text = {}
         self.silent_mode = silent_mode
         self.logger_setup = logger_setup
-
-    def __log(self, text: str) -> None: 
-        with open(self.log_f_path, "a") as f:
-            f.write(text)
+        self.current_theorem = None
+        self.theorem_start_time = None
+        self.solved_theorems = 0
+        self.finished_theorems = 0
+        self.theorem_events = []
+        self.replaying = False
+        self.metrics = MetricsStream(metrics_path) if metrics_path is not None else None
+        if self.metrics is not None: 
+            self.metrics.emit(
+                "run_start", file=self.coq_file, strategy=run_strategy, 
+                shots=shots, theorems=len(ranges)
+            )
 
     def log(self, text: str) -> None: 
         logger.info(text)
 
-    def __get_text_in_range(
-        self, 
-        start: Position, 
-        end: Position, 
-        preserve_line_breaks: bool = True
-    ) -> str:
-        if start.line == end.line: 
-            return self.contents[start.line][start.character:end.character]
-        else: 
-            text = self.contents[start.line][start.character:]
-            for i in range(start.line + 1, end.line):
-                if preserve_line_breaks: 
-                    text += '\n'
-                text += self.contents[i]
-            if preserve_line_breaks:
-                text += '\n'
-            text += self.contents[end.line][:end.character]
-
-            return text
-
-    def __substitute_text_pieces(self) -> str: 
-        """
-        Iterates over self.contents and substitutes
-        the ranges from self.ranges_to_text with 
-        the corresponding text. 
-        """
-        new_text = ""
-        ranges_text_pairs: List[Tuple[Range, str]] = list(self.ranges_to_text.items())
-        ranges_text_pairs.sort(key=lambda x: (x[0].start.line, x[0].start.character))
-        last_range_end_pos = Position(0, 0)
-        for (range_, text_piece) in ranges_text_pairs:
-            # Add the text between the last range and the start of the current range
-            new_text += self.__get_text_in_range(last_range_end_pos, range_.start)
-            # Add the text of the current range
-            new_text += text_piece
-            last_range_end_pos = range_.end
-
-        # Add the text after the last range
-        new_text += self.__get_text_in_range(
-            last_range_end_pos, 
-            Position(len(self.contents) - 1, len(self.contents[-1]))
-        )
-        return new_text
-        
+    def records_metrics(self) -> bool:
+        return self.metrics is not None
+
+    def __emit(self, event: str, **fields) -> None:
+        if self.metrics is not None and not self.replaying: 
+            self.metrics.emit(event, **fields)
+
+    def __record(self, event: str, *args) -> None:
+        """
+        Remembers the call, so that the theorem can be 
+        logged again from a journal with `replay_theorem`.
+        """
+        self.theorem_events.append([event] + list(args))
+
     def on_start_llm_response_fetch(self, thr_index: int, am_theorems: int) -> None: 
+        if self.current_theorem != thr_index + 1: 
+            self.current_theorem = thr_index + 1
+            self.theorem_start_time = time.time()
         logger.info(f"Fetching potential proofs for theorem {thr_index + 1}/{am_theorems}")
 
     def on_end_llm_response_fetch(self) -> None:
         logger.info("Fetching potential proofs finished")
 
+    def on_llm_request(
+        self, thr_ind: int, seconds: float, queue_wait: float, 
+        tokens_in: int, tokens_out: int, cache_hit: bool
+    ) -> None:
+        """
+        A request to the LLM for the theorem took `seconds` after 
+        waiting for `queue_wait` seconds to be sent. May be called 
+        from any thread.
+        """
+        if self.metrics is None: 
+            return
+        self.metrics.emit(
+            "llm_request", theorem=thr_ind, seconds=seconds, queue_wait=queue_wait, 
+            tokens_in=tokens_in, tokens_out=tokens_out, cache_hit=cache_hit
+        )
+        self.metrics.add(
+            thr_ind, llm_requests=1, llm_seconds=seconds, queue_wait=queue_wait, 
+            tokens_in=tokens_in, tokens_out=tokens_out, llm_cache_hits=int(cache_hit)
+        )
+
+    def on_verification(
+        self, thr_ind: int, seconds: float, 
+        candidates: int, cache_hits: int
+    ) -> None:
+        """
+        Checking `candidates` proofs of the theorem took `seconds`, 
+        `cache_hits` of them were not checked as their results 
+        were known. May be called from any thread.
+        """
+        if self.metrics is None: 
+            return
+        self.metrics.emit(
+            "verification", theorem=thr_ind, seconds=seconds, 
+            candidates=candidates, cache_hits=cache_hits
+        )
+        self.metrics.add(
+            thr_ind, verify_seconds=seconds, 
+            verified_candidates=candidates, check_cache_hits=cache_hits
+        )
+
+    def on_prefilter_stats(
+        self, sanitized_responses: int, 
+        linted_proofs: int, rejected_proofs: Dict[str, int]
+    ) -> None:
+        """
+        Of `linted_proofs` proofs the proof filter rejected 
+        `rejected_proofs` (by the kind of the mistake) before 
+        they reached coq-lsp, `sanitized_responses` responses 
+        had to be cut down to the proof.
+        """
+        rejected = sum(rejected_proofs.values())
+        logger.info(
+            f"Pre-filter: {rejected}/{linted_proofs} proofs rejected without checking" 
+            + (f" ({', '.join(f'{count} {kind}' for kind, count in rejected_proofs.items())})" if rejected > 0 else "") 
+            + f", {sanitized_responses} responses sanitized"
+        )
+        self.__emit(
+            "prefilter", linted=linted_proofs, sanitized=sanitized_responses, 
+            rejected=rejected, by_kind=rejected_proofs
+        )
+
+    def on_proof_view_restart(self, thr_ind: int) -> None:
+        if self.metrics is None: 
+            return
+        self.metrics.emit("proof_view_restart", theorem=thr_ind)
+        self.metrics.add(thr_ind, proof_view_restarts=1)
+
     def on_theorem_proof_start(self) -> None:
         if self.in_proof: 
             raise EvalLoggerException("Already in proof")
         self.in_proof = True
         self.proof_complete = False
+        self.in_repair = False
+        self.theorem_events = []
         self.proof_log = "(* {THEOREM PROOF LOG START} *)\n"
 
     def on_success_attempt(
         self, attempt_ind: int, 
-        thr_ind: int, statement: str, 
+        thr_ind: int, thr_id: int, 
         proof: str
     ) -> None:
         if not self.in_proof: 
             raise EvalLoggerException("Not in proof")
+        self.__record("success_attempt", attempt_ind, thr_ind, thr_id, proof)
+        statement = self.theorem_store.statement(thr_id)
         self.proof_log += f"(* Attempt {attempt_ind} for theorem {thr_ind} *)\n"
         self.proof_log += f"{statement}\n{proof}\n"
         
@@ -142,27 +286,116 @@ class EvalLogger:
         logger.info(f"Attempt {attempt_ind} for theorem {thr_ind} successful")
         self.values[attempt_ind - 1] += 1
         self.proof_complete = True
+        self.__emit("attempt", theorem=thr_ind, attempt=attempt_ind, status="success", error_class=None)
 
         if self.silent_mode:
-            needed_range = self.statements_to_ranges[statement]
+            needed_range = self.ranges[thr_id]
             self.ranges_to_text[needed_range] = f"{statement}\n{proof}"
     
     def on_failed_attempt(
         self, attempt_ind: int, 
-        thr_ind: int, statement: str, 
+        thr_ind: int, thr_id: int, 
         proof: str, error_msg: str
     ) -> None: 
         if not self.in_proof: 
             raise EvalLoggerException("Not in proof")
+        self.__record("failed_attempt", attempt_ind, thr_ind, thr_id, proof, error_msg)
+        statement = self.theorem_store.statement(thr_id)
         self.proof_log += f"(* Attempt {attempt_ind} for theorem {thr_ind} *)\n"
         self.proof_log += f"(*\n{statement}\n{proof}\n*)\n"
         
         self.proof_log += f"(* Attempt {attempt_ind} for theorem {thr_ind} unsuccessful *)\n"
         self.proof_log += f"(* ERROR message: {error_msg} *)\n\n"
+        self.__emit(
+            "attempt", theorem=thr_ind, attempt=attempt_ind, 
+            status="failure", error_class=error_class(error_msg)
+        )
     
-    def on_attempt_exception(self, attempt_ind: int, thr_ind: int, error_msg: str) -> None:
+    def on_cancelled_attempt(
+        self, attempt_ind: int, 
+        thr_ind: int, thr_id: int, 
+        proof: str
+    ) -> None:
+        """
+        The attempt was not checked because another proof 
+        for the theorem had already been accepted. It is 
+        neither a success nor a failure.
+        """
+        if not self.in_proof: 
+            raise EvalLoggerException("Not in proof")
+        self.__record("cancelled_attempt", attempt_ind, thr_ind, thr_id, proof)
+        statement = self.theorem_store.statement(thr_id)
+        self.proof_log += f"(* Attempt {attempt_ind} for theorem {thr_ind} *)\n"
+        self.proof_log += f"(*\n{statement}\n{proof}\n*)\n"
+        self.proof_log += f"(* Attempt {attempt_ind} for theorem {thr_ind} cancelled *)\n\n"
+        self.cancelled_attempts += 1
+        self.__emit("attempt", theorem=thr_ind, attempt=attempt_ind, status="cancelled", error_class=None)
+
+    def on_shot_escalation(
+        self, thr_ind: int, round_ind: int, 
+        shots: int, temperature: float
+    ) -> None:
+        if not self.in_proof: 
+            raise EvalLoggerException("Not in proof")
+        self.__record("shot_escalation", thr_ind, round_ind, shots, temperature)
+        self.proof_log += f"(* All attempts failed, asking for {shots} more proofs at temperature {temperature:.2f} *)\n\n"
+        logger.info(
+            f"Escalation round {round_ind} for theorem {thr_ind}: "
+            f"{shots} more proofs at temperature {temperature:.2f}"
+        )
+
+    def on_repair_round(self, thr_ind: int, round_ind: int, candidates: int) -> None:
+        """
+        The `candidates` most promising failed proofs are 
+        sent back to the LLM with their errors to be fixed.
+        """
+        if not self.in_proof: 
+            raise EvalLoggerException("Not in proof")
+        self.__record("repair_round", thr_ind, round_ind, candidates)
+        self.proof_log += f"(* Repair round {round_ind}: asking to fix {candidates} failed proofs given their errors *)\n\n"
+        self.repair_requests += candidates
+        self.in_repair = True
+        logger.info(f"Repair round {round_ind} for theorem {thr_ind}: {candidates} failed proofs sent back")
+        self.__emit("repair_round", theorem=thr_ind, round=round_ind, candidates=candidates)
+
+    def on_sampling_stats(
+        self, thr_ind: int, 
+        sampled_proofs: int, baseline_proofs: int, 
+        used_tokens: int, baseline_tokens: int, 
+        elapsed_seconds: float, saved_seconds: float
+    ) -> None:
+        """
+        Adaptive sampling of the theorem took `sampled_proofs` 
+        proofs and `used_tokens` tokens, where asking for 
+        `baseline_proofs` proofs at once would take an estimated 
+        `baseline_tokens` tokens and `saved_seconds` more seconds.
+        """
+        self.__record(
+            "sampling_stats", thr_ind, sampled_proofs, baseline_proofs, 
+            used_tokens, baseline_tokens, elapsed_seconds, saved_seconds
+        )
+        self.sampled_proofs += sampled_proofs
+        self.baseline_proofs += baseline_proofs
+        self.used_tokens += used_tokens
+        self.baseline_tokens += baseline_tokens
+        self.saved_seconds += saved_seconds
+        logger.info(
+            f"Theorem {thr_ind}: {sampled_proofs}/{baseline_proofs} proofs sampled, "
+            f"~{used_tokens} tokens instead of ~{baseline_tokens}, "
+            f"{elapsed_seconds:.2f}s, ~{saved_seconds:.2f}s saved"
+        )
+
+    def on_attempt_exception(
+        self, attempt_ind: int, thr_ind: int, 
+        error_msg: str, exception_class: Optional[str] = None
+    ) -> None:
         if not self.in_proof: 
             raise EvalLoggerException("Not in proof")
+        self.__record("attempt_exception", attempt_ind, thr_ind, error_msg, exception_class)
+        self.__emit(
+            "attempt", theorem=thr_ind, attempt=attempt_ind, 
+            status="exception", error_class=exception_class
+        )
         self.proof_log += f"(* Attempt {attempt_ind} for theorem {thr_ind} failed with an exception*)\n"
         self.proof_log += f"(* EXCEPTION message: {error_msg} *)\n\n"
         logger.info(f"Attempt {attempt_ind} for theorem {thr_ind} failed with an exception")
@@ -170,29 +403,94 @@ class EvalLogger:
     def on_proof_check_fail(self, error_msg: str) -> None:
         if not self.in_proof: 
             raise EvalLoggerException("Not in proof")
+        self.__record("proof_check_fail", error_msg)
         self.proof_log += f"(* ProofView responded with an error: {error_msg} *)\n"
 
-    def on_theorem_proof_end(self, statement: str, correct_proof: str) -> None: 
+    def on_theorem_proof_end(self, thr_id: int) -> None: 
         if not self.in_proof: 
             raise EvalLoggerException("Not in proof")
+        statement = self.theorem_store.statement(thr_id)
         if not self.proof_complete: 
             self.values[-1] += 1
             self.proof_log += f"(* Correct proof was not found. Here is the one from original file. *)\n"
-            self.proof_log += f"{statement}\n{correct_proof}\n"
+            self.proof_log += f"{statement}\n{self.theorem_store.proof(thr_id)}\n"
             self.proof_log += "(* {THEOREM PROOF LOG END} *)"
             
         self.in_proof = False
+        self.finished_theorems += 1
+        self.solved_theorems += int(self.proof_complete)
+        self.repaired_theorems += int(self.proof_complete and self.in_repair)
+        if self.metrics is not None and not self.replaying: 
+            totals = self.metrics.pop_theorem(self.current_theorem)
+            self.metrics.emit(
+                "theorem", theorem=self.current_theorem, statement=statement, 
+                solved=self.proof_complete, seconds=time.time() - self.theorem_start_time, 
+                **totals
+            )
+
+        if not self.silent_mode: 
+            needed_range = self.ranges[thr_id]
+            self.log_writer.substitute(needed_range, self.proof_log)
+
+    def replay_theorem(
+        self, thr_index: int, am_theorems: int, 
+        thr_id: int, events: List[list]
+    ) -> None:
+        """
+        Logs a theorem finished in an earlier run again from the 
+        `theorem_events` recorded for it then, so that the counters 
+        and the log are the same as if it was evaluated now. 
+        Nothing is written to the metrics stream, the earlier 
+        run has already written the metrics of the theorem.
+        """
+        self.replaying = True
+        try: 
+            self.current_theorem = thr_index + 1
+            logger.info(f"Theorem {thr_index + 1}/{am_theorems} restored from the journal")
+            self.on_theorem_proof_start()
+            for event, *args in events: 
+                if event not in _replayable_events: 
+                    raise EvalLoggerException(f"Unknown event in the journal: {event}")
+                getattr(self, f"on_{event}")(*args)
+            self.on_theorem_proof_end(thr_id)
+        finally: 
+            self.replaying = False
 
+    def get_found_proofs(self) -> List[str]: 
+        """
+        In the silent mode returns the found proofs, each 
+        prefixed with the statement of its theorem.
+        """
         if not self.silent_mode: 
-            needed_range = self.statements_to_ranges[statement]
-            self.ranges_to_text[needed_range] = self.proof_log
+            return []
+        return list(self.ranges_to_text.values())
 
     def on_evaluation_finish(self) -> None: 
+        if self.metrics is not None: 
+            self.metrics.emit(
+                "run_end", theorems=self.finished_theorems, solved=self.solved_theorems, 
+                cancelled_attempts=self.cancelled_attempts
+            )
+            self.metrics.close()
+        if self.cancelled_attempts > 0: 
+            logger.info(f"{self.cancelled_attempts} attempts were cancelled after an earlier success")
+        if self.baseline_proofs > 0: 
+            logger.info(
+                f"Adaptive sampling: {self.sampled_proofs}/{self.baseline_proofs} proofs sampled, "
+                f"~{self.used_tokens} tokens instead of ~{self.baseline_tokens} "
+                f"({self.baseline_tokens - self.used_tokens} saved), ~{self.saved_seconds:.2f}s saved"
+            )
+        if self.repair_requests > 0: 
+            logger.info(
+                f"Repair: {self.repaired_theorems} theorems proved after "
+                f"{self.repair_requests} repair requests"
+            )
         if not self.silent_mode: 
-            new_text = self.__substitute_text_pieces()
+            self.log_writer.close()
+            # plotly is slow to import and only needed for the chart
+            import plotly.graph_objects as go
             fig = go.Figure(data=[go.Pie(labels=self.labels, values=self.values, pull=self.pull)])
             fig.write_image(self.log_pie_path)
-            self.__log(new_text)
         elif self.logger_setup is not None: 
             theorem_proof: List[str] = list(self.ranges_to_text.values())
             if len(theorem_proof) == 0: 
@@ -0,0 +1,158 @@
+from .mock_llm import MockLLMBackend
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from collections import deque
+import threading
+import logging
+import json
+import time
+import sys
+
+"""
+A local stand-in for the chat completions endpoint of the OpenAI
+API, to test GPT35 and its rate limiting without the network:
+
+    server = FakeOpenAIServer(requests_per_minute=20)
+    llm_interface = GPT35("fake-key", api_base=server.start())
+
+Answers come from a MockLLMBackend. When more requests arrive
+within a minute than allowed, the server answers with 429 and
+a Retry-After header, as the real API does.
+"""
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("FakeOpenAIServer")
+
+
+class FakeOpenAIServer:
+    def __init__(
+        self,
+        backend: Optional[MockLLMBackend] = None,
+        requests_per_minute: Optional[int] = None,
+        retry_after: float = 1.0,
+        window_seconds: float = 60.0,
+        port: int = 0
+    ) -> None:
+        """
+        :param backend: Produces the proofs, the default MockLLMBackend if None.
+        :param requests_per_minute: The RPM limit of the server, unlimited if None.
+        :param retry_after: The value of Retry-After in the 429 responses, in seconds.
+        :param window_seconds: The length of the window the limit is counted in.
+        :param port: The port to listen on, any free port if 0.
+        """
+        self.backend = backend if backend is not None else MockLLMBackend()
+        self.requests_per_minute = requests_per_minute
+        self.retry_after = retry_after
+        self.window_seconds = window_seconds
+        self.port = port
+        self.requests = 0
+        self.rate_limited = 0
+        self.__recent: deque = deque()
+        self.__lock = threading.Lock()
+        self.__server: Optional[ThreadingHTTPServer] = None
+        self.__thread: Optional[threading.Thread] = None
+
+    def admit(self) -> bool:
+        with self.__lock:
+            self.requests += 1
+            if self.requests_per_minute is None:
+                return True
+            now = time.monotonic()
+            while len(self.__recent) > 0 and now - self.__recent[0] >= self.window_seconds:
+                self.__recent.popleft()
+            if len(self.__recent) >= self.requests_per_minute:
+                self.rate_limited += 1
+                return False
+            self.__recent.append(now)
+            return True
+
+    def completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        messages = request.get("messages", [])
+        message = messages[-1]["content"] if len(messages) > 0 else ""
+        choices = int(request.get("n", 1))
+        time.sleep(self.backend.request_time(choices))
+        proofs = self.backend.get_choices(message, choices)
+        # Roughly four characters per token, as the real API counts
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4 + 1
+        completion_tokens = sum(len(proof) for proof in proofs) // 4 + len(proofs)
+        return {
+            "id": f"chatcmpl-fake-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [
+                {"index": i, "message": {"role": "assistant", "content": proof}, "finish_reason": "stop"}
+                for i, proof in enumerate(proofs)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def __reply(self, status: int, body: Dict[str, Any], headers: Dict[str, str] = {}) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self.__reply(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+                elif not server.admit():
+                    self.__reply(
+                        429,
+                        {"error": {"message": "Rate limit reached for requests", "type": "requests"}},
+                        {"Retry-After": str(server.retry_after)}
+                    )
+                else:
+                    self.__reply(200, server.completion(request))
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
+
+    def start(self) -> str:
+        """
+        Starts serving in a background thread and
+        returns the base url to give to GPT35.
+        """
+        self.__server = ThreadingHTTPServer(("127.0.0.1", self.port), self.__handler())
+        self.port = self.__server.server_address[1]
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def stop(self) -> None:
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+
+if __name__ == "__main__":
+    """
+    The port to listen on and the RPM limit ("NONE" for no limit).
+    """
+    port = int(sys.argv[1])
+    requests_per_minute = int(sys.argv[2]) if sys.argv[2] != "NONE" else None
+
+    server = FakeOpenAIServer(requests_per_minute=requests_per_minute, port=port)
+    logger.info(f"Listening on {server.start()}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -1,36 +1,158 @@
 from .llm_interface import LLMInterface
 from .llm_prompt_interface import LLMPromptInterface
-from typing import List, Dict
-import openai
+from .prompt_budget import TokenCounter
+from .rate_limiter import RateLimiter, get_rate_limiter, backoff_delay
+from .prompt_payload import PromptPayload, PromptPayloadCache
+from typing import Any, List, Dict, Optional
 import logging
+import time
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("OpenaiCalls")
 
 
+def estimate_tokens(
+    token_counter: TokenCounter, payload: PromptPayload, message: Optional[str],
+    choices: int, expected_completion_tokens: int
+) -> int:
+    """
+    The tokens a request is assumed to take before its real
+    usage is known, to schedule it under the rate limits.
+    """
+    # Every message costs a few tokens of formatting
+    prompt_tokens = payload.count_tokens(token_counter, per_message=4) + 3
+    if message is not None:
+        prompt_tokens += token_counter.count(message) + 4
+    return prompt_tokens + choices * expected_completion_tokens
+
+
+def is_rate_limited(e: Exception) -> bool:
+    import openai
+    return isinstance(e, openai.error.RateLimitError) or getattr(e, "http_status", None) == 429
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    """
+    The time the server asked to wait in Retry-After, if any.
+    """
+    headers = getattr(e, "headers", None) or {}
+    for name in ("Retry-After", "retry-after"):
+        if name in headers:
+            try:
+                return max(0.0, float(headers[name]))
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+def is_retryable(e: Exception) -> bool:
+    import openai
+    # Retrying a malformed or unauthorized request never helps
+    return not isinstance(e, (
+        openai.error.InvalidRequestError,
+        openai.error.AuthenticationError,
+        openai.error.PermissionError
+    ))
+
+
 class GPT35(LLMInterface):
-    def __init__(self, api_key: str) -> None:
+    def __init__(
+        self,
+        api_key: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        api_base: Optional[str] = None,
+        request_attempts: int = 6,
+        expected_completion_tokens: int = 256
+    ) -> None:
+        """
+        :param api_key: The key of the OpenAI API.
+        :param rate_limiter: Schedules the requests under the RPM and TPM limits.
+            By default the limiter shared by all the clients with this key is used.
+        :param api_base: The base url of the API, e.g. of a local fake server.
+        :param request_attempts: How many times a request is sent before giving up.
+        :param expected_completion_tokens: The completion length per choice
+            assumed before the real usage of a request is known.
+        """
         self.history = []
         self.model = "gpt-3.5-turbo-0301"
-        self.request_attemps = 3
-        openai.api_key = api_key
+        self.request_attemps = request_attempts
+        self.api_base = api_base
+        self.expected_completion_tokens = expected_completion_tokens
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter(api_key)
+        self.token_counter = TokenCounter(self.model)
+        self.payloads = PromptPayloadCache()
+        # The key is passed with every request rather than set 
+        # on the openai module, so clients with different keys 
+        # can be used from several threads
+        self.api_key = api_key
 
     def __accept_message(self, message: str) -> None:
         self.history.append({"role": "user", "content": message})
 
     def __get_next_responses(self, choices: int = 1) -> List[str]:
-        completion = openai.ChatCompletion.create(
-            model=self.model, 
-            messages=self.history,
-            n=choices
-        )
+        completion = self.__create_completion(PromptPayload(self.history), None, choices, None)
 
         best_response = completion['choices'][0]['message']['content']
         self.history.append({"role": "assistant", "content": best_response})
 
         return [choice['message']['content'] for choice in completion["choices"]]
 
+    def __create_completion(
+        self,
+        payload: PromptPayload,
+        message: Optional[str],
+        choices: int,
+        temperature: Optional[float]
+    ) -> Dict[str, Any]:
+        """
+        Sends the payload followed by the message, if any,
+        once the rate limiter lets the request through.
+        Failed requests are retried with exponential backoff and
+        jitter; after a 429 with Retry-After the limiter holds all
+        the requests back for the time the server asked for.
+        """
+        import openai
+        options = {"api_key": self.api_key}
+        if self.api_base is not None:
+            options["api_base"] = self.api_base
+        # The API default is used unless a temperature is given
+        if temperature is not None:
+            options["temperature"] = temperature
+        estimated_tokens = estimate_tokens(
+            self.token_counter, payload, message, choices, self.expected_completion_tokens
+        )
+        messages = payload.request_messages(message) if message is not None else list(payload.messages)
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(estimated_tokens)
+            try:
+                completion = openai.ChatCompletion.create(
+                    model=self.model,
+                    messages=messages,
+                    n=choices,
+                    **options
+                )
+            except Exception as e:
+                attempt += 1
+                delay = None
+                if is_rate_limited(e):
+                    delay = retry_after(e)
+                    self.rate_limiter.on_rate_limited(delay)
+                if attempt >= self.request_attemps or not is_retryable(e):
+                    raise e
+                logger.info(f"OpenAI API call failed with {e}. {self.request_attemps - attempt} attempts left.")
+                # With Retry-After the limiter already holds the request back
+                if delay is None:
+                    time.sleep(backoff_delay(attempt - 1))
+                continue
+
+            usage = completion.get("usage")
+            if usage is not None and "total_tokens" in usage:
+                self.rate_limiter.reconcile(estimated_tokens, usage["total_tokens"])
+            return completion
+
     def init_history(self, llm_prompt: LLMPromptInterface) -> None:
         prompt = llm_prompt.get_system_message()
         message_history = llm_prompt.get_msg_history()
@@ -42,20 +164,12 @@ class GPT35(LLMInterface):
         self.__accept_message(message)
         return self.__get_next_responses(choices=choices)
 
-    def send_message_wout_history_change(self, message: str, choices: int = 1) -> List[str]:
-        attempts = self.request_attemps
-        while attempts > 0:
-            try: 
-                completion = openai.ChatCompletion.create(
-                    model=self.model, 
-                    messages=self.history + [{"role": "user", "content": message}],
-                    n=choices
-                )
-                return [choice['message']['content'] for choice in completion["choices"]]
-            except Exception as e:
-                attempts -= 1
-                logger.info(f"OpenAI API call failed with {e}. {attempts} attempts left.")
-                if attempts == 0: 
-                    raise e
-                else: 
-                    continue
\ No newline at end of file
+    def send_message_wout_history_change(
+        self, message: str, choices: int = 1, 
+        history: Optional[List[Dict[str, str]]] = None, 
+        temperature: Optional[float] = None
+    ) -> List[str]:
+        completion = self.__create_completion(
+            self.payloads.for_request(self.history, history), message, choices, temperature
+        )
+        return [choice['message']['content'] for choice in completion["choices"]]
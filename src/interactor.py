@@ -1,8 +1,103 @@
 from .llm_interface import LLMInterface
 from .llm_prompt_interface import LLMPromptInterface, ProofViewError
 from .eval_logger import EvalLogger, StdoutLoggingSetup
+from .prompt_budget import TokenCounter
+from .run_journal import RunJournal
+from .proof_filter import ProofFilter
+from .parsed_file_cache import file_key
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
 import time
-from typing import Tuple
+import os
+from typing import Tuple, List, Dict, Optional
+
+@dataclass
+class RunOptions: 
+    """
+    The settings of Interactor.run.
+
+    `shots` proofs are asked for per theorem. When `concurrency` 
+    is greater than 1, the evaluation is pipelined: LLM responses 
+    for up to `concurrency` next theorems are fetched in background 
+    threads while the proofs for the current theorem are being 
+    checked. If the prompt checks proofs with a pool of ProofView 
+    workers, the prefetched theorems are checked in the background 
+    as well. Logging still happens in file order, so the results 
+    do not depend on the concurrency level.
+
+    With `early_exit` set and a pool of ProofView workers, the 
+    candidate proofs of a theorem race on all the workers in 
+    the order of a cheap ranking score and the remaining 
+    checks are cancelled as soon as one proof is accepted. 
+    Cancelled candidates are logged separately and are not 
+    counted as failed attempts. Without a pool the candidates 
+    are checked in one batch, as without `early_exit`.
+
+    With `max_shots` set, sampling is adaptive: `shots` proofs 
+    are asked for first, and only if all of them fail, more 
+    are asked for in rounds, `escalation_factor` times more 
+    each round, at a temperature `temperature_step` higher 
+    each round, until `max_shots` proofs in total have been 
+    tried. The tokens and time saved compared to asking for 
+    `max_shots` proofs at once are logged per theorem.
+
+    With `repair_rounds` set, if still none of the proofs is 
+    correct, the `repair_candidates` most promising failed 
+    proofs (see LLMPromptInterface.rank_repair_candidates) 
+    are sent back to the LLM together with the errors Coq 
+    reported for them, and the LLM is asked for a fixed 
+    proof of each. The fixed proofs that fail again are 
+    the candidates of the next round, for up to 
+    `repair_rounds` rounds.
+
+    With `prefilter` set, the responses of the LLM are cut 
+    down to the proofs in them (without Markdown fences, 
+    repeated statements and explanations) and the proofs 
+    with mistakes that can be seen without Coq (giving up, 
+    no Qed., unbalanced brackets, braces or comments, empty 
+    bullets) are rejected before they reach coq-lsp, see 
+    proof_filter.py. They are logged as failed attempts.
+
+    With `metrics_path` set, the timings, token counts, cache 
+    hits and errors of every request, check and attempt are 
+    written there as JSON lines (see metrics_report.py).
+
+    With `journal_path` set, the result of every finished 
+    theorem (the proofs, their check results and everything 
+    else that was logged for it) is appended there before 
+    the next theorem is logged. With `resume` set as well, 
+    the theorems found in the journal of an earlier run with 
+    the same file contents, model, train theorems, strategy 
+    and sampling, repair, early exit and prefilter settings 
+    are not evaluated again: they are logged from the journal, 
+    so a run that crashed can be continued without asking the 
+    LLM twice. Without `resume` the journal is started anew.
+    """
+    shots: int = 1
+    concurrency: int = 1
+    early_exit: bool = False
+    max_shots: Optional[int] = None
+    escalation_factor: int = 2
+    temperature_step: float = 0.2
+    repair_rounds: int = 0
+    repair_candidates: int = 1
+    prefilter: bool = False
+    metrics_path: Optional[str] = None
+    journal_path: Optional[str] = None
+    resume: bool = False
+
+    def validate(self) -> None: 
+        """
+        Raises ValueError if the options contradict each other.
+        """
+        if self.concurrency < 1: 
+            raise ValueError("concurrency must be at least 1")
+        if self.max_shots is not None and self.max_shots < self.shots: 
+            raise ValueError("max_shots must be at least shots")
+        if self.repair_rounds < 0 or self.repair_candidates < 1: 
+            raise ValueError("repair_rounds must be non-negative and repair_candidates positive")
+        if self.resume and self.journal_path is None: 
+            raise ValueError("resume needs a journal_path")
 
 class Interactor: 
     def __init__(
@@ -18,11 +113,162 @@ class Interactor:
         self.log_f_path = None
         self.contents = None
         self.contents_pointer = 0
-        self.timeout = 20
         self.silent_mode = is_silent
         self.logging_setup = logging_setup
+        self.eval_logger = None
+        self.token_counter = None
+        self.restored_ids = set()
+        self.proof_filter = None
     
-    def run(self, shots: int = 1) -> float:
+    def __prefetch_llm_responses(
+        self, 
+        executor: ThreadPoolExecutor, 
+        in_flight: Dict[int, Future], 
+        thr_ids: List[int], 
+        from_index: int, 
+        concurrency: int, 
+        shots: int, 
+        early_exit: bool
+    ) -> None:
+        """
+        Keeps up to `concurrency` LLM requests in flight for the 
+        theorems starting from `from_index`, in file order.
+        """
+        for thr_index in range(from_index, min(from_index + concurrency, len(thr_ids))):
+            if thr_index not in in_flight and thr_ids[thr_index] not in self.restored_ids:
+                in_flight[thr_index] = executor.submit(
+                    self.__fetch_and_check, thr_index, thr_ids[thr_index], 
+                    shots, early_exit, time.time()
+                )
+
+    def __send_statement(
+        self, 
+        thr_index: int, 
+        thr_id: int, 
+        shots: int, 
+        temperature: Optional[float] = None, 
+        queue_wait: float = 0.0, 
+        deferred: Optional[List[Tuple[str, tuple]]] = None
+    ) -> List[str]:
+        """
+        Asks the LLM for `shots` proofs of the theorem, with 
+        the message history the prompt chose for it.
+        The metrics events are added to `deferred` if given, 
+        see __report.
+        """
+        statement = self.llm_prompt.theorem_store.statement(thr_id)
+        start_time = time.time()
+        llm_response = self.llm_interface.send_message_wout_history_change(
+            message=statement, 
+            choices=shots, 
+            history=self.llm_prompt.get_msg_history_for_theorem(statement), 
+            temperature=temperature
+        )
+        if self.eval_logger is not None and self.eval_logger.records_metrics(): 
+            self.__report(
+                deferred, "on_llm_request", 
+                thr_index + 1, time.time() - start_time, queue_wait, 
+                self.__prompt_tokens(statement), 
+                sum(self.token_counter.count(proof) for proof in llm_response), 
+                self.llm_interface.last_request_cached()
+            )
+        if self.proof_filter is not None: 
+            llm_response = self.proof_filter.sanitize(llm_response)
+        return llm_response
+
+    def __report(self, deferred: Optional[List[Tuple[str, tuple]]], event: str, *args) -> None:
+        """
+        Passes the event to the logger, or, for a theorem that 
+        is being prefetched in the background, keeps it until 
+        the main loop gets to the theorem, so that the metrics 
+        stream is in file order.
+        """
+        if deferred is not None: 
+            deferred.append((event, args))
+        else: 
+            getattr(self.eval_logger, event)(*args)
+
+    def __prompt_tokens(self, statement: str) -> int:
+        """
+        Estimates the amount of tokens sent in a single 
+        request for the statement, the history included.
+        """
+        if self.token_counter is None: 
+            self.token_counter = TokenCounter()
+        payload = self.llm_prompt.get_prompt_payload(statement)
+        return payload.count_tokens(self.token_counter) + self.token_counter.count(statement)
+
+    def __fetch_and_check(
+        self, 
+        thr_index: int, 
+        thr_id: int, 
+        shots: int, 
+        early_exit: bool, 
+        submit_time: float
+    ) -> Tuple[
+        List[str], Optional[List[Optional[Tuple[bool, str]]]], 
+        Optional[Exception], List[Tuple[str, tuple]]
+    ]:
+        """
+        Fetches the LLM response for the theorem. If the 
+        prompt is able to check proofs of different theorems 
+        in parallel, the first verification attempt is made 
+        right away in the background too. Returns the response, 
+        the check result (None if the check was not made), 
+        the exception the check failed with, if any, and the 
+        metrics events to pass to the logger.
+        """
+        deferred: List[Tuple[str, tuple]] = []
+        llm_response = self.__send_statement(
+            thr_index, thr_id, shots, 
+            queue_wait=time.time() - submit_time, deferred=deferred
+        )
+        if not self.llm_prompt.supports_concurrent_verification():
+            return llm_response, None, None, deferred
+        try: 
+            proof_check_result = self.__verify_proofs(
+                thr_index, thr_id, llm_response, early_exit, deferred=deferred
+            )
+            return llm_response, proof_check_result, None, deferred
+        except Exception as e:
+            return llm_response, None, e, deferred
+
+    def __verify_proofs(
+        self, 
+        thr_index: int, 
+        thr_id: int, 
+        llm_response: List[str], 
+        early_exit: bool, 
+        deferred: Optional[List[Tuple[str, tuple]]] = None
+    ) -> List[Optional[Tuple[bool, str]]]:
+        """
+        Checks the proofs, except for the ones the proof 
+        filter rejects, which fail with the rejection message.
+        """
+        rejected = self.proof_filter.lint(llm_response) if self.proof_filter is not None else {}
+        to_check = [proof for index, proof in enumerate(llm_response) if index not in rejected]
+        if len(to_check) == 0: 
+            return [(False, rejected[index]) for index in range(len(llm_response))]
+
+        statement = self.llm_prompt.theorem_store.statement(thr_id)
+        start_time = time.time()
+        if early_exit: 
+            proof_check_result = self.llm_prompt.verify_proofs_until_success(statement, to_check)
+        else: 
+            proof_check_result = self.llm_prompt.verify_proofs(statement, to_check)
+        if self.eval_logger is not None: 
+            self.__report(
+                deferred, "on_verification", 
+                thr_index + 1, time.time() - start_time, len(to_check), 
+                self.llm_prompt.last_verification_cache_hits()
+            )
+        checked = iter(proof_check_result)
+        return [
+            (False, rejected[index]) if index in rejected else next(checked) 
+            for index in range(len(llm_response))
+        ]
+
+    def run(self, options: Optional[RunOptions] = None) -> float:
         """ 
         Retrieves theorems we want to evaluate the LLM on 
         from the LLMPrompt object, then sends them to the
@@ -32,73 +278,418 @@ class Interactor:
         Returns the ratio of theorems for which the proof has
         been found successfully to the amount of theorems 
         provided for evaluation.
+
+        :param options: How to sample, check, repair and record 
+            the proofs, see RunOptions. By default, one proof 
+            is asked for per theorem.
         """
+        if options is None: 
+            options = RunOptions()
+        options.validate()
+
+        run_logger = self.__start_run(options)
+        thr_ids = self.llm_prompt.get_theorems_for_evaluation()
+        run_key = self.__run_key(options)
+        journal, restored = self.__open_journal(options, run_key, thr_ids)
+        self.restored_ids = set(restored)
+
+        successfull_proofs = 0
+        executor = ThreadPoolExecutor(max_workers=options.concurrency) if options.concurrency > 1 else None
+        in_flight: Dict[int, Future] = {}
+        try: 
+            for thr_index, thr_id in enumerate(thr_ids):
+                if thr_id in restored: 
+                    entry = restored[thr_id]
+                    run_logger.replay_theorem(thr_index, len(thr_ids), thr_id, entry["events"])
+                    successfull_proofs += entry["successful_proofs"]
+                    continue
+                theorem_proofs = self.__evaluate_theorem(
+                    run_logger, executor, in_flight, thr_ids, thr_index, options
+                )
+                successfull_proofs += theorem_proofs
+                if journal is not None: 
+                    journal.record({
+                        "run": run_key, "theorem": thr_id, 
+                        "name": self.llm_prompt.theorem_store.name(thr_id), 
+                        "successful_proofs": theorem_proofs, 
+                        "events": run_logger.theorem_events
+                    })
+        finally: 
+            if executor is not None: 
+                for future in in_flight.values(): 
+                    future.cancel()
+                executor.shutdown(wait=True)
+    
+        if self.proof_filter is not None: 
+            run_logger.on_prefilter_stats(*self.proof_filter.stats())
+        run_logger.on_evaluation_finish()
+
+        return successfull_proofs / len(thr_ids) if len(thr_ids) != 0 else 0
+
+    def __start_run(self, options: RunOptions) -> EvalLogger:
+        """
+        Creates the logger of the run, the proof filter 
+        and the token counter the options need.
+        """
+        max_attempts = options.shots if options.max_shots is None else options.max_shots
+        max_attempts += options.repair_rounds * options.repair_candidates
         run_logger = EvalLogger(
-            self.llm_prompt.coq_file, self.llm_prompt.prompt_strategy, 
-            shots, self.llm_prompt.statements_to_ranges, silent_mode=self.silent_mode,
-            logger_setup=self.logging_setup
+            self.llm_prompt.coq_file, self.llm_prompt.prompt_strategy, max_attempts, 
+            self.llm_prompt.theorem_store, self.llm_prompt.eval_ranges, 
+            silent_mode=self.silent_mode,
+            logger_setup=self.logging_setup, file_contents=self.llm_prompt.file_contents, 
+            metrics_path=options.metrics_path
         )
+        self.eval_logger = run_logger
+        self.proof_filter = ProofFilter() if options.prefilter else None
+        if (options.max_shots is not None or options.metrics_path is not None) and self.token_counter is None: 
+            self.token_counter = TokenCounter()
+        return run_logger
 
-        statements = self.llm_prompt.get_theorems_for_evaluation()
-        successfull_proofs = 0
-        for thr_index, statement in enumerate(statements):
-            # run_logger.log("Await to not bump into the tocken limit")
-            # time.sleep(self.timeout)
-            run_logger.on_start_llm_response_fetch(thr_index, len(statements))
-            llm_response = self.llm_interface.send_message_wout_history_change(
-                message=statement, 
-                choices=shots
+    def __run_key(self, options: RunOptions) -> Dict[str, object]:
+        """
+        Returns every parameter that changes the outcome of a 
+        theorem, so that a run with other settings is not 
+        resumed from the journal of this one.
+        """
+        return {
+            "file": os.path.abspath(self.llm_prompt.coq_file), 
+            "file_key": file_key(self.llm_prompt.coq_file, self.llm_prompt.root_dir), 
+            "model": getattr(self.llm_interface, "model", self.llm_interface.__class__.__name__), 
+            "train_theorems": sorted(self.llm_prompt.train_theorems), 
+            "strategy": self.llm_prompt.prompt_strategy, 
+            "shots": options.shots, "max_shots": options.max_shots, 
+            "escalation_factor": options.escalation_factor, 
+            "temperature_step": options.temperature_step, 
+            "repair_rounds": options.repair_rounds, 
+            "repair_candidates": options.repair_candidates, 
+            "early_exit": options.early_exit, "prefilter": options.prefilter
+        }
+
+    def __open_journal(
+        self, 
+        options: RunOptions, 
+        run_key: Dict[str, object], 
+        thr_ids: List[int]
+    ) -> Tuple[Optional[RunJournal], Dict[int, dict]]:
+        """
+        Opens the journal of the run, if there is one, and 
+        returns it with the entries of the theorems to resume 
+        from it. Without `resume` the journal is started anew.
+        """
+        if options.journal_path is None: 
+            return None, {}
+        journal = RunJournal(options.journal_path)
+        if not options.resume: 
+            journal.clear()
+            return journal, {}
+        return journal, self.__restore_from_journal(journal, run_key, thr_ids)
+
+    def __restore_from_journal(
+        self, 
+        journal: RunJournal, 
+        run_key: Dict[str, object], 
+        thr_ids: List[int]
+    ) -> Dict[int, dict]:
+        """
+        Returns the journal entries of the theorems to evaluate 
+        that were finished by an earlier run with the same key, 
+        by theorem id. An entry whose theorem has another name 
+        now (the file was changed) is not used.
+        """
+        theorem_store = self.llm_prompt.theorem_store
+        to_evaluate = set(thr_ids)
+        restored = {}
+        for entry in journal.entries(): 
+            thr_id = entry.get("theorem")
+            if (entry.get("run") == run_key and thr_id in to_evaluate 
+                    and entry.get("name") == theorem_store.name(thr_id)): 
+                restored[thr_id] = entry
+        return restored
+
+    def __evaluate_theorem(
+        self, 
+        run_logger: EvalLogger, 
+        executor: ThreadPoolExecutor, 
+        in_flight: Dict[int, Future], 
+        thr_ids: List[int], 
+        thr_index: int, 
+        options: RunOptions
+    ) -> int:
+        """
+        Fetches (or awaits the prefetched) LLM response for 
+        the theorem with index `thr_index`, checks the proofs 
+        and logs the results. If none of them is correct and 
+        `max_shots` allows, asks for more proofs, then, if 
+        `repair_rounds` allows, asks to repair the failed ones. 
+        Returns the amount of successfully checked proofs.
+        """
+        shots, early_exit, max_shots = options.shots, options.early_exit, options.max_shots
+        thr_id = thr_ids[thr_index]
+        start_time = time.time()
+        run_logger.on_start_llm_response_fetch(thr_index, len(thr_ids))
+        prechecked_result, precheck_error = None, None
+        if executor is not None: 
+            self.__prefetch_llm_responses(
+                executor, in_flight, thr_ids, 
+                thr_index, options.concurrency, shots, early_exit
+            )
+            llm_response, prechecked_result, precheck_error, deferred = in_flight.pop(thr_index).result()
+            for event, args in deferred: 
+                getattr(run_logger, event)(*args)
+            # Start fetching the next theorem while this one is being checked
+            self.__prefetch_llm_responses(
+                executor, in_flight, thr_ids, 
+                thr_index + 1, options.concurrency, shots, early_exit
             )
-            run_logger.on_end_llm_response_fetch()
-            run_logger.on_theorem_proof_start()
-
-            verify_proofs_attempts = 3
-            proof_check_result = []
-            while verify_proofs_attempts > 0:
-                try: 
-                    proof_check_result = self.llm_prompt.verify_proofs(statement, llm_response)
+        else: 
+            llm_response = self.__send_statement(thr_index, thr_id, shots)
+        run_logger.on_end_llm_response_fetch()
+        run_logger.on_theorem_proof_start()
+
+        check_start_time = time.time()
+        llm_response, proof_check_result = self.__check_llm_response(
+            run_logger, thr_ids, thr_index, shots, None, early_exit, 
+            llm_response, prechecked_result, precheck_error
+        )
+        check_time = time.time() - check_start_time
+        successfull_proofs = self.__log_check_results(
+            run_logger, thr_index, thr_id, llm_response, proof_check_result, 0
+        )
+        failed = self.__failed_proofs(llm_response, proof_check_result)
+        attempts = len(llm_response)
+
+        if max_shots is not None: 
+            samples = [llm_response]
+            checked = sum(1 for result in proof_check_result if result is not None)
+            escalation_time = 0.0
+            round_index = 0
+            while successfull_proofs == 0 and sum(map(len, samples)) < max_shots: 
+                round_index += 1
+                round_shots = min(
+                    shots * options.escalation_factor ** round_index, 
+                    max_shots - sum(map(len, samples))
+                )
+                # 2.0 is the highest temperature the API accepts
+                temperature = min(2.0, 1.0 + options.temperature_step * round_index)
+                run_logger.on_shot_escalation(thr_index + 1, round_index, round_shots, temperature)
+
+                round_start_time = time.time()
+                run_logger.on_start_llm_response_fetch(thr_index, len(thr_ids))
+                llm_response = self.__send_statement(thr_index, thr_id, round_shots, temperature)
+                run_logger.on_end_llm_response_fetch()
+                escalation_time += time.time() - round_start_time
+
+                check_start_time = time.time()
+                llm_response, proof_check_result = self.__check_llm_response(
+                    run_logger, thr_ids, thr_index, round_shots, temperature, 
+                    early_exit, llm_response, None, None
+                )
+                check_time += time.time() - check_start_time
+                checked += sum(1 for result in proof_check_result if result is not None)
+                successfull_proofs += self.__log_check_results(
+                    run_logger, thr_index, thr_id, llm_response, 
+                    proof_check_result, sum(map(len, samples))
+                )
+                failed += self.__failed_proofs(llm_response, proof_check_result)
+                samples.append(llm_response)
+            attempts = sum(map(len, samples))
+
+            # The fixed-n baseline sends the prompt once and gets 
+            # `max_shots` completions of the same average length
+            prompt_tokens = self.__prompt_tokens(self.llm_prompt.theorem_store.statement(thr_id))
+            completion_tokens = [
+                self.token_counter.count(proof) for response in samples for proof in response
+            ]
+            average_completion = sum(completion_tokens) / max(1, len(completion_tokens))
+            # Checks the baseline would have made in addition, minus 
+            # the extra requests the escalation rounds took
+            saved_time = (
+                (max_shots - len(completion_tokens)) * check_time / max(1, checked) 
+                - escalation_time
+            )
+            run_logger.on_sampling_stats(
+                thr_index + 1, len(completion_tokens), max_shots, 
+                len(samples) * prompt_tokens + sum(completion_tokens), 
+                prompt_tokens + round(max_shots * average_completion), 
+                time.time() - start_time, saved_time
+            )
+
+        if successfull_proofs == 0 and options.repair_rounds > 0: 
+            successfull_proofs += self.__repair_proofs(
+                run_logger, thr_index, thr_id, failed, attempts, options
+            )
+
+        run_logger.on_theorem_proof_end(thr_id)
+
+        return successfull_proofs
+
+    def __failed_proofs(
+        self, 
+        llm_response: List[str], 
+        proof_check_result: List[Optional[Tuple[bool, str]]]
+    ) -> List[Tuple[str, str]]:
+        return [
+            (proof, check_result[1]) for proof, check_result in zip(llm_response, proof_check_result)
+            if check_result is not None and not check_result[0]
+        ]
+
+    def __send_repair(
+        self, 
+        thr_index: int, 
+        thr_id: int, 
+        proof: str, 
+        error_msg: str
+    ) -> List[str]:
+        """
+        Asks the LLM to fix the proof of the theorem, 
+        given the error Coq reported for it.
+        """
+        statement = self.llm_prompt.theorem_store.statement(thr_id)
+        history = self.llm_prompt.get_repair_history(statement, proof)
+        message = self.llm_prompt.get_repair_message(statement, proof, error_msg)
+        start_time = time.time()
+        llm_response = self.llm_interface.send_message_wout_history_change(
+            message=message, choices=1, history=history
+        )
+        if self.eval_logger is not None and self.eval_logger.records_metrics(): 
+            messages = [self.llm_prompt.get_system_message(), message]
+            messages.extend(entry["content"] for entry in history)
+            self.eval_logger.on_llm_request(
+                thr_index + 1, time.time() - start_time, 0.0, 
+                sum(self.token_counter.count(text) for text in messages), 
+                sum(self.token_counter.count(fixed) for fixed in llm_response), 
+                self.llm_interface.last_request_cached()
+            )
+        if self.proof_filter is not None: 
+            llm_response = self.proof_filter.sanitize(llm_response)
+        return llm_response
+
+    def __repair_proofs(
+        self, 
+        run_logger: EvalLogger, 
+        thr_index: int, 
+        thr_id: int, 
+        failed: List[Tuple[str, str]], 
+        attempt_offset: int, 
+        options: RunOptions
+    ) -> int:
+        """
+        Sends the most promising failed proofs back to the LLM 
+        with their errors, checks and logs the fixed proofs. 
+        Returns the amount of successfully checked proofs.
+        """
+        for round_index in range(1, options.repair_rounds + 1): 
+            ranking = self.llm_prompt.rank_repair_candidates(
+                [proof for proof, _ in failed], [error_msg for _, error_msg in failed]
+            )
+            chosen = [failed[index] for index in ranking[:options.repair_candidates]]
+            if len(chosen) == 0: 
+                break
+            run_logger.on_repair_round(thr_index + 1, round_index, len(chosen))
+            fixed_proofs = []
+            for proof, error_msg in chosen: 
+                fixed_proofs.extend(self.__send_repair(thr_index, thr_id, proof, error_msg))
+            try: 
+                proof_check_result = self.__verify_proofs(thr_index, thr_id, fixed_proofs, options.early_exit)
+            except ProofViewError as e: 
+                run_logger.on_proof_check_fail(e.message)
+                break
+            successfull_proofs = self.__log_check_results(
+                run_logger, thr_index, thr_id, fixed_proofs, 
+                proof_check_result, attempt_offset
+            )
+            if successfull_proofs > 0: 
+                return successfull_proofs
+            attempt_offset += len(fixed_proofs)
+            failed = self.__failed_proofs(fixed_proofs, proof_check_result)
+
+        return 0
+
+    def __check_llm_response(
+        self, 
+        run_logger: EvalLogger, 
+        thr_ids: List[int], 
+        thr_index: int, 
+        shots: int, 
+        temperature: Optional[float], 
+        early_exit: bool, 
+        llm_response: List[str], 
+        prechecked_result: Optional[List[Optional[Tuple[bool, str]]]], 
+        precheck_error: Optional[Exception]
+    ) -> Tuple[List[str], List[Optional[Tuple[bool, str]]]]:
+        """
+        Checks the proofs of the LLM response. If ProofView 
+        fails, a new response is fetched and checked instead. 
+        Returns the response that was checked in the end and 
+        the check results.
+        """
+        thr_id = thr_ids[thr_index]
+        verify_proofs_attempts = 3
+        proof_check_result = []
+        while verify_proofs_attempts > 0:
+            try: 
+                if precheck_error is not None: 
+                    error, precheck_error = precheck_error, None
+                    raise error
+                if prechecked_result is not None: 
+                    proof_check_result = prechecked_result
                     break
-                except ProofViewError as e:
-                    verify_proofs_attempts -= 1
-                    run_logger.on_proof_check_fail(e.message)
-                    run_logger.on_start_llm_response_fetch(thr_index, len(statements))
-                    llm_response = self.llm_interface.send_message_wout_history_change(
-                        message=statement, 
-                        choices=shots
-                    )
-                    run_logger.on_end_llm_response_fetch()
-                    run_logger.log(llm_response)
-                    if verify_proofs_attempts == 0: 
-                        raise e
-                    else: 
-                        continue
-                except Exception as e:
-                    run_logger.on_attempt_exception(0, thr_index + 1, str(e))
-                    run_logger.on_start_llm_response_fetch(thr_index, len(statements))
-                    llm_response = self.llm_interface.send_message_wout_history_change(
-                        message=statement, 
-                        choices=shots
-                    )
-                    run_logger.on_end_llm_response_fetch()
-                    run_logger.log(llm_response)
-                    self.llm_prompt.restart_proof_view()
-
-            for i, (proof_status, error_msg) in enumerate(proof_check_result):
-                if proof_status: 
-                    successfull_proofs += 1
-                    run_logger.on_success_attempt(
-                        i + 1, thr_index + 1, 
-                        statement, llm_response[i]
-                    )
+                proof_check_result = self.__verify_proofs(thr_index, thr_id, llm_response, early_exit)
+                break
+            except ProofViewError as e:
+                verify_proofs_attempts -= 1
+                run_logger.on_proof_check_fail(e.message)
+                run_logger.on_start_llm_response_fetch(thr_index, len(thr_ids))
+                # A cached response would be the same as the last one
+                self.llm_interface.refresh_next_request()
+                llm_response = self.__send_statement(thr_index, thr_id, shots, temperature)
+                run_logger.on_end_llm_response_fetch()
+                run_logger.log(llm_response)
+                if verify_proofs_attempts == 0: 
+                    raise e
                 else: 
-                    run_logger.on_failed_attempt(
-                        i + 1, thr_index + 1, 
-                        statement, llm_response[i], error_msg
-                    )
-            
-            run_logger.on_theorem_proof_end(statement, self.llm_prompt.correct_proofs[statement])
-    
-        run_logger.on_evaluation_finish()
+                    continue
+            except Exception as e:
+                run_logger.on_attempt_exception(0, thr_index + 1, str(e), e.__class__.__name__)
+                run_logger.on_start_llm_response_fetch(thr_index, len(thr_ids))
+                self.llm_interface.refresh_next_request()
+                llm_response = self.__send_statement(thr_index, thr_id, shots, temperature)
+                run_logger.on_end_llm_response_fetch()
+                run_logger.log(llm_response)
+                self.llm_prompt.restart_proof_view()
+                run_logger.on_proof_view_restart(thr_index + 1)
+
+        return llm_response, proof_check_result
+
+    def __log_check_results(
+        self, 
+        run_logger: EvalLogger, 
+        thr_index: int, 
+        thr_id: int, 
+        llm_response: List[str], 
+        proof_check_result: List[Optional[Tuple[bool, str]]], 
+        attempt_offset: int
+    ) -> int:
+        successfull_proofs = 0
+        for i, check_result in enumerate(proof_check_result):
+            if check_result is None: 
+                run_logger.on_cancelled_attempt(
+                    attempt_offset + i + 1, thr_index + 1, 
+                    thr_id, llm_response[i]
+                )
+                continue
+            proof_status, error_msg = check_result
+            if proof_status: 
+                successfull_proofs += 1
+                run_logger.on_success_attempt(
+                    attempt_offset + i + 1, thr_index + 1, 
+                    thr_id, llm_response[i]
+                )
+            else: 
+                run_logger.on_failed_attempt(
+                    attempt_offset + i + 1, thr_index + 1, 
+                    thr_id, llm_response[i], error_msg
+                )
 
-        return successfull_proofs / len(statements) if len(statements) != 0 else 0
-                    
\ No newline at end of file
+        return successfull_proofs
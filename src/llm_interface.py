@@ -1,4 +1,4 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 from .llm_prompt_interface import LLMPromptInterface
 
 class LLMInterface:
@@ -33,7 +33,11 @@ class LLMInterface:
         """
         pass
 
-    def send_message_wout_history_change(self, message: str, choices: int = 1) -> List[str]: 
+    def send_message_wout_history_change(
+        self, message: str, choices: int = 1, 
+        history: Optional[List[Dict[str, str]]] = None, 
+        temperature: Optional[float] = None
+    ) -> List[str]: 
         """
         Sends a message to the LLM and returns the response. 
         But garantees that the message history after the call 
@@ -41,6 +45,25 @@ class LLMInterface:
 
         :param message: The message to send to the LLM.
         :param choices: The number of choices to return. Defaults to 1.
+        :param history: If given, is used instead of the message history 
+            for this request. The system message is kept.
+        :param temperature: The sampling temperature for this request. 
+            If None, the default of the LLM is used.
         :return: A list of choices. 
         """
-        pass
\ No newline at end of file
+        pass
+
+    def last_request_cached(self) -> bool: 
+        """
+        Returns True if the last request made from the calling 
+        thread was answered without asking the LLM.
+        """
+        return False
+
+    def refresh_next_request(self) -> None: 
+        """
+        Asks for the next request made from the calling thread 
+        to be sent to the LLM even if its answer is cached, e.g. 
+        when the cached answer could not be checked. 
+        """
+        pass
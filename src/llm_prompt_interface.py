@@ -1,16 +1,38 @@
 from typing import List, Dict, Optional, Tuple
+from concurrent.futures import wait, FIRST_COMPLETED
+import threading
 import sys
 import logging
 from ..coqpylspclient import ProofView, ProofViewError
-from ..coqpylspclient import Range, Position
+from ..coqpylspclient import Range
 from ..coqpylspclient.coqlspclient.progress_bar import ProgressBar
+from .proof_view_pool import ProofViewPool
+from .proof_check_cache import ProofCheckCache
+from .coq_file_contents import get_coq_file_contents
+from .context_checkpoints import ContextCheckpoints
+from .parsed_file_cache import load_theorems, IndexedTheorem
+from .metrics_stream import error_class
+from .tactic_trie import PrefixSharingVerifier
+from .prompt_payload import PromptPayload, PromptPayloadCache
+from .theorem_store import TheoremStore
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("LLMPromptInterface")
 
+# Errors that come late in a proof first, the 
+# ones that mean it is far off the track last
+_repair_priority = {
+    "incomplete_proof": 0, "tactic_failure": 1, "unification": 2, "type_error": 3, 
+    "reference_not_found": 4, "timeout": 5, "other": 6, "syntax": 7
+}
+
 
 class LLMPromptInterface:
+    # Whether the prompt needs the theorems as parsed by 
+    # ProofView, with their proof steps, in theorems_from_file
+    keeps_parsed_theorems = False
+
     def __init__(
         self, 
         path_to_coq_file: str, 
@@ -18,43 +40,85 @@ class LLMPromptInterface:
         train_theorems: List[str],
         test_theorems: List[str],
         proof_view: Optional[ProofView] = None,
-        progress_bar: ProgressBar = None
+        progress_bar: ProgressBar = None,
+        proof_view_workers: int = 1,
+        proof_check_cache: Optional[ProofCheckCache] = None,
+        incremental_context: bool = False,
+        prefix_sharing: bool = False,
+        theorems: Optional[List[IndexedTheorem]] = None
     ) -> None:
-        self.proof_view = proof_view if proof_view is not None else ProofView(
-            path_to_coq_file, path_to_root_dir, prog_bar=progress_bar
-        )
+        # The ProofView is started on first use, as with a cached 
+        # theorem index it is not needed until the first check
+        self.__proof_view = proof_view
+        self.__proof_view_lock = threading.Lock()
         self.coq_file = path_to_coq_file
+        self.file_contents = get_coq_file_contents(path_to_coq_file)
         self.root_dir = path_to_root_dir
         self.prompt_strategy = self.__class__.__name__
         self.progress_bar = progress_bar
+        # With more than one worker, proofs are checked 
+        # in parallel by a pool of coq-lsp sessions
+        self.proof_view_pool = ProofViewPool(
+            path_to_coq_file, path_to_root_dir, 
+            size=proof_view_workers, progress_bar=progress_bar
+        ) if proof_view_workers > 1 else None
+        self.proof_check_cache = proof_check_cache
+        self.__last_verification = threading.local()
 
-        logger.info(f"Start preprocessing {self.coq_file} to obtain the training info.")
-        self.theorems_from_file = self.proof_view.parse_file()
+        # The caller may already hold the theorems of the 
+        # file, e.g. the server keeps them per file session
+        if theorems is None: 
+            logger.info(f"Start preprocessing {self.coq_file} to obtain the training info.")
+            theorems, self.__proof_view = load_theorems(
+                path_to_coq_file, path_to_root_dir, 
+                proof_view=self.__proof_view, progress_bar=progress_bar
+            )
 
         self.train_theorems = train_theorems
         self.test_theorems = test_theorems
 
-        self.theorems_for_eval = list(
-            filter(
-                lambda th: th.name in self.test_theorems, 
-                self.theorems_from_file
-            )
-        )
-        self.correct_proofs = {
-            theorem.statement : theorem.proof.only_text() 
-            for theorem in self.theorems_from_file
-        }
+        # The theorems are kept as spans of the text of the file. 
+        # The theorem index has no proof steps, so the prompts that 
+        # need them parse the file
+        self.theorem_store = TheoremStore(self.file_contents, theorems)
+        self.theorems_from_file = self.proof_view.parse_file() if self.keeps_parsed_theorems else None
+        self.train_ids = self.theorem_store.ids_with_names(self.train_theorems)
+        self.eval_ids = self.theorem_store.ids_with_names(self.test_theorems)
+        self.theorems_for_eval = [self.theorem_store.records[thr_id] for thr_id in self.eval_ids]
 
-        try: 
-            self.statements_to_ranges = {
-                theorem.statement : Range(
-                    start=theorem.statement_range.start, 
-                    end=theorem.proof.end_pos.end
-                )
-                for theorem in self.theorems_for_eval
-            }
-        except AttributeError:
+        if any(not record.has_proof for record in self.theorems_for_eval): 
             raise Exception("Some theorems in the file do not have proofs.")
+        # The theorems to evaluate are referred to by their ids, 
+        # the logs look their ranges up as dict keys, so there 
+        # is one Range object per theorem
+        self.eval_ranges: Dict[int, Range] = {
+            thr_id: self.theorem_store.range(thr_id) for thr_id in self.eval_ids
+        }
+
+        # In the incremental mode candidates are checked against 
+        # the checkpoint before the theorem, where the proofs 
+        # above it are not re-elaborated
+        self.context_checkpoints = ContextCheckpoints(
+            self.file_contents, theorems
+        ) if incremental_context else None
+
+        # With prefix sharing the tactics shared by the candidates 
+        # of a theorem are checked once, see PrefixSharingVerifier
+        self.prefix_verifier = PrefixSharingVerifier() if prefix_sharing else None
+        self.prompt_payloads = PromptPayloadCache()
+        self.__default_payload = None
+
+    @property
+    def proof_view(self) -> ProofView:
+        with self.__proof_view_lock:
+            if self.__proof_view is None: 
+                self.__proof_view = ProofView(self.coq_file, self.root_dir, prog_bar=self.progress_bar)
+            return self.__proof_view
+
+    @proof_view.setter
+    def proof_view(self, proof_view: ProofView) -> None:
+        with self.__proof_view_lock:
+            self.__proof_view = proof_view
 
     def get_system_message(self) -> str: 
         """
@@ -68,20 +132,118 @@ class LLMPromptInterface:
         """
         pass
 
+    def get_msg_history_for_theorem(self, thr_st: str) -> Optional[List[Dict[str, str]]]:
+        """
+        Gets the message history to use when asking the LLM 
+        to prove the given theorem. None means the history 
+        from get_msg_history is used, which is the default.
+        """
+        return None
+
+    def get_prompt_payload(self, thr_st: str) -> PromptPayload:
+        """
+        Gets the system message and the message history to ask 
+        for a proof of the theorem with, as a payload shared by 
+        all the theorems with the same history.
+        """
+        system_message = {"role": "system", "content": self.get_system_message()}
+        history = self.get_msg_history_for_theorem(thr_st)
+        if history is not None: 
+            return self.prompt_payloads.get(system_message, history)
+        # The default history is the same for all the theorems, 
+        # so it is built once
+        if self.__default_payload is None: 
+            self.__default_payload = self.prompt_payloads.get(system_message, self.get_msg_history())
+        return self.__default_payload
+
+    def get_repair_history(self, thr_st: str, proof: str) -> List[Dict[str, str]]:
+        """
+        Gets the message history to use when asking the LLM 
+        to repair a failed proof of the theorem: the history 
+        for the theorem followed by the theorem and the proof.
+        """
+        history = self.get_msg_history_for_theorem(thr_st)
+        if history is None: 
+            history = self.get_msg_history()
+        return history + [
+            {"role": "user", "content": thr_st}, 
+            {"role": "assistant", "content": proof}
+        ]
+
+    def get_repair_message(self, thr_st: str, proof: str, error_msg: str) -> str:
+        """
+        Gets the message asking the LLM to repair the proof 
+        it gave, given the error Coq reported for it.
+        """
+        return (f'Coq rejected this proof with the error: {error_msg}\n'
+                'Fix the proof. Answer with the whole corrected proof, '
+                'it should start with "Proof." and end with "Qed.".')
+
+    def __get_theorem_context(self, thr_st: str) -> str:
+        """
+        Returns the text of the file preceding the theorem.
+        """
+        thr_line_index = self.eval_ranges[self.eval_id_of(thr_st)].start.line
+        if self.context_checkpoints is not None: 
+            return self.context_checkpoints.checkpoint(thr_line_index)
+        return self.file_contents.prefix(thr_line_index)
+
+    def __check_keys(self, context: str, thr_st: str, proofs: List[str]) -> List[str]:
+        """
+        Returns a key per proof such that equal keys mean 
+        equal check results: normalized proof hashes when 
+        the proof check cache is used, the proofs otherwise. 
+        """
+        if self.proof_check_cache is None: 
+            return list(proofs)
+        context_hash = ProofCheckCache.context_hash(self.root_dir, context)
+        return [self.proof_check_cache.key(context_hash, thr_st, proof) for proof in proofs]
+
+    def __lookup_checks(
+        self, 
+        keys: List[str], 
+        proofs: List[str]
+    ) -> Tuple[Dict[str, Tuple[bool, str]], Dict[str, str]]:
+        """
+        Deduplicates the proofs by their keys and looks them up 
+        in the proof check cache. Returns the known results and 
+        the proofs (one per key) that still have to be checked.
+        """
+        known: Dict[str, Tuple[bool, str]] = {}
+        to_check: Dict[str, str] = {}
+        for key, proof in zip(keys, proofs): 
+            if key in known or key in to_check: 
+                continue
+            cached = self.proof_check_cache.get(key) if self.proof_check_cache is not None else None
+            if cached is not None: 
+                known[key] = cached
+            else: 
+                to_check[key] = proof
+        self.__last_verification.cache_hits = len(known)
+        return known, to_check
+
+    def __store_check(self, key: str, result: Tuple[bool, str]) -> None:
+        if self.proof_check_cache is not None: 
+            self.proof_check_cache.put(key, result)
+
     def verify_proof(self, thr_st: str, proof: str) -> Tuple[bool, str]:
         """
         Verifies the proof using the ProofView class.
         """
-        context = ""
-        if self.statements_to_ranges is not None:
-            with open(self.coq_file, "r") as f:
-                context = f.read()                
-                thr_line_index = self.statements_to_ranges[thr_st].start.line
-                context = "\n".join(context.split('\n')[:thr_line_index])
-                
+        context = self.__get_theorem_context(thr_st)
+        key = self.__check_keys(context, thr_st, [proof])[0]
+        known, _ = self.__lookup_checks([key], [proof])
+        if key in known: 
+            return known[key]
         check_proof = self.proof_view.check_proof(thr_st, proof, context)
+        self.__store_check(key, check_proof)
         return check_proof
 
+    def __check_batch(self, context: str, thr_st: str, proofs: List[str]) -> List[Tuple[bool, str]]:
+        if self.proof_view_pool is not None: 
+            return self.proof_view_pool.check_proofs(context, thr_st, proofs)
+        return self.proof_view.check_proofs(context, thr_st, proofs)
+
     def verify_proofs(self, thr_st: str, proofs: List[str]) -> List[Tuple[bool, str]]:
         """
         Verifies k proofs using the ProofView class. Return 
@@ -90,23 +252,182 @@ class LLMPromptInterface:
         the error message if the verification failed.
         Either verification stops when the first proof is
         verified or all proofs are verified and failed.
+        Identical proofs are checked only once and, if a 
+        proof check cache is set, proofs that were checked 
+        before in the same context are not checked at all.
         """
-        context = ""
-        if self.statements_to_ranges is not None:
-            with open(self.coq_file, "r") as f:
-                context = f.read()                
-                thr_line_index = self.statements_to_ranges[thr_st].start.line
-                context = "\n".join(context.split('\n')[:thr_line_index])
-                
-        result = self.proof_view.check_proofs(context, thr_st, proofs)
-        return result
+        context = self.__get_theorem_context(thr_st)
+        keys = self.__check_keys(context, thr_st, proofs)
+        known, to_check = self.__lookup_checks(keys, proofs)
+        if len(to_check) > 0: 
+            proofs_to_check = list(to_check.values())
+            if self.prefix_verifier is not None: 
+                checked = self.prefix_verifier.verify(
+                    lambda proofs_batch: self.__check_batch(context, thr_st, proofs_batch), 
+                    proofs_to_check
+                )
+            else: 
+                checked = self.__check_batch(context, thr_st, proofs_to_check)
+            for key, check_result in zip(to_check.keys(), checked): 
+                self.__store_check(key, check_result)
+                known[key] = check_result
+
+        return [known[key] for key in keys]
+
+    def last_verification_cache_hits(self) -> int:
+        """
+        Returns how many distinct proofs the last verification 
+        made from the calling thread took from the proof check 
+        cache instead of checking them.
+        """
+        return getattr(self.__last_verification, "cache_hits", 0)
+
+    def rank_proofs(self, proofs: List[str]) -> List[int]:
+        """
+        Returns the indexes of the proofs in the order they 
+        should be checked in when we are only interested in 
+        the first correct one. The score is cheap on purpose: 
+        proofs that give up (admit, Admitted, Abort) go last, 
+        shorter proofs go first as they are faster to check.
+        """
+        def score(index: int) -> Tuple[bool, int, int]:
+            proof = proofs[index]
+            gives_up = any(word in proof for word in ("admit", "Admitted", "Abort"))
+            return (gives_up, len(proof), index)
+
+        return sorted(range(len(proofs)), key=score)
+
+    def rank_repair_candidates(self, proofs: List[str], error_msgs: List[str]) -> List[int]:
+        """
+        Returns the indexes of the failed proofs in the order 
+        they are worth repairing in. Proofs that give up and 
+        repeated proofs are left out. Proofs that failed late 
+        (goals left, a failed tactic) go before the ones that 
+        are far off (unknown names, syntax errors), shorter 
+        proofs go first within the same class of errors.
+        """
+        def score(index: int) -> Tuple[int, int, int]:
+            priority = _repair_priority.get(error_class(error_msgs[index]), len(_repair_priority))
+            return (priority, len(proofs[index]), index)
+
+        candidates, seen = [], set()
+        for index, proof in enumerate(proofs): 
+            if proof in seen or any(word in proof for word in ("admit", "Admitted", "Abort")): 
+                continue
+            seen.add(proof)
+            candidates.append(index)
+        return sorted(candidates, key=score)
+
+    def verify_proofs_until_success(
+        self, 
+        thr_st: str, 
+        proofs: List[str], 
+        ranked: bool = True
+    ) -> List[Optional[Tuple[bool, str]]]:
+        """
+        Verifies the proofs until the first one is accepted. 
+        When a pool of ProofView workers is available, the 
+        candidates race against each other on all the workers, 
+        with `ranked` set in the order given by rank_proofs, 
+        otherwise in the original order. Without a pool the 
+        proofs are checked with verify_proofs instead: checking 
+        them one by one would send the context of the theorem to 
+        coq-lsp for every proof, which is slower than a single 
+        batched check unless one of the first proofs is accepted. 
+        Returns a list of the same length as `proofs` with 
+        the (bool, str) result of every check that was made 
+        and None for the checks that were cancelled because 
+        another proof had already been accepted.
+        """
+        if self.proof_view_pool is None: 
+            return self.verify_proofs(thr_st, proofs)
+
+        context = self.__get_theorem_context(thr_st)
+        keys = self.__check_keys(context, thr_st, proofs)
+        known, to_check = self.__lookup_checks(keys, proofs)
+        if not any(status for status, _ in known.values()): 
+            self.__race_proofs(context, thr_st, to_check, known, ranked)
+
+        return [known.get(key) for key in keys]
+
+    def __race_proofs(
+        self, 
+        context: str, 
+        thr_st: str, 
+        to_check: Dict[str, str], 
+        known: Dict[str, Tuple[bool, str]], 
+        ranked: bool
+    ) -> None:
+        """
+        Checks the proofs from `to_check` on the pool until the 
+        first one is accepted and puts the results into `known`.
+        """
+        keys = list(to_check.keys())
+        proofs = list(to_check.values())
+        order = self.rank_proofs(proofs) if ranked else list(range(len(proofs)))
+
+        def accept(index: int, check_result: Tuple[bool, str]) -> None:
+            self.__store_check(keys[index], check_result)
+            known[keys[index]] = check_result
+
+        futures = {
+            self.proof_view_pool.submit_proof_check(thr_st, proofs[index], context): index
+            for index in order
+        }
+        pending = set(futures.keys())
+        try: 
+            while pending: 
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                accepted = False
+                for future in done: 
+                    accept(futures[future], future.result())
+                    accepted = accepted or future.result()[0]
+                if accepted: 
+                    break
+        finally: 
+            for future in pending: 
+                # Checks that managed to finish meanwhile are still reported
+                if not future.cancel() and future.done() and future.exception() is None: 
+                    accept(futures[future], future.result())
+
+    def supports_concurrent_verification(self) -> bool:
+        """
+        Returns True if verify_proofs may be called for 
+        different theorems from several threads at once.
+        """
+        return self.proof_view_pool is not None
     
-    def get_theorems_for_evaluation(self) -> List[str]:
+    def get_theorems_for_evaluation(self) -> List[int]:
+        """
+        Returns the ids of the theorems on which we 
+        want to evaluate the LLM, see theorem_store.
+        """
+        return list(self.eval_ids)
+
+    def eval_id_of(self, thr_st: str) -> int:
+        """
+        Returns the id of the theorem to evaluate with the 
+        statement, of the last one if there are several. 
+        Raises KeyError if there is none.
+        """
+        thr_id = self.theorem_store.id_of(thr_st)
+        if thr_id in self.eval_ranges: 
+            return thr_id
+        # The statement is repeated outside of the theorems to evaluate
+        for other in reversed(self.eval_ids): 
+            if self.theorem_store.statement(other) == thr_st: 
+                return other
+        raise KeyError(thr_st)
+
+    def release_proof_view(self) -> None:
         """
-        Returns the list of theorems on which we 
-        want to evaluate the LLM.
+        Stops the ProofView to free its coq-lsp process. 
+        A new one is started when a proof is checked again.
         """
-        return [theorem.statement for theorem in self.theorems_for_eval]
+        with self.__proof_view_lock:
+            if self.__proof_view is not None: 
+                self.__proof_view.exit()
+                self.__proof_view = None
 
     def restart_proof_view(self) -> None:
         """
@@ -118,4 +439,9 @@ class LLMPromptInterface:
         """
         Free up resources.
         """
-        self.proof_view.exit()
\ No newline at end of file
+        if self.__proof_view is not None: 
+            self.__proof_view.exit()
+        if self.proof_view_pool is not None: 
+            self.proof_view_pool.exit()
+        if self.proof_check_cache is not None: 
+            self.proof_check_cache.close()
\ No newline at end of file
@@ -0,0 +1,113 @@
+from ..coqpylspclient import ProofView, Range
+from .parsed_file_cache import load_theorems
+from .coq_file_contents import get_coq_file_contents
+from .theorem_store import TheoremStore
+from typing import Any, Callable, Dict, List, Tuple
+import tracemalloc
+import json
+import gc
+import sys
+
+"""
+Memory taken by the theorem data of a prompt, before and after
+it was moved to TheoremStore:
+
+    python3 -m src.memory_benchmark <root_dir> <coq_file> [<coq_file> ...]
+
+`legacy` is what LLMPromptInterface used to keep: the theorems
+as parsed by ProofView, with their proof steps, a dict from every
+statement to its proof text and a dict from the statements of the
+evaluated theorems to their ranges. `compact` is the store, built
+from the theorem index, with the ranges of the evaluated theorems
+keyed by theorem id, which is all the prompt keeps now. The text
+of the file is shared by both and is not counted. All the
+theorems of a file are taken as evaluated, which is the worst
+case for the ranges.
+"""
+
+
+def _legacy(proof_view: ProofView) -> Any:
+    theorems = proof_view.parse_file()
+    correct_proofs = {
+        theorem.statement: theorem.proof.only_text()
+        for theorem in theorems if theorem.proof is not None
+    }
+    statements_to_ranges = {
+        theorem.statement: Range(start=theorem.statement_range.start, end=theorem.proof.end_pos.end)
+        for theorem in theorems if theorem.proof is not None
+    }
+    return theorems, correct_proofs, statements_to_ranges
+
+
+def _compact(coq_file: str, root_dir: str) -> Any:
+    theorems, _ = load_theorems(coq_file, root_dir)
+    store = TheoremStore(get_coq_file_contents(coq_file), theorems)
+    eval_ids = [record.id for record in store if record.has_proof]
+    ranges = {thr_id: store.range(thr_id) for thr_id in eval_ids}
+    return store, ranges
+
+
+def _retained(build: Callable[[], Any]) -> int:
+    """
+    Bytes still allocated by `build` once it returned,
+    with the garbage it made collected.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        kept = build()
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+        del kept
+    finally:
+        tracemalloc.stop()
+    return after - before
+
+
+def measure_file(coq_file: str, root_dir: str) -> Dict[str, Any]:
+    # Start coq-lsp, save the theorem index and read the
+    # file once outside of the measurement
+    proof_view = ProofView(coq_file, root_dir)
+    theorems, _ = load_theorems(coq_file, root_dir, proof_view=proof_view)
+    get_coq_file_contents(coq_file)
+
+    try:
+        legacy = _retained(lambda: _legacy(proof_view))
+    finally:
+        proof_view.exit()
+    compact = _retained(lambda: _compact(coq_file, root_dir))
+    return {
+        "file": coq_file,
+        "theorems": len(theorems),
+        "legacy_bytes": legacy,
+        "compact_bytes": compact,
+        "reduction": 1 - compact / legacy if legacy > 0 else 0.0
+    }
+
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    lines = []
+    for result in results:
+        per_theorem: Tuple[float, float] = tuple(
+            result[key] / max(result["theorems"], 1) for key in ("legacy_bytes", "compact_bytes")
+        )
+        lines.append(
+            f"{result['file']}: {result['theorems']} theorems, "
+            f"{result['legacy_bytes'] / 1024:.1f} KiB -> {result['compact_bytes'] / 1024:.1f} KiB "
+            f"({per_theorem[0]:.0f} -> {per_theorem[1]:.0f} bytes per theorem, "
+            f"{100 * result['reduction']:.1f}% less)"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    """
+    The workspace root and the Coq files to measure.
+    """
+    root_dir: str = sys.argv[1]
+    coq_files: List[str] = sys.argv[2:]
+
+    results = [measure_file(coq_file, root_dir) for coq_file in coq_files]
+    print(format_results(results))
+    print(json.dumps(results, indent=4))
@@ -0,0 +1,150 @@
+from typing import Any, Dict, List, Optional
+import json
+import math
+import sys
+
+"""
+Summarizes the metrics stream of one or several runs, written
+by Interactor.run(RunOptions(..., metrics_path=...)):
+
+    python3 -m src.metrics_report metrics.jsonl [more.jsonl ...]
+
+Prints the p50/p95 latencies of the LLM requests, the proof
+checks and the whole theorems, the throughput, the token counts,
+the cache hit rates and the failed attempts by error class.
+"""
+
+
+def load_events(path: str) -> List[Dict[str, Any]]:
+    events = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                # The last line of a crashed run may be cut off
+                continue
+    return events
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    The q-th percentile (0 <= q <= 100) with linear
+    interpolation between the closest ranks.
+    """
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    by_kind: Dict[str, List[Dict[str, Any]]] = {}
+    for event in events:
+        by_kind.setdefault(event["event"], []).append(event)
+
+    def values(kind: str, field: str) -> List[float]:
+        return [event[field] for event in by_kind.get(kind, []) if event.get(field) is not None]
+
+    def latency(samples: List[float]) -> Dict[str, Optional[float]]:
+        return {
+            "count": len(samples), "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95), "max": max(samples) if samples else None
+        }
+
+    theorems = by_kind.get("theorem", [])
+    attempts = by_kind.get("attempt", [])
+    requests = by_kind.get("llm_request", [])
+    verifications = by_kind.get("verification", [])
+    # Runs are timed separately, so merged streams do not count the gaps between them
+    wall_time, run_start = 0.0, None
+    for event in events:
+        if event["event"] == "run_start":
+            run_start = event["time"]
+        elif event["event"] == "run_end" and run_start is not None:
+            wall_time += event["time"] - run_start
+            run_start = None
+    if wall_time == 0.0 and len(events) > 0:
+        wall_time = max(event["time"] for event in events) - min(event["time"] for event in events)
+
+    per_candidate = [
+        event["seconds"] / event["candidates"] for event in verifications if event.get("candidates")
+    ]
+    error_classes: Dict[str, int] = {}
+    for event in attempts:
+        if event["status"] in ("failure", "exception"):
+            name = event.get("error_class") or "unknown"
+            error_classes[name] = error_classes.get(name, 0) + 1
+
+    candidates = sum(event["candidates"] for event in verifications)
+    return {
+        "wall_seconds": wall_time,
+        "theorems": len(theorems),
+        "solved": sum(1 for event in theorems if event.get("solved")),
+        "theorems_per_second": len(theorems) / wall_time if wall_time > 0 else None,
+        "attempts_per_second": len(attempts) / wall_time if wall_time > 0 else None,
+        "theorem_seconds": latency(values("theorem", "seconds")),
+        "llm_request_seconds": latency(values("llm_request", "seconds")),
+        "queue_wait_seconds": latency(values("llm_request", "queue_wait")),
+        "verification_seconds": latency(values("verification", "seconds")),
+        "verification_seconds_per_candidate": latency(per_candidate),
+        "tokens_in": sum(values("llm_request", "tokens_in")),
+        "tokens_out": sum(values("llm_request", "tokens_out")),
+        "llm_cache_hit_rate": (
+            sum(1 for event in requests if event.get("cache_hit")) / len(requests) if requests else None
+        ),
+        "check_cache_hit_rate": (
+            sum(event["cache_hits"] for event in verifications) / candidates if candidates else None
+        ),
+        "proof_view_restarts": len(by_kind.get("proof_view_restart", [])),
+        "attempts": {
+            status: sum(1 for event in attempts if event["status"] == status)
+            for status in ("success", "failure", "cancelled", "exception")
+        },
+        "error_classes": dict(sorted(error_classes.items(), key=lambda item: -item[1])),
+    }
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    def number(value: Optional[float], unit: str = "") -> str:
+        return "-" if value is None else f"{value:.3f}{unit}"
+
+    lines = [
+        f"Theorems: {summary['theorems']} ({summary['solved']} solved) in {number(summary['wall_seconds'], 's')}",
+        f"Throughput: {number(summary['theorems_per_second'])} theorems/s, "
+        f"{number(summary['attempts_per_second'])} attempts/s",
+        "",
+        f"{'latency':<36}{'count':>8}{'p50':>10}{'p95':>10}{'max':>10}",
+    ]
+    for name in (
+        "theorem_seconds", "llm_request_seconds", "queue_wait_seconds",
+        "verification_seconds", "verification_seconds_per_candidate"
+    ):
+        stats = summary[name]
+        lines.append(
+            f"{name:<36}{stats['count']:>8}{number(stats['p50']):>10}"
+            f"{number(stats['p95']):>10}{number(stats['max']):>10}"
+        )
+    lines += [
+        "",
+        f"Tokens: {summary['tokens_in']} in, {summary['tokens_out']} out",
+        f"Cache hit rate: {number(summary['llm_cache_hit_rate'])} LLM, "
+        f"{number(summary['check_cache_hit_rate'])} proof checks",
+        f"ProofView restarts: {summary['proof_view_restarts']}",
+        "Attempts: " + ", ".join(f"{count} {status}" for status, count in summary["attempts"].items()),
+        "Errors: " + (", ".join(
+            f"{count} {name}" for name, count in summary["error_classes"].items()
+        ) or "none"),
+    ]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    events = []
+    for path in sys.argv[1:]:
+        events.extend(load_events(path))
+    print(format_summary(summarize(events)))
@@ -0,0 +1,79 @@
+from typing import Any, Dict, Optional
+import threading
+import json
+import time
+import re
+import os
+
+
+_error_classes = [
+    ("prefilter", re.compile(r"^Rejected before checking")),
+    # Failures of coq-lsp itself, before the ones of the proof
+    ("crash", re.compile(r"coq-lsp|[Cc]rash|[Bb]roken pipe|[Cc]onnection (?:reset|refused|closed)|[Ss]erver (?:error|exited|died)")),
+    ("timeout", re.compile(r"[Tt]imeout|[Tt]imed out")),
+    ("syntax", re.compile(r"[Ss]yntax error|[Ll]exer")),
+    ("reference_not_found", re.compile(r"reference .* was not found|[Uu]nbound|not found in the current environment")),
+    ("unification", re.compile(r"[Uu]nable to unify|[Cc]annot unify|[Ii]mpossible to unify")),
+    ("type_error", re.compile(r"has type .* while it is expected|[Ii]llegal application|not a.*type")),
+    ("incomplete_proof", re.compile(r"[Ii]ncomplete proof|[Nn]o such goal|[Aa]ttempt to save|[Uu]nfocused|remaining goals")),
+    ("tactic_failure", re.compile(r"[Tt]actic failure|[Nn]o applicable tactic|[Nn]o matching clauses|failed")),
+]
+
+
+def error_class(error_msg: Optional[str]) -> Optional[str]:
+    """
+    Puts a Coq error message into a coarse class, so that the
+    failures of a run can be counted by their cause.
+    """
+    if error_msg is None:
+        return None
+    for name, pattern in _error_classes:
+        if pattern.search(error_msg):
+            return name
+    return "other"
+
+
+class MetricsStream:
+    def __init__(self, path: str) -> None:
+        """
+        Writes the events of a run as JSON lines, one object per
+        event with its name under "event" and the wall-clock time
+        under "time". The file is appended to and flushed after
+        every event, so a run that crashed can still be analyzed.
+        Numeric amounts can be accumulated per theorem and
+        emitted together once the theorem is done.
+
+        :param path: Path to the JSONL file.
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.__file = open(path, "a")
+        self.__lock = threading.Lock()
+        self.__theorems: Dict[int, Dict[str, Any]] = {}
+
+    def emit(self, event: str, **fields: Any) -> None:
+        record = {"event": event, "time": time.time()}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.write(line)
+                self.__file.flush()
+
+    def add(self, thr_ind: int, **amounts: float) -> None:
+        with self.__lock:
+            totals = self.__theorems.setdefault(thr_ind, {})
+            for name, amount in amounts.items():
+                totals[name] = totals.get(name, 0) + amount
+
+    def pop_theorem(self, thr_ind: int) -> Dict[str, Any]:
+        with self.__lock:
+            return self.__theorems.pop(thr_ind, {})
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
@@ -0,0 +1,100 @@
+from .llm_interface import LLMInterface
+from .async_llm_interface import AsyncLLMInterface
+from .llm_prompt_interface import LLMPromptInterface
+from typing import List, Dict, Optional, Tuple, AsyncIterator
+import asyncio
+import time
+
+
+class MockLLMBackend:
+    def __init__(
+        self, 
+        responses: Optional[Dict[str, List[str]]] = None, 
+        default_response: str = "Proof. auto. Qed.", 
+        latency: float = 0.0, 
+        per_choice_latency: float = 0.0
+    ) -> None:
+        """
+        A deterministic local stand-in for an LLM, used to 
+        benchmark the pipeline offline. For a message it answers 
+        with the proofs from `responses` (cycled if more choices 
+        are requested than stored), or with `default_response`. 
+        A request takes `latency` seconds plus `per_choice_latency` 
+        seconds per choice; when streaming, the i-th choice is 
+        complete after latency + (i + 1) * per_choice_latency.
+
+        :param responses: Maps messages (statements) to the proofs to return.
+        :param default_response: The proof returned for unknown messages.
+        :param latency: Time to the first token of a request, in seconds.
+        :param per_choice_latency: Time to generate a single choice, in seconds.
+        """
+        self.responses = responses if responses is not None else {}
+        self.default_response = default_response
+        self.latency = latency
+        self.per_choice_latency = per_choice_latency
+        self.requests = 0
+
+    def get_choices(self, message: str, choices: int) -> List[str]:
+        self.requests += 1
+        proofs = self.responses.get(message)
+        if not proofs: 
+            return [self.default_response] * choices
+        return [proofs[i % len(proofs)] for i in range(choices)]
+
+    def request_time(self, choices: int) -> float:
+        return self.latency + self.per_choice_latency * choices
+
+
+class MockLLM(LLMInterface):
+    def __init__(self, backend: Optional[MockLLMBackend] = None) -> None:
+        self.backend = backend if backend is not None else MockLLMBackend()
+        self.history = []
+        self.model = "mock"
+
+    def init_history(self, llm_prompt: LLMPromptInterface) -> None:
+        self.history.append({"role": "system", "content": llm_prompt.get_system_message()})
+        self.history.extend(llm_prompt.get_msg_history())
+
+    def send_message_for_response(self, message: str, choices: int = 1) -> List[str]:
+        responses = self.send_message_wout_history_change(message, choices=choices)
+        self.history.append({"role": "user", "content": message})
+        self.history.append({"role": "assistant", "content": responses[0]})
+        return responses
+
+    def send_message_wout_history_change(
+        self, message: str, choices: int = 1, 
+        history: Optional[List[Dict[str, str]]] = None, 
+        temperature: Optional[float] = None
+    ) -> List[str]:
+        time.sleep(self.backend.request_time(choices))
+        return self.backend.get_choices(message, choices)
+
+
+class AsyncMockLLM(AsyncLLMInterface):
+    def __init__(self, backend: Optional[MockLLMBackend] = None) -> None:
+        self.backend = backend if backend is not None else MockLLMBackend()
+        self.history = []
+        self.model = "mock"
+
+    def init_history(self, llm_prompt: LLMPromptInterface) -> None:
+        self.history.append({"role": "system", "content": llm_prompt.get_system_message()})
+        self.history.extend(llm_prompt.get_msg_history())
+
+    async def send_message_wout_history_change(
+        self, message: str, choices: int = 1, 
+        history: Optional[List[Dict[str, str]]] = None, 
+        temperature: Optional[float] = None
+    ) -> List[str]:
+        await asyncio.sleep(self.backend.request_time(choices))
+        return self.backend.get_choices(message, choices)
+
+    async def stream_message_wout_history_change(
+        self, message: str, choices: int = 1, 
+        history: Optional[List[Dict[str, str]]] = None, 
+        temperature: Optional[float] = None
+    ) -> AsyncIterator[Tuple[int, str]]:
+        proofs = self.backend.get_choices(message, choices)
+        await asyncio.sleep(self.backend.latency)
+        for index, proof in enumerate(proofs): 
+            await asyncio.sleep(self.backend.per_choice_latency)
+            yield index, proof
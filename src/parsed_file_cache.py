@@ -0,0 +1,168 @@
+from typing import Any, Dict, List, Optional, Tuple
+from ..coqpylspclient import ProofView, Range, Position
+from ..coqpylspclient.coqlspclient.coq_lsp_structs import Theorem
+from ..coqpylspclient.coqlspclient.progress_bar import ProgressBar
+import hashlib
+import logging
+import json
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("ParsedFileCache")
+
+CACHE_DIR_NAME = ".coq_llm_cache"
+# Bumped when the layout of the saved index changes
+INDEX_VERSION = 1
+
+
+class IndexedProof:
+    __slots__ = ("text", "end_pos", "is_incomplete")
+
+    def __init__(self, text: str, end_pos: Range, is_incomplete: bool) -> None:
+        """
+        The part of a parsed proof kept in the theorem index: its
+        text, the range of its last sentence and whether it ends
+        with Admitted. The proof steps with their goals are not kept.
+        """
+        self.text = text
+        self.end_pos = end_pos
+        self.is_incomplete = is_incomplete
+
+    def only_text(self) -> str:
+        return self.text
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class IndexedTheorem:
+    __slots__ = ("name", "statement_range", "statement", "proof")
+
+    def __init__(
+        self, name: str, statement_range: Range,
+        statement: str, proof: Optional[IndexedProof]
+    ) -> None:
+        """
+        A theorem as saved in the theorem index, with the
+        attributes of a parsed Theorem that the package uses.
+        """
+        self.name = name
+        self.statement_range = statement_range
+        self.statement = statement
+        self.proof = proof
+
+
+def _range_to_json(range_: Range) -> List[int]:
+    return [range_.start.line, range_.start.character, range_.end.line, range_.end.character]
+
+
+def _range_from_json(values: List[int]) -> Range:
+    start_line, start_character, end_line, end_character = (int(value) for value in values)
+    return Range(
+        start=Position(start_line, start_character),
+        end=Position(end_line, end_character)
+    )
+
+
+def _theorem_to_json(theorem: Theorem) -> Dict[str, Any]:
+    proof = theorem.proof
+    return {
+        "name": theorem.name,
+        "statement": theorem.statement,
+        "statement_range": _range_to_json(theorem.statement_range),
+        "proof": None if proof is None else {
+            "text": proof.only_text(),
+            "end_pos": _range_to_json(proof.end_pos),
+            "is_incomplete": bool(proof.is_incomplete)
+        }
+    }
+
+
+def _theorem_from_json(entry: Dict[str, Any]) -> IndexedTheorem:
+    proof = entry["proof"]
+    return IndexedTheorem(
+        str(entry["name"]), _range_from_json(entry["statement_range"]), str(entry["statement"]),
+        None if proof is None else IndexedProof(
+            str(proof["text"]), _range_from_json(proof["end_pos"]), bool(proof["is_incomplete"])
+        )
+    )
+
+
+def file_key(path_to_coq_file: str, path_to_root_dir: str) -> str:
+    """
+    Hashes the contents of the file together with the _CoqProject
+    of the workspace, as the latter changes how the file is parsed.
+    """
+    hasher = hashlib.sha256()
+    with open(path_to_coq_file, "rb") as f:
+        hasher.update(f.read())
+    coq_project = os.path.join(path_to_root_dir, "_CoqProject")
+    hasher.update(b"\0")
+    if os.path.exists(coq_project):
+        with open(coq_project, "rb") as f:
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+def cache_path(path_to_coq_file: str, path_to_root_dir: str, suffix: str) -> str:
+    """
+    The path of a file kept for the Coq file in the .coq_llm_cache
+    folder of the workspace, ending with the suffix.
+    """
+    file_id = hashlib.sha256(os.path.abspath(path_to_coq_file).encode("utf-8")).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(path_to_coq_file))[0]
+    return os.path.join(path_to_root_dir, CACHE_DIR_NAME, f"{name}.{file_id}.{suffix}")
+
+
+def index_path(path_to_coq_file: str, path_to_root_dir: str) -> str:
+    return cache_path(path_to_coq_file, path_to_root_dir, "theorems.json")
+
+
+def load_theorems(
+    path_to_coq_file: str,
+    path_to_root_dir: str,
+    proof_view: Optional[ProofView] = None,
+    progress_bar: ProgressBar = None
+) -> Tuple[List[IndexedTheorem], Optional[ProofView]]:
+    """
+    Returns the theorems of the file: their names, statements,
+    ranges and proof texts, as ProofView.parse_file gives them.
+    They are saved as JSON to the .coq_llm_cache folder of the
+    workspace, keyed by the hash of the file and the _CoqProject,
+    so the file is elaborated through coq-lsp only when it has
+    changed. The index lives in the workspace and is only read
+    as data, it is never unpickled.
+    A ProofView is started only if the file has to be parsed;
+    it is returned along with the theorems (or the given one is),
+    so that the caller can reuse it.
+    """
+    key = file_key(path_to_coq_file, path_to_root_dir)
+    path = index_path(path_to_coq_file, path_to_root_dir)
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION and index.get("key") == key:
+                return [_theorem_from_json(entry) for entry in index["theorems"]], proof_view
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.info(f"Unable to load the theorem index {path}: {e}")
+
+    if proof_view is None:
+        proof_view = ProofView(path_to_coq_file, path_to_root_dir, prog_bar=progress_bar)
+    entries = [_theorem_to_json(theorem) for theorem in proof_view.parse_file()]
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so that a concurrent
+        # reader never sees a half-written index
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "key": key, "theorems": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.info(f"Unable to save the theorem index {path}: {e}")
+
+    # The same records are returned whether the index was
+    # loaded or built, so the parsed proof steps are dropped
+    return [_theorem_from_json(entry) for entry in entries], proof_view
@@ -0,0 +1,205 @@
+from typing import List, Dict, Callable, Optional, Set, Tuple
+from .parsed_file_cache import IndexedTheorem
+import threading
+import logging
+import math
+import re
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("PromptBudget")
+
+
+class TokenCounter:
+    def __init__(self, model: str = "gpt-3.5-turbo") -> None:
+        """
+        Counts tokens the way the model does. Uses the BPE
+        tokenizer of the model from tiktoken when it is installed
+        (it is an optional requirement, see README).
+        Otherwise falls back to an offline estimate: the text is
+        split with the pre-tokenization pattern of the GPT
+        tokenizers and every piece longer than 4 characters is
+        counted as several tokens. Counts are cached per text,
+        so every theorem is tokenized only once.
+
+        :param model: The model whose tokenizer should be used.
+        """
+        self.model = model
+        self.__cache: Dict[str, int] = {}
+        self.__lock = threading.Lock()
+        self.__encoding = None
+        try:
+            import tiktoken
+            self.__encoding = tiktoken.encoding_for_model(model)
+        except Exception as e:
+            logger.info(f"BPE tokenizer for {model} is not available ({e}), token counts are estimated.")
+
+    __pretokenize = re.compile(
+        r"""'s|'t|'re|'ve|'m|'ll|'d| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+(?!\S)|\s+"""
+    )
+
+    def __estimate(self, text: str) -> int:
+        tokens = 0
+        for piece in self.__pretokenize.findall(text):
+            tokens += max(1, math.ceil(len(piece.strip()) / 4)) if piece.strip() else 1
+        return tokens
+
+    def count(self, text: str) -> int:
+        with self.__lock:
+            cached = self.__cache.get(text)
+        if cached is not None:
+            return cached
+        if self.__encoding is not None:
+            tokens = len(self.__encoding.encode(text, disallowed_special=()))
+        else:
+            tokens = self.__estimate(text)
+        with self.__lock:
+            self.__cache[text] = tokens
+        return tokens
+
+    def count_theorem(self, theorem: IndexedTheorem) -> int:
+        """
+        Counts the tokens the theorem takes as a k-shot example:
+        the statement as the user message and the proof as the
+        assistant message.
+        """
+        proof = theorem.proof.only_text() if theorem.proof is not None else "Admitted."
+        return self.count(theorem.statement) + self.count(proof)
+
+
+_identifier = re.compile(r"[A-Za-z_][A-Za-z0-9_']*")
+
+
+def identifier_tokens(text: str) -> List[str]:
+    """
+    Returns the identifiers (including tactic names and
+    keywords) occurring in the text, in order and with
+    repetitions.
+    """
+    return _identifier.findall(text)
+
+
+def identifiers(text: str) -> Set[str]:
+    """
+    Returns the set of identifiers (including tactic
+    names and keywords) occurring in the text.
+    """
+    return set(identifier_tokens(text))
+
+
+def identifier_relevance(target_statements: List[str]) -> Callable[[IndexedTheorem], float]:
+    """
+    Returns a relevance score for train theorems: the share of
+    the identifiers of the target statements that also occur in
+    the train theorem. A small constant is added, so that when
+    nothing else differs more examples are still preferred.
+    """
+    target_identifiers = set()
+    for statement in target_statements:
+        target_identifiers |= identifiers(statement)
+
+    def relevance(theorem: IndexedTheorem) -> float:
+        if len(target_identifiers) == 0:
+            return 1.0
+        overlap = len(identifiers(theorem.statement) & target_identifiers)
+        return 0.1 + overlap / len(target_identifiers)
+
+    return relevance
+
+
+def select_train_theorems(
+    candidates: List[IndexedTheorem],
+    token_budget: int,
+    relevance: Callable[[IndexedTheorem], float],
+    token_counter: Optional[TokenCounter] = None,
+    max_table_size: int = 2_000_000
+) -> List[IndexedTheorem]:
+    """
+    Chooses the train theorems with the largest total relevance
+    whose k-shot examples fit into `token_budget` tokens, by
+    solving the 0/1 knapsack problem with dynamic programming.
+    If the table of `len(candidates) * token_budget` cells would
+    exceed `max_table_size`, token counts are rounded up to a
+    coarser unit, so the result still fits the budget.
+    Returns the chosen theorems in the order of `candidates`.
+    """
+    if token_budget <= 0 or len(candidates) == 0:
+        return []
+    token_counter = token_counter if token_counter is not None else TokenCounter()
+
+    unit = max(1, math.ceil(len(candidates) * token_budget / max_table_size))
+    capacity = token_budget // unit
+    weights = [math.ceil(token_counter.count_theorem(theorem) / unit) for theorem in candidates]
+    values = [relevance(theorem) for theorem in candidates]
+
+    best = [0.0] * (capacity + 1)
+    taken: List[bytearray] = []
+    for weight, value in zip(weights, values):
+        row = bytearray(capacity + 1)
+        if weight <= capacity:
+            for c in range(capacity, weight - 1, -1):
+                candidate_value = best[c - weight] + value
+                if candidate_value > best[c]:
+                    best[c] = candidate_value
+                    row[c] = 1
+        taken.append(row)
+
+    chosen = [False] * len(candidates)
+    c = capacity
+    for i in range(len(candidates) - 1, -1, -1):
+        if taken[i][c]:
+            chosen[i] = True
+            c -= weights[i]
+
+    return [theorem for theorem, is_chosen in zip(candidates, chosen) if is_chosen]
+
+
+def split_admitted_theorems(
+    all_theorems: List[IndexedTheorem],
+    gpt_token_limit: int,
+    system_message: str,
+    token_counter: Optional[TokenCounter] = None
+) -> Tuple[List[str], List[str]]:
+    """
+    Returns the names of the admitted theorems of the file and
+    the names of the solved theorems to use as train theorems.
+
+    When we send a request to gpt, it has an upper limit on the number of tokens.
+    Number of tokens in our case, as we make a request for a single theorem not continuing the
+    chat, will be system_message.size + all_theorems_statements_with_proofs.size + new_statement.size
+
+    When working with huge files, we cannot send all the solved theorems from the
+    file as "train" theorems, because we will reach the token limit. This is why we
+    choose the train theorems that are the most relevant to the admitted ones and
+    together fit into 90% of the limit, leaving space for the system message of the prompt
+    the theorems are sent with and the longest admitted statement.
+    """
+    token_counter = token_counter if token_counter is not None else TokenCounter()
+    admitted_theorems: List[str] = []
+    admitted_statements: List[str] = []
+    rest_theorems: List[IndexedTheorem] = []
+    admitted_theorems_max_tokens = 0
+
+    for theorem in all_theorems:
+        if theorem.proof is None:
+            continue
+
+        if theorem.proof.is_incomplete:
+            admitted_theorems_max_tokens = max(
+                admitted_theorems_max_tokens,
+                token_counter.count(theorem.statement)
+            )
+            admitted_theorems.append(theorem.name)
+            admitted_statements.append(theorem.statement)
+        else:
+            rest_theorems.append(theorem)
+
+    token_budget = (
+        int(0.9 * gpt_token_limit) - token_counter.count(system_message) - admitted_theorems_max_tokens
+    )
+    rest_theorems = select_train_theorems(
+        rest_theorems, token_budget,
+        identifier_relevance(admitted_statements),
+        token_counter=token_counter
+    )
+    return admitted_theorems, [theorem.name for theorem in rest_theorems]
@@ -0,0 +1,114 @@
+from .prompt_budget import TokenCounter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from collections import OrderedDict
+import threading
+import hashlib
+import json
+
+
+class PromptPayload:
+    def __init__(self, messages: Sequence[Dict[str, str]]) -> None:
+        """
+        The part of chat requests that many of them share: the
+        system message and the message history. It is built once
+        and not changed afterwards, so its JSON, hash and token
+        count are computed once too, and a request only appends
+        its message to it. The messages keep the order they are
+        given in (the examples in the order of the file), so all
+        the requests with the same payload start with the same
+        prefix and can hit the prompt cache of the provider.
+
+        :param messages: The system message and the history.
+        """
+        self.messages: Tuple[Dict[str, str], ...] = tuple(
+            {"role": message["role"], "content": message["content"]} for message in messages
+        )
+        self.serialized = json.dumps(list(self.messages), sort_keys=True, ensure_ascii=False)
+        self.hash = hashlib.sha256(self.serialized.encode("utf-8")).hexdigest()
+        self.__request_hasher = hashlib.sha256(
+            ('{"history": ' + self.serialized + ', "message": ').encode("utf-8")
+        )
+        self.__token_counts: Dict[Tuple[str, int], int] = {}
+        self.__lock = threading.Lock()
+
+    def request_messages(self, message: str) -> List[Dict[str, str]]:
+        return [*self.messages, {"role": "user", "content": message}]
+
+    def request_key(self, message: str, **fields: Any) -> str:
+        """
+        Returns the sha256 of the JSON of the request
+        {"history": <messages>, "message": message, **fields}
+        with sorted keys, without serializing the history
+        again. The names of the fields should come after
+        "message" in the sort order.
+        """
+        if any(name <= "message" for name in fields):
+            raise ValueError("The fields of a request key should sort after 'message'")
+        tail = json.dumps(message, ensure_ascii=False) + "".join(
+            f", {json.dumps(name)}: {json.dumps(value, ensure_ascii=False)}"
+            for name, value in sorted(fields.items())
+        ) + "}"
+        hasher = self.__request_hasher.copy()
+        hasher.update(tail.encode("utf-8"))
+        return hasher.hexdigest()
+
+    def count_tokens(self, token_counter: TokenCounter, per_message: int = 0) -> int:
+        """
+        The tokens in the contents of the messages, plus
+        `per_message` tokens of formatting for each of them.
+        """
+        key = (token_counter.model, per_message)
+        with self.__lock:
+            if key in self.__token_counts:
+                return self.__token_counts[key]
+        tokens = sum(token_counter.count(message["content"]) + per_message for message in self.messages)
+        with self.__lock:
+            self.__token_counts[key] = tokens
+        return tokens
+
+
+class PromptPayloadCache:
+    def __init__(self, max_size: int = 1024) -> None:
+        """
+        Keeps the payloads of the recent histories, so that
+        requests with the same history share one payload.
+        """
+        self.max_size = max_size
+        self.__payloads: "OrderedDict[Tuple[str, ...], PromptPayload]" = OrderedDict()
+        self.__default: Optional[PromptPayload] = None
+        self.__lock = threading.Lock()
+
+    def get(self, system_message: Dict[str, str], history: Sequence[Dict[str, str]]) -> PromptPayload:
+        key = (system_message["content"],) + tuple(
+            part for message in history for part in (message["role"], message["content"])
+        )
+        with self.__lock:
+            payload = self.__payloads.get(key)
+            if payload is not None:
+                self.__payloads.move_to_end(key)
+                return payload
+        payload = PromptPayload([system_message, *history])
+        with self.__lock:
+            self.__payloads[key] = payload
+            if len(self.__payloads) > self.max_size:
+                self.__payloads.popitem(last=False)
+        return payload
+
+    def for_request(
+        self, own_history: List[Dict[str, str]],
+        history: Optional[List[Dict[str, str]]] = None
+    ) -> PromptPayload:
+        """
+        The payload of a request made by an LLM interface with
+        the history `own_history` (the system message first),
+        given the history passed to the request, if any.
+        """
+        if history is not None:
+            if len(own_history) == 0:
+                return PromptPayload(history)
+            return self.get(own_history[0], history)
+        with self.__lock:
+            # The own history only grows, by send_message_for_response
+            if self.__default is None or len(self.__default.messages) != len(own_history):
+                self.__default = PromptPayload(own_history)
+            return self.__default
@@ -0,0 +1,113 @@
+from .disk_cache import DiskCache
+from .metrics_stream import error_class
+from typing import List, Optional, Tuple
+import hashlib
+import json
+import os
+import re
+
+# Failures that say nothing about the proof
+_transient_errors = ("timeout", "crash")
+_require = re.compile(r"(?:\bFrom\s+([\w.']+)\s+)?\bRequire(?:\s+(?:Import|Export))?\s+(.+?)\.(?=\s|$)", re.DOTALL)
+_load_path = re.compile(r"-[QR]\s+(\S+)\s+(\S+)")
+
+
+def _dependency_paths(root_dir: str, coq_project: str, context: str) -> List[str]:
+    """
+    The compiled files of the workspace that the context 
+    requires, found through the -Q and -R mappings of the 
+    _CoqProject. Libraries outside of it, e.g. the standard 
+    library, are not looked up.
+    """
+    mappings = [
+        (directory, "" if prefix == '""' else prefix)
+        for directory, prefix in _load_path.findall(coq_project)
+    ]
+    paths = []
+    for match in _require.finditer(context):
+        library, names = match.group(1), match.group(2).split()
+        for name in names:
+            full_name = f"{library}.{name}" if library is not None else name
+            for directory, prefix in mappings:
+                if prefix == "":
+                    relative = full_name
+                elif full_name.startswith(prefix + "."):
+                    relative = full_name[len(prefix) + 1:]
+                else:
+                    continue
+                path = os.path.join(root_dir, directory, *relative.split(".")) + ".vo"
+                if os.path.exists(path):
+                    paths.append(path)
+                    break
+    return sorted(set(paths))
+
+
+class ProofCheckCache:
+    def __init__(
+        self,
+        cache: Optional[DiskCache] = None,
+        cache_path: str = os.path.join("cache", "proof_checks.sqlite")
+    ) -> None:
+        """
+        A persistent cache of proof check results. A result is
+        stored under the hash of the context preceding the theorem,
+        the statement and the proof, with all whitespace runs in
+        the statement and the proof collapsed, so the same proof
+        with a different indentation is checked only once.
+        Failures caused by coq-lsp (timeouts and crashes) are
+        not stored, as checking the proof again may succeed.
+
+        :param cache: The cache to use. If None, a DiskCache at `cache_path` is opened.
+        :param cache_path: Path to the cache database.
+        """
+        self.cache = cache if cache is not None else DiskCache(cache_path)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", text).strip()
+
+    @staticmethod
+    def context_hash(root_dir: str, context: str) -> str:
+        """
+        Hashes the context the proofs are checked in. The root
+        directory and the _CoqProject are a part of it as they
+        define the load path, and so are the size and the
+        modification time of every compiled file of the
+        workspace the context requires.
+        """
+        hasher = hashlib.sha256()
+        hasher.update(os.path.abspath(root_dir).encode("utf-8"))
+        hasher.update(b"\0")
+        coq_project = ""
+        coq_project_path = os.path.join(root_dir, "_CoqProject")
+        if os.path.exists(coq_project_path):
+            with open(coq_project_path, "r", encoding="utf-8", errors="replace") as f:
+                coq_project = f.read()
+        hasher.update(coq_project.encode("utf-8"))
+        hasher.update(b"\0")
+        for path in _dependency_paths(root_dir, coq_project, context):
+            stat = os.stat(path)
+            hasher.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\0".encode("utf-8"))
+        hasher.update(b"\0")
+        hasher.update(context.encode("utf-8"))
+        return hasher.hexdigest()
+
+    def key(self, context_hash: str, thr_st: str, proof: str) -> str:
+        payload = "\0".join([context_hash, self.normalize(thr_st), self.normalize(proof)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[bool, str]]:
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        status, error_msg = json.loads(cached)
+        return status, error_msg
+
+    def put(self, key: str, result: Tuple[bool, str]) -> None:
+        status, error_msg = result
+        if not status and error_class(error_msg) in _transient_errors:
+            return
+        self.cache.put(key, json.dumps(list(result), ensure_ascii=False))
+
+    def close(self) -> None:
+        self.cache.close()
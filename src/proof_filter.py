@@ -0,0 +1,144 @@
+from .tactic_trie import split_sentences
+from typing import Dict, List, Optional, Tuple
+import threading
+import re
+
+
+REJECTION_PREFIX = "Rejected before checking: "
+
+_fence = re.compile(r"```[^\n`]*\n?(.*?)(?:```|$)", re.DOTALL)
+_proof_start = re.compile(r"(?<![\w'])Proof\.(?=\s|$)")
+_proof_end = re.compile(r"(?<![\w'])(?:Qed|Defined|Admitted|Abort)\.(?=\s|$)")
+_gives_up = re.compile(r"^(?:admit|give_up|Admitted|Abort)\b")
+_closing = {")": "(", "]": "["}
+
+
+def sanitize_proof(response: str) -> str:
+    """
+    Cuts the proof out of an LLM response: takes the first
+    Markdown code block if there is one, then drops what
+    comes before "Proof." (usually the theorem statement
+    repeated) and after the last Qed., Defined., Admitted.
+    or Abort. (usually an explanation).
+    """
+    text = response
+    fenced = _fence.search(text)
+    if fenced is not None:
+        text = fenced.group(1)
+    start = _proof_start.search(text)
+    if start is not None:
+        text = text[start.start():]
+    ends = list(_proof_end.finditer(text))
+    if len(ends) > 0:
+        text = text[:ends[-1].end()]
+    return text.strip()
+
+
+def _balanced_comments(proof: str) -> bool:
+    depth, i = 0, 0
+    while i < len(proof):
+        if proof.startswith("(*", i):
+            depth += 1
+            i += 2
+        elif proof.startswith("*)", i):
+            depth -= 1
+            if depth < 0:
+                return False
+            i += 2
+        else:
+            i += 1
+    return depth == 0
+
+
+def _balanced_brackets(sentence: str) -> bool:
+    # Strings are removed first, they may contain anything
+    stack = []
+    for char in re.sub(r'"[^"]*"', "", sentence):
+        if char in "([":
+            stack.append(char)
+        elif char in ")]":
+            if len(stack) == 0 or stack.pop() != _closing[char]:
+                return False
+    return len(stack) == 0
+
+
+def lint_proof(proof: str) -> Optional[str]:
+    """
+    Looks for the mistakes in a proof that make coq-lsp
+    reject it for sure. Returns the kind of the first
+    mistake found, None if the proof looks plausible.
+    """
+    if proof.strip() == "":
+        return "empty"
+    if not _balanced_comments(proof):
+        return "unbalanced_comment"
+    sentences = split_sentences(proof)
+    if len(sentences) == 0:
+        return "empty"
+    if any(_gives_up.match(sentence) for sentence in sentences):
+        return "gives_up"
+    if sentences[-1] not in ("Qed.", "Defined."):
+        return "no_qed"
+    if not all(_balanced_brackets(sentence) for sentence in sentences):
+        return "unbalanced_brackets"
+    depth = 0
+    for index, sentence in enumerate(sentences):
+        if sentence == "{":
+            depth += 1
+        elif sentence == "}":
+            depth -= 1
+            if depth < 0:
+                return "unbalanced_braces"
+        elif sentence.strip("-+*") == "":
+            following = sentences[index + 1] if index + 1 < len(sentences) else None
+            if following in (None, "}", "Qed.", "Defined."):
+                return "empty_bullet"
+    if depth != 0:
+        return "unbalanced_braces"
+    return None
+
+
+class ProofFilter:
+    def __init__(self) -> None:
+        """
+        A cheap local stage between the LLM and coq-lsp: the
+        responses are sanitized with `sanitize_proof` as they
+        arrive, and the proofs `lint_proof` finds a mistake in
+        are rejected instead of being sent to coq-lsp. Counts
+        what was changed and rejected. Thread safe.
+        """
+        self.__lock = threading.Lock()
+        self.__sanitized = 0
+        self.__linted = 0
+        self.__rejected: Dict[str, int] = {}
+
+    def sanitize(self, responses: List[str]) -> List[str]:
+        proofs = [sanitize_proof(response) for response in responses]
+        with self.__lock:
+            self.__sanitized += sum(1 for proof, response in zip(proofs, responses) if proof != response)
+        return proofs
+
+    def lint(self, proofs: List[str]) -> Dict[int, str]:
+        """
+        Returns the indexes of the rejected proofs
+        with the rejection messages.
+        """
+        rejected = {}
+        for index, proof in enumerate(proofs):
+            mistake = lint_proof(proof)
+            if mistake is not None:
+                rejected[index] = REJECTION_PREFIX + mistake
+        with self.__lock:
+            self.__linted += len(proofs)
+            for message in rejected.values():
+                mistake = message[len(REJECTION_PREFIX):]
+                self.__rejected[mistake] = self.__rejected.get(mistake, 0) + 1
+        return rejected
+
+    def stats(self) -> Tuple[int, int, Dict[str, int]]:
+        """
+        Returns the amount of responses changed by sanitizing,
+        the amount of proofs linted and the rejections by kind.
+        """
+        with self.__lock:
+            return self.__sanitized, self.__linted, dict(self.__rejected)
@@ -0,0 +1,195 @@
+from typing import List, Optional, Tuple, Callable
+from concurrent.futures import ThreadPoolExecutor, Future
+import threading
+import logging
+import queue
+import os
+from ..coqpylspclient import ProofView, ProofViewError
+from ..coqpylspclient.coqlspclient.progress_bar import ProgressBar
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("ProofViewPool")
+
+
+class ProofViewPoolError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+
+class ProofViewPool:
+    def __init__(
+        self,
+        path_to_coq_file: str,
+        path_to_root_dir: str,
+        size: Optional[int] = None,
+        progress_bar: ProgressBar = None,
+        retries: int = 1
+    ) -> None:
+        """
+        Keeps `size` pre-warmed ProofView instances (coq-lsp
+        sessions) for a single file and distributes proof
+        checks between them. By default one worker per core
+        is started.
+
+        A worker that raises anything but a ProofViewError while
+        checking is considered crashed: it is dropped, a replacement
+        is started in the background and the failed chunk is retried
+        on another worker up to `retries` times. The remaining
+        workers keep checking in the meantime.
+
+        :param path_to_coq_file: The file the sessions are opened for.
+        :param path_to_root_dir: The workspace folder with the _CoqProject.
+        :param size: The amount of workers. Defaults to os.cpu_count().
+        :param progress_bar: The progress bar passed to every ProofView.
+        :param retries: How many times a chunk is rerun after a crash.
+        """
+        self.coq_file = path_to_coq_file
+        self.root_dir = path_to_root_dir
+        self.size = size if size is not None else (os.cpu_count() or 1)
+        if self.size < 1:
+            raise ValueError("ProofViewPool size must be at least 1")
+        self.progress_bar = progress_bar
+        self.retries = retries
+
+        self.__idle: "queue.Queue[ProofView]" = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__alive = 0
+        self.__starting = 0
+        self.__closed = False
+        self.__executor = ThreadPoolExecutor(max_workers=self.size)
+
+        logger.info(f"Starting {self.size} ProofView workers for {self.coq_file}")
+        warm_up = ThreadPoolExecutor(max_workers=self.size)
+        with self.__lock:
+            self.__starting += self.size
+        for _ in range(self.size):
+            warm_up.submit(self.__spawn_worker)
+        warm_up.shutdown(wait=True)
+        if self.__alive == 0:
+            raise ProofViewPoolError(f"Unable to start any ProofView for {self.coq_file}")
+
+    def __spawn_worker(self) -> None:
+        try:
+            worker = ProofView(self.coq_file, self.root_dir, prog_bar=self.progress_bar)
+        except Exception as e:
+            logger.error(f"Failed to start a ProofView worker: {e}")
+            with self.__lock:
+                self.__starting -= 1
+            return
+
+        with self.__lock:
+            self.__starting -= 1
+            if self.__closed:
+                worker.exit()
+                return
+            self.__alive += 1
+        self.__idle.put(worker)
+
+    def __replace_worker(self, worker: ProofView) -> None:
+        with self.__lock:
+            self.__alive -= 1
+            self.__starting += 1
+            closed = self.__closed
+        try:
+            worker.exit()
+        except Exception:
+            pass
+        if closed:
+            with self.__lock:
+                self.__starting -= 1
+            return
+        logger.info("ProofView worker crashed, starting a replacement in the background")
+        threading.Thread(target=self.__spawn_worker, daemon=True).start()
+
+    def __acquire(self) -> ProofView:
+        while True:
+            try:
+                return self.__idle.get(timeout=0.5)
+            except queue.Empty:
+                with self.__lock:
+                    if self.__closed:
+                        raise ProofViewPoolError("ProofViewPool is closed")
+                    if self.__alive == 0 and self.__starting == 0:
+                        raise ProofViewPoolError("All ProofView workers have crashed")
+
+    def __run_on_worker(self, check: Callable[[ProofView], List[Tuple[bool, str]]]) -> List[Tuple[bool, str]]:
+        attempts = self.retries + 1
+        while True:
+            worker = self.__acquire()
+            try:
+                result = check(worker)
+            except ProofViewError as e:
+                # The session is fine, the request itself is not
+                self.__idle.put(worker)
+                raise e
+            except Exception as e:
+                attempts -= 1
+                self.__replace_worker(worker)
+                if attempts == 0:
+                    raise e
+                continue
+            self.__idle.put(worker)
+            return result
+
+    def check_proofs(
+        self,
+        context: str,
+        thr_st: str,
+        proofs: List[str]
+    ) -> List[Tuple[bool, str]]:
+        """
+        Checks the proofs of a single theorem by splitting
+        them into chunks, one per worker. Has the same
+        contract as ProofView.check_proofs and is safe
+        to call from several threads at once, so proofs
+        of different theorems can be checked in parallel.
+        """
+        if len(proofs) == 0:
+            return []
+        chunks_amount = min(len(proofs), self.size)
+        chunks = [proofs[i::chunks_amount] for i in range(chunks_amount)]
+        futures = [
+            self.__executor.submit(
+                self.__run_on_worker,
+                lambda worker, chunk=chunk: worker.check_proofs(context, thr_st, chunk)
+            )
+            for chunk in chunks
+        ]
+
+        result: List[Tuple[bool, str]] = [None] * len(proofs)
+        for chunk_index, future in enumerate(futures):
+            for i, check_result in enumerate(future.result()):
+                result[chunk_index + i * chunks_amount] = check_result
+        return result
+
+    def check_proof(self, thr_st: str, proof: str, context: str) -> Tuple[bool, str]:
+        """
+        Checks a single proof on the first idle worker.
+        """
+        return self.submit_proof_check(thr_st, proof, context).result()
+
+    def submit_proof_check(self, thr_st: str, proof: str, context: str) -> Future:
+        """
+        Schedules the check of a single proof and returns 
+        a Future with its (bool, str) result. Checks are 
+        started in the order they were submitted, a check 
+        that has not started yet may be cancelled.
+        """
+        return self.__executor.submit(
+            self.__run_on_worker,
+            lambda worker: worker.check_proofs(context, thr_st, [proof])[0]
+        )
+
+    def exit(self) -> None:
+        """
+        Stops all the workers.
+        """
+        with self.__lock:
+            self.__closed = True
+        self.__executor.shutdown(wait=True)
+        while True:
+            try:
+                self.__idle.get_nowait().exit()
+            except queue.Empty:
+                break
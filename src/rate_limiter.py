@@ -0,0 +1,165 @@
+from typing import Any, Dict, Optional
+from collections import deque
+import threading
+import hashlib
+import logging
+import random
+import time
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("RateLimiter")
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 60.0) -> float:
+    """
+    Exponential backoff with full jitter: a random delay between
+    zero and base_delay * 2^attempt, capped at max_delay. The
+    jitter keeps the clients that were throttled together from
+    retrying together.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: int = 3500, tokens_per_minute: int = 90000) -> None:
+        """
+        A client-side scheduler for the requests to a rate limited
+        API. Both limits are token buckets that hold up to a minute
+        worth of allowance and refill continuously. A request waits
+        in a FIFO queue until both buckets have enough allowance
+        for it. After a 429 response every request is held back
+        for the time the server asked for in Retry-After.
+        The limiter is thread safe, so it can be shared by all
+        the clients that use the same API key.
+
+        :param requests_per_minute: The RPM limit of the account.
+        :param tokens_per_minute: The TPM limit of the account.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.__request_allowance = float(requests_per_minute)
+        self.__token_allowance = float(tokens_per_minute)
+        self.__last_refill = time.monotonic()
+        self.__blocked_until = 0.0
+        self.__queue: deque = deque()
+        self.__condition = threading.Condition()
+
+        self.requests = 0
+        self.throttled_requests = 0
+        self.throttle_seconds = 0.0
+        self.rate_limited_responses = 0
+        self.max_queue_depth = 0
+
+    def __refill(self, now: float) -> None:
+        elapsed = now - self.__last_refill
+        self.__last_refill = now
+        self.__request_allowance = min(
+            float(self.requests_per_minute),
+            self.__request_allowance + elapsed * self.requests_per_minute / 60
+        )
+        self.__token_allowance = min(
+            float(self.tokens_per_minute),
+            self.__token_allowance + elapsed * self.tokens_per_minute / 60
+        )
+
+    def __time_to_wait(self, now: float, tokens: int) -> float:
+        return max(
+            0.0,
+            self.__blocked_until - now,
+            (1 - self.__request_allowance) * 60 / self.requests_per_minute,
+            (tokens - self.__token_allowance) * 60 / self.tokens_per_minute
+        )
+
+    def acquire(self, tokens: int) -> float:
+        """
+        Blocks until the request with the estimated amount of
+        tokens may be sent, and takes its allowance. Requests
+        are let through in the order they arrived. Returns the
+        time the request was held back for, in seconds.
+        """
+        # A request larger than the whole budget would wait forever
+        tokens = min(tokens, self.tokens_per_minute)
+        start_time = time.monotonic()
+        ticket = object()
+        with self.__condition:
+            self.__queue.append(ticket)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.__queue))
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.__refill(now)
+                    timeout = None
+                    if self.__queue[0] is ticket:
+                        timeout = self.__time_to_wait(now, tokens)
+                        if timeout <= 0:
+                            self.__request_allowance -= 1
+                            self.__token_allowance -= tokens
+                            break
+                    self.__condition.wait(timeout=timeout)
+            finally:
+                self.__queue.remove(ticket)
+                self.__condition.notify_all()
+
+            throttled = time.monotonic() - start_time
+            self.requests += 1
+            if throttled > 0.001:
+                self.throttled_requests += 1
+                self.throttle_seconds += throttled
+        return throttled
+
+    def reconcile(self, estimated_tokens: int, used_tokens: int) -> None:
+        """
+        Corrects the token allowance once the real usage
+        of a request is known.
+        """
+        with self.__condition:
+            self.__token_allowance -= used_tokens - min(estimated_tokens, self.tokens_per_minute)
+            self.__condition.notify_all()
+
+    def on_rate_limited(self, retry_after: Optional[float]) -> None:
+        """
+        Registers a 429 response. If the server said when to
+        retry, no request is let through before that time.
+        """
+        with self.__condition:
+            self.rate_limited_responses += 1
+            if retry_after is not None:
+                self.__blocked_until = max(self.__blocked_until, time.monotonic() + retry_after)
+            self.__condition.notify_all()
+
+    def queue_depth(self) -> int:
+        with self.__condition:
+            return len(self.__queue)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.__condition:
+            return {
+                "requests": self.requests,
+                "queue_depth": len(self.__queue),
+                "max_queue_depth": self.max_queue_depth,
+                "throttled_requests": self.throttled_requests,
+                "throttle_seconds": self.throttle_seconds,
+                "rate_limited_responses": self.rate_limited_responses,
+            }
+
+
+_shared_limiters: Dict[str, RateLimiter] = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(
+    api_key: str,
+    requests_per_minute: int = 3500,
+    tokens_per_minute: int = 90000
+) -> RateLimiter:
+    """
+    Returns the limiter shared by all the clients in the process
+    that use the API key, as the limits are set per account.
+    The limits are taken from the first call for the key.
+    """
+    key = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    with _shared_limiters_lock:
+        if key not in _shared_limiters:
+            _shared_limiters[key] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return _shared_limiters[key]
@@ -0,0 +1,126 @@
+from .llm_interface import LLMInterface
+from .llm_prompt_interface import LLMPromptInterface
+from typing import List, Dict, Optional
+import threading
+import logging
+import json
+import time
+import re
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("ReplayLLM")
+
+_theorem_name = re.compile(
+    r"^\s*(?:Theorem|Lemma|Example|Corollary|Proposition|Fact|Remark)\s+([^\s:(]+)"
+)
+
+
+class ReplayLLMError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+
+def theorem_name(statement: str) -> Optional[str]:
+    match = _theorem_name.match(statement)
+    return match.group(1) if match is not None else None
+
+
+class ReplayLLM(LLMInterface):
+    def __init__(self, recordings_path: str, latency: float = 0.0) -> None:
+        """
+        A deterministic LLM that serves recorded completions, so
+        that runs can be repeated and timed without the network.
+        The recordings are a json object that maps theorem names
+        to the list of completions recorded for them. A request
+        for n choices gets the first n completions, cycled if
+        fewer were recorded.
+
+        :param recordings_path: Path to the json file with the recordings.
+        :param latency: Seconds every request takes, to emulate a real LLM.
+        """
+        with open(recordings_path, "r") as f:
+            self.recordings: Dict[str, List[str]] = json.load(f)
+        self.latency = latency
+        self.history = []
+        self.model = "replay"
+        self.requests = 0
+
+    def init_history(self, llm_prompt: LLMPromptInterface) -> None:
+        self.history.append({"role": "system", "content": llm_prompt.get_system_message()})
+        self.history.extend(llm_prompt.get_msg_history())
+
+    def send_message_for_response(self, message: str, choices: int = 1) -> List[str]:
+        responses = self.send_message_wout_history_change(message, choices=choices)
+        self.history.append({"role": "user", "content": message})
+        self.history.append({"role": "assistant", "content": responses[0]})
+        return responses
+
+    def send_message_wout_history_change(
+        self, message: str, choices: int = 1,
+        history: Optional[List[Dict[str, str]]] = None,
+        temperature: Optional[float] = None
+    ) -> List[str]:
+        name = theorem_name(message)
+        completions = self.recordings.get(name) if name is not None else None
+        if not completions:
+            raise ReplayLLMError(f"No completions were recorded for {name or message!r}")
+        self.requests += 1
+        time.sleep(self.latency)
+        return [completions[i % len(completions)] for i in range(choices)]
+
+
+class RecordingLLM(LLMInterface):
+    def __init__(self, llm_interface: LLMInterface, recordings_path: str) -> None:
+        """
+        Passes the requests to a live LLM and stores the completions
+        in the format ReplayLLM reads, so that a run can be recorded
+        once and then replayed in benchmarks.
+
+        :param llm_interface: The LLM to record.
+        :param recordings_path: Path to the json file with the recordings,
+            new completions are added to the existing ones.
+        """
+        self.llm_interface = llm_interface
+        self.recordings_path = recordings_path
+        self.recordings: Dict[str, List[str]] = {}
+        if os.path.exists(recordings_path):
+            with open(recordings_path, "r") as f:
+                self.recordings = json.load(f)
+        self.__lock = threading.Lock()
+
+    def init_history(self, llm_prompt: LLMPromptInterface) -> None:
+        self.llm_interface.init_history(llm_prompt)
+
+    def __record(self, message: str, responses: List[str]) -> None:
+        name = theorem_name(message)
+        if name is None:
+            return
+        with self.__lock:
+            recorded = self.recordings.setdefault(name, [])
+            recorded.extend(response for response in responses if response not in recorded)
+            with open(self.recordings_path, "w") as f:
+                json.dump(self.recordings, f, indent=2, ensure_ascii=False)
+
+    def send_message_for_response(self, message: str, choices: int = 1) -> List[str]:
+        responses = self.llm_interface.send_message_for_response(message, choices=choices)
+        self.__record(message, responses)
+        return responses
+
+    def send_message_wout_history_change(
+        self, message: str, choices: int = 1,
+        history: Optional[List[Dict[str, str]]] = None,
+        temperature: Optional[float] = None
+    ) -> List[str]:
+        responses = self.llm_interface.send_message_wout_history_change(
+            message, choices=choices, history=history, temperature=temperature
+        )
+        self.__record(message, responses)
+        return responses
+
+    def last_request_cached(self) -> bool:
+        return self.llm_interface.last_request_cached()
+
+    def refresh_next_request(self) -> None:
+        self.llm_interface.refresh_next_request()
@@ -0,0 +1,176 @@
+from typing import List, Dict, Tuple, Optional
+from .theorem_store import TheoremStore
+from .prompt_budget import identifiers, identifier_tokens
+from .parsed_file_cache import cache_path
+import numpy as np
+import hashlib
+import logging
+import re
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("RetrievalIndex")
+
+_sentence_end = re.compile(r"\.(?:\s|$)")
+
+
+class TheoremRetrievalIndex:
+    def __init__(
+        self,
+        names: List[str],
+        vocabulary: List[str],
+        idf: np.ndarray,
+        rows: np.ndarray,
+        columns: np.ndarray,
+        weights: np.ndarray
+    ) -> None:
+        """
+        A TF-IDF index over theorems. A theorem is described by the
+        identifiers of its statement and the tactics of its proof.
+        The L2-normalized TF-IDF vectors of the theorems are stored
+        as a sparse matrix in the coordinate format, so the cosine
+        similarity with a query is computed for all the theorems
+        at once with a couple of vectorized operations.
+
+        :param names: Names of the indexed theorems, one per row.
+        :param vocabulary: The terms, one per column.
+        :param idf: Inverse document frequencies of the terms.
+        :param rows: Row indexes of the non-zero weights.
+        :param columns: Column indexes of the non-zero weights.
+        :param weights: The non-zero normalized TF-IDF weights.
+        """
+        self.names = names
+        self.vocabulary = vocabulary
+        self.term_indexes = {term: i for i, term in enumerate(vocabulary)}
+        self.idf = idf
+        self.rows = rows
+        self.columns = columns
+        self.weights = weights
+
+    @staticmethod
+    def theorem_terms(statement: str, proof: Optional[str]) -> List[str]:
+        terms = list(identifiers(statement))
+        if proof is not None:
+            for sentence in _sentence_end.split(proof):
+                words = identifier_tokens(sentence)
+                if len(words) > 0 and words[0] not in ("Proof", "Qed", "Defined"):
+                    terms.append(f"tactic:{words[0]}")
+        return terms
+
+    @staticmethod
+    def build(theorems: TheoremStore, thr_ids: List[int]) -> "TheoremRetrievalIndex":
+        documents = [
+            TheoremRetrievalIndex.theorem_terms(theorems.statement(thr_id), theorems.proof(thr_id))
+            for thr_id in thr_ids
+        ]
+        vocabulary = sorted({term for document in documents for term in document})
+        term_indexes = {term: i for i, term in enumerate(vocabulary)}
+
+        rows: List[int] = []
+        columns: List[int] = []
+        counts: List[int] = []
+        for row, document in enumerate(documents):
+            term_counts: Dict[int, int] = {}
+            for term in document:
+                column = term_indexes[term]
+                term_counts[column] = term_counts.get(column, 0) + 1
+            for column, count in sorted(term_counts.items()):
+                rows.append(row)
+                columns.append(column)
+                counts.append(count)
+
+        rows_array = np.array(rows, dtype=np.int32)
+        columns_array = np.array(columns, dtype=np.int32)
+        document_frequency = np.bincount(columns_array, minlength=len(vocabulary))
+        idf = (np.log((1 + len(documents)) / (1 + document_frequency)) + 1).astype(np.float32)
+        weights = (np.log1p(np.array(counts, dtype=np.float32)) * idf[columns_array]).astype(np.float32)
+        norms = np.sqrt(np.bincount(rows_array, weights=weights ** 2, minlength=len(documents)))
+        weights = (weights / np.where(norms == 0, 1, norms)[rows_array]).astype(np.float32)
+
+        return TheoremRetrievalIndex(
+            [theorems.name(thr_id) for thr_id in thr_ids], vocabulary, 
+            idf, rows_array, columns_array, weights
+        )
+
+    def query(self, statement: str) -> List[Tuple[str, float]]:
+        """
+        Returns the names of the indexed theorems with their
+        similarity to the statement, the most similar first.
+        """
+        if len(self.names) == 0:
+            return []
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for term in identifiers(statement):
+            index = self.term_indexes.get(term)
+            if index is not None:
+                vector[index] += 1
+        vector = np.log1p(vector) * self.idf
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+
+        scores = np.bincount(
+            self.rows, weights=self.weights * vector[self.columns], 
+            minlength=len(self.names)
+        )
+        # Stable sort keeps the file order among equal scores
+        order = np.argsort(-scores, kind="stable")
+        return [(self.names[i], float(scores[i])) for i in order]
+
+    def save(self, path: str, key: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(
+                f, key=np.array(key), names=np.array(self.names, dtype=str),
+                vocabulary=np.array(self.vocabulary, dtype=str),
+                idf=self.idf, rows=self.rows, columns=self.columns, weights=self.weights
+            )
+
+    @staticmethod
+    def load(path: str, key: str) -> Optional["TheoremRetrievalIndex"]:
+        """
+        Loads the index saved at the path if it was built
+        for the same key, otherwise returns None.
+        """
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if str(data["key"]) != key:
+                    return None
+                return TheoremRetrievalIndex(
+                    [str(name) for name in data["names"]],
+                    [str(term) for term in data["vocabulary"]],
+                    data["idf"], data["rows"], data["columns"], data["weights"]
+                )
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def load_or_build_retrieval_index(
+    path_to_coq_file: str,
+    path_to_root_dir: str,
+    file_text: str,
+    theorems: TheoremStore,
+    thr_ids: List[int]
+) -> TheoremRetrievalIndex:
+    """
+    Returns the retrieval index over the theorems of the file.
+    The index is persisted to the .coq_llm_cache folder of the
+    workspace and is rebuilt only when the file or the set of
+    indexed theorems changes.
+    """
+    hasher = hashlib.sha256(file_text.encode("utf-8"))
+    for thr_id in thr_ids:
+        hasher.update(b"\0" + theorems.name(thr_id).encode("utf-8"))
+    key = hasher.hexdigest()
+    index_path = cache_path(path_to_coq_file, path_to_root_dir, "retrieval.npz")
+
+    index = TheoremRetrievalIndex.load(index_path, key) if os.path.exists(index_path) else None
+    if index is None:
+        logger.info(f"Building the retrieval index for {path_to_coq_file}")
+        index = TheoremRetrievalIndex.build(theorems, thr_ids)
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            index.save(index_path, key)
+        except OSError as e:
+            logger.info(f"Unable to save the retrieval index to {index_path}: {e}")
+    return index
@@ -0,0 +1,45 @@
+from .batch_solver import BatchSolver
+from .gpt35 import GPT35
+import sys
+
+"""
+Path to the workspace folder with the _CoqProject. Every .v file
+inside of it is searched for admitted theorems.
+"""
+path_to_root_dir: str = sys.argv[1]
+
+"""
+The key of the OpenAI API and the number of attempts to solve a single theorem.
+"""
+openai_api_key = sys.argv[2]
+number_of_shots = int(sys.argv[3])
+
+"""
+The number of LLM requests and the number of proof checks 
+that are allowed to run at the same time.
+"""
+max_llm_requests = int(sys.argv[4])
+max_proof_checkers = int(sys.argv[5])
+
+"""
+Folder to write the patched files to. If equal to "INPLACE", 
+the files of the workspace are patched in place.
+"""
+output_dir = sys.argv[6] if sys.argv[6] != "INPLACE" else None
+
+"""
+Path to the json file with the summary report.
+"""
+report_path: str = sys.argv[7]
+
+solver = BatchSolver(
+    path_to_root_dir, lambda: GPT35(openai_api_key), 
+    shots=number_of_shots, 
+    max_llm_requests=max_llm_requests, 
+    max_proof_checkers=max_proof_checkers
+)
+
+summary = solver.run()
+solver.stop()
+summary["patched_files"] = solver.write_patched_files(output_dir)
+BatchSolver.write_report(summary, report_path)
@@ -1,4 +1,4 @@
-from .interactor import Interactor
+from .interactor import Interactor, RunOptions
 from .gpt35 import GPT35
 from .coq_llm_prompt import CoqPromptSingleTheorem
 from ..coqpylspclient.coqlspclient.progress_bar import StdoutProgressBar
@@ -63,6 +63,6 @@ interactor = Interactor(
     is_silent=True, logging_setup=logging_setup
 )
 
-interactor.run(shots=number_of_shots)
+interactor.run(RunOptions(shots=number_of_shots))
 
 llm_prompt.stop()
\ No newline at end of file
@@ -0,0 +1,61 @@
+from typing import Any, Dict, List
+import threading
+import logging
+import json
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("RunJournal")
+
+
+class RunJournal:
+    def __init__(self, path: str) -> None:
+        """
+        A write-ahead journal of finished work: an append-only
+        file with one JSON entry per line. Every entry is flushed
+        and synced to disk before `record` returns, so after a
+        crash the journal holds everything that was finished.
+        A partially written last line is ignored on load.
+
+        :param path: Path to the journal, created if missing.
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.__lock = threading.Lock()
+        # Terminate a line left half-written by a crash, 
+        # so that new entries start on a line of their own
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+    def entries(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, "r") as f:
+            for line_number, line in enumerate(f):
+                if line.strip() == "":
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.info(f"Skipping a broken entry on line {line_number + 1} of {self.path}")
+        return entries
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.__lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def clear(self) -> None:
+        with self.__lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,234 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+
+# Checks a batch of proofs of one theorem in one context
+CheckFunction = Callable[[List[str]], List[Tuple[bool, str]]]
+
+_proof_ends = ("Qed.", "Defined.", "Admitted.", "Abort.")
+
+
+def split_sentences(proof: str) -> List[str]:
+    """
+    Splits a proof into its Coq sentences: the tactics, each
+    ending with a period followed by a space, and the bullets
+    and braces that focus goals. Comments are dropped and runs
+    of whitespace outside of strings are collapsed, so proofs
+    that only differ in layout have the same sentences.
+    """
+    sentences = []
+    current: List[str] = []
+    i, n = 0, len(proof)
+    while i < n:
+        char = proof[i]
+        if proof.startswith("(*", i):
+            depth = 0
+            while i < n:
+                if proof.startswith("(*", i):
+                    depth += 1
+                    i += 2
+                elif proof.startswith("*)", i):
+                    depth -= 1
+                    i += 2
+                    if depth == 0:
+                        break
+                else:
+                    i += 1
+            continue
+        if char.isspace():
+            if current and current[-1] != " ":
+                current.append(" ")
+            i += 1
+            continue
+        if not current:
+            # Bullets and braces are sentences of their own
+            if char in "{}":
+                sentences.append(char)
+                i += 1
+                continue
+            if char in "-+*":
+                j = i
+                while j < n and proof[j] == char:
+                    j += 1
+                sentences.append(proof[i:j])
+                i = j
+                continue
+        if char == '"':
+            j = proof.find('"', i + 1)
+            j = n - 1 if j == -1 else j
+            current.append(proof[i:j + 1])
+            i = j + 1
+            continue
+        current.append(char)
+        i += 1
+        if char == "." and (i == n or proof[i].isspace()):
+            sentences.append("".join(current).strip())
+            current = []
+    rest = "".join(current).strip()
+    if rest:
+        sentences.append(rest)
+    return sentences
+
+
+class _TrieNode:
+    def __init__(self, depth: int) -> None:
+        self.depth = depth
+        self.children: Dict[str, "_TrieNode"] = {}
+        # Variants that end here and that pass through here
+        self.ends: List[int] = []
+        self.variants: List[int] = []
+
+
+class PrefixSharingVerifier:
+    def __init__(self, min_shared: int = 2, locate_errors: bool = False) -> None:
+        """
+        Checks candidate proofs of a theorem so that the tactics
+        they share are checked once. The candidates are split
+        into sentences and put into a trie. Every prefix shared
+        by at least `min_shared` distinct candidates is checked
+        first, closed with Admitted. If it fails, all the
+        candidates that share it fail with its error and none
+        of them is checked; otherwise the candidates are split
+        where they diverge and the same is done for each part.
+        The trie is walked level by level, with all the checks
+        of a level sent as one batch. Candidates that only
+        differ in layout or comments are checked once.
+
+        The error message of a failed candidate ends with the
+        first failing tactic when it is known: when only one
+        sentence was left unchecked before the failure, or, with
+        `locate_errors` set, when a shared prefix failed, in
+        which case the tactic is found by bisecting the prefix.
+
+        :param min_shared: How many distinct candidates should
+            share a prefix for it to be checked on its own.
+        :param locate_errors: Whether to bisect failed shared
+            prefixes to find the first failing tactic. It takes
+            extra checks, so it is off by default.
+        """
+        self.min_shared = min_shared
+        self.locate_errors = locate_errors
+        self.__lock = threading.Lock()
+        self.__candidates = 0
+        self.__checks = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        The amount of distinct candidates verified so far
+        and the amount of checks it took.
+        """
+        with self.__lock:
+            return {"candidates": self.__candidates, "checks": self.__checks}
+
+    @staticmethod
+    def __probe(sentences: List[str]) -> str:
+        return " ".join(sentences + ["Admitted."])
+
+    @staticmethod
+    def __with_tactic(error_msg: str, tactic: Optional[str]) -> str:
+        if tactic is None:
+            return error_msg
+        return f"{error_msg}\nFirst failing tactic: {tactic}"
+
+    def __checked(self, check: CheckFunction, proofs: List[str]) -> List[Tuple[bool, str]]:
+        if len(proofs) == 0:
+            return []
+        with self.__lock:
+            self.__checks += len(proofs)
+        return check(proofs)
+
+    def __locate(
+        self, check: CheckFunction, sentences: List[str],
+        passed_depth: int, failed_depth: int
+    ) -> str:
+        """
+        Bisects the prefixes between a passing and a failing one
+        and returns the sentence that makes the prefix fail.
+        """
+        while failed_depth - passed_depth > 1:
+            middle = (passed_depth + failed_depth) // 2
+            status, _ = self.__checked(check, [self.__probe(sentences[:middle])])[0]
+            if status:
+                passed_depth = middle
+            else:
+                failed_depth = middle
+        return sentences[failed_depth - 1]
+
+    def verify(self, check: CheckFunction, proofs: List[str]) -> List[Tuple[bool, str]]:
+        """
+        Returns the (bool, str) check result of every proof,
+        as `check(proofs)` would.
+        """
+        variants: List[List[str]] = []
+        variant_proofs: List[str] = []
+        variant_of: List[int] = []
+        index_of: Dict[Tuple[str, ...], int] = {}
+        for proof in proofs:
+            sentences = split_sentences(proof)
+            key = tuple(sentences)
+            if key not in index_of:
+                index_of[key] = len(variants)
+                variants.append(sentences)
+                variant_proofs.append(proof)
+            variant_of.append(index_of[key])
+        with self.__lock:
+            self.__candidates += len(variants)
+
+        root = _TrieNode(0)
+        for variant_ind, sentences in enumerate(variants):
+            node = root
+            node.variants.append(variant_ind)
+            for sentence in sentences:
+                if sentence not in node.children:
+                    node.children[sentence] = _TrieNode(node.depth + 1)
+                node = node.children[sentence]
+                node.variants.append(variant_ind)
+            node.ends.append(variant_ind)
+
+        results: Dict[int, Tuple[bool, str]] = {}
+        # Nodes to split and candidates to check, with the 
+        # depth of the longest prefix known to pass
+        level: List[Tuple[_TrieNode, int]] = [(root, 0)]
+        leaves: List[Tuple[int, int]] = []
+        while len(level) > 0 or len(leaves) > 0:
+            probes: List[Tuple[_TrieNode, int]] = []
+            next_level: List[Tuple[_TrieNode, int]] = []
+            next_leaves: List[Tuple[int, int]] = []
+            for node, passed_depth in level:
+                # Walk down to where the candidates diverge
+                while len(node.children) == 1 and len(node.ends) == 0:
+                    node = next(iter(node.children.values()))
+                shared = variants[node.variants[0]][passed_depth:node.depth]
+                if len(node.variants) < self.min_shared or any(sentence in _proof_ends for sentence in shared):
+                    leaves.extend((variant_ind, passed_depth) for variant_ind in node.variants)
+                elif all(sentence == "Proof." for sentence in shared):
+                    # Nothing that may fail in the shared prefix
+                    leaves.extend((variant_ind, node.depth) for variant_ind in node.ends)
+                    next_level.extend((child, node.depth) for child in node.children.values())
+                else:
+                    probes.append((node, passed_depth))
+
+            checked = self.__checked(
+                check,
+                [self.__probe(variants[node.variants[0]][:node.depth]) for node, _ in probes]
+                + [variant_proofs[variant_ind] for variant_ind, _ in leaves]
+            )
+            for (node, passed_depth), (status, error_msg) in zip(probes, checked):
+                if status:
+                    next_leaves.extend((variant_ind, node.depth) for variant_ind in node.ends)
+                    next_level.extend((child, node.depth) for child in node.children.values())
+                    continue
+                sentences = variants[node.variants[0]]
+                tactic = None
+                if node.depth - passed_depth == 1:
+                    tactic = sentences[node.depth - 1]
+                elif self.locate_errors:
+                    tactic = self.__locate(check, sentences, passed_depth, node.depth)
+                for variant_ind in node.variants:
+                    results[variant_ind] = (False, self.__with_tactic(error_msg, tactic))
+            for (variant_ind, passed_depth), (status, error_msg) in zip(leaves, checked[len(probes):]):
+                sentences = variants[variant_ind]
+                tactic = sentences[-1] if not status and len(sentences) - passed_depth == 1 else None
+                results[variant_ind] = (status, error_msg if status else self.__with_tactic(error_msg, tactic))
+            level, leaves = next_level, next_leaves
+
+        return [results[variant_ind] for variant_ind in variant_of]
@@ -0,0 +1,166 @@
+from typing import Dict, Iterable, Iterator, List, Optional
+from ..coqpylspclient import Range, Position
+from .parsed_file_cache import IndexedTheorem
+from .coq_file_contents import CoqFileContents
+import sys
+
+
+class TheoremRecord:
+    # Records are kept for every theorem of the file,
+    # so they have no __dict__
+    __slots__ = (
+        "id", "name", "statement_start", "statement_end", "proof_start", "proof_end",
+        "start_line", "start_character", "end_line", "end_character", "is_incomplete"
+    )
+
+    def __init__(
+        self, id: int, name: str,
+        statement_start: int, statement_end: int,
+        proof_start: int, proof_end: int,
+        start_line: int, start_character: int,
+        end_line: int, end_character: int,
+        is_incomplete: bool
+    ) -> None:
+        self.id = id
+        self.name = name
+        self.statement_start = statement_start
+        self.statement_end = statement_end
+        self.proof_start = proof_start
+        self.proof_end = proof_end
+        self.start_line = start_line
+        self.start_character = start_character
+        self.end_line = end_line
+        self.end_character = end_character
+        self.is_incomplete = is_incomplete
+
+    @property
+    def has_proof(self) -> bool:
+        return self.proof_start >= 0
+
+
+class TheoremStore:
+    def __init__(self, file_contents: CoqFileContents, theorems: List[IndexedTheorem]) -> None:
+        """
+        The statements, proofs and ranges of the theorems of a file,
+        without a copy of their text. A theorem is a `TheoremRecord`
+        whose id is its index in the file, and its statement and proof
+        are spans of the text of the file, which is shared with the
+        `CoqFileContents`. A text that is not found where the theorem
+        is in the file (e.g. a proof normalized by the parser) is
+        appended to a second buffer instead, once. The given theorems
+        are not referenced afterwards, so the memory they take can
+        be freed.
+
+        :param file_contents: The contents of the file.
+        :param theorems: The theorems of the file, from load_theorems.
+        """
+        self.text = file_contents.text
+        self.records: List[TheoremRecord] = []
+        extra: List[str] = []
+        extra_length = 0
+        # Statements are looked up by hash, the colliding
+        # ones are kept in a dict of their own
+        self.__by_hash: Dict[int, int] = {}
+        self.__colliding: Dict[str, int] = {}
+
+        def span(piece: str, lower: int, upper: int) -> int:
+            nonlocal extra_length
+            start = self.text.find(piece, lower, upper)
+            if start >= 0:
+                return start
+            extra.append(piece)
+            extra_length += len(piece)
+            return len(self.text) + extra_length - len(piece)
+
+        for theorem in theorems:
+            statement_range = theorem.statement_range
+            proof = theorem.proof
+            statement_start = file_contents.offset(statement_range.start)
+            statement_end = file_contents.offset(statement_range.end)
+            end = statement_range.end if proof is None else proof.end_pos.end
+            # The statement may be found up to the end of the proof
+            upper = file_contents.offset(end) if proof is not None else statement_end
+            start = span(theorem.statement, statement_start, upper)
+            proof_start, proof_end = -1, -1
+            if proof is not None:
+                proof_text = proof.only_text()
+                proof_start = span(proof_text, statement_end, upper)
+                proof_end = proof_start + len(proof_text)
+
+            record = TheoremRecord(
+                len(self.records), sys.intern(theorem.name),
+                start, start + len(theorem.statement), proof_start, proof_end,
+                statement_range.start.line, statement_range.start.character,
+                end.line, end.character,
+                proof is not None and proof.is_incomplete
+            )
+            self.records.append(record)
+            self.__index(record)
+
+        self.extra = "".join(extra)
+
+    def __index(self, record: TheoremRecord) -> None:
+        key = hash(self.__slice(record.statement_start, record.statement_end))
+        other = self.__by_hash.get(key)
+        if other is None or self.statement(other) == self.statement(record.id):
+            # A later theorem with the same statement takes its place
+            self.__by_hash[key] = record.id
+        else:
+            self.__colliding[self.statement(record.id)] = record.id
+
+    def __slice(self, start: int, end: int) -> str:
+        if start < len(self.text):
+            return self.text[start:end]
+        return self.extra[start - len(self.text):end - len(self.text)]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[TheoremRecord]:
+        return iter(self.records)
+
+    def name(self, thr_id: int) -> str:
+        return self.records[thr_id].name
+
+    def statement(self, thr_id: int) -> str:
+        record = self.records[thr_id]
+        return self.__slice(record.statement_start, record.statement_end)
+
+    def proof(self, thr_id: int) -> Optional[str]:
+        """
+        The text of the proof, None if the theorem has none.
+        """
+        record = self.records[thr_id]
+        if not record.has_proof:
+            return None
+        return self.__slice(record.proof_start, record.proof_end)
+
+    def range(self, thr_id: int) -> Range:
+        """
+        The range of the theorem in the file, from the start
+        of the statement to the end of the proof.
+        """
+        record = self.records[thr_id]
+        return Range(
+            start=Position(record.start_line, record.start_character),
+            end=Position(record.end_line, record.end_character)
+        )
+
+    def id_of(self, statement: str) -> int:
+        """
+        Returns the id of the theorem with the statement, of the
+        last one if there are several. Raises KeyError if none.
+        """
+        if statement in self.__colliding:
+            return self.__colliding[statement]
+        thr_id = self.__by_hash.get(hash(statement))
+        if thr_id is None or self.statement(thr_id) != statement:
+            raise KeyError(statement)
+        return thr_id
+
+    def ids_with_names(self, names: Iterable[str]) -> List[int]:
+        """
+        The ids of the theorems with the given names, in file order.
+        """
+        names = set(names)
+        return [record.id for record in self.records if record.name in names]